@@ -0,0 +1,359 @@
+"""Worker process side of the code execution sandbox.
+
+Workers are spawned by `ExecutionPool` in server.py. Each one imports the
+analysis libraries once, applies its resource limits and then runs generated
+code jobs received over a pipe until it is told to stop or is recycled.
+DataFrames arrive as Arrow IPC files in shared memory (/dev/shm), which the
+worker memory-maps instead of unpickling a copy.
+"""
+import base64
+import io
+import json
+import time
+from collections import OrderedDict
+from contextlib import redirect_stdout, redirect_stderr
+from typing import Any, Dict, Optional
+
+import matplotlib
+matplotlib.use('Agg')  # Use non-interactive backend
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+import plotly.io as pio
+import pyarrow as pa
+import seaborn as sns
+from plotly.utils import PlotlyJSONEncoder
+
+pd.set_option('mode.copy_on_write', True)
+
+# Frames most recently loaded by this worker, keyed by shared file path
+_frames: "OrderedDict[str, pd.DataFrame]" = OrderedDict()
+_MAX_FRAMES = 2
+
+
+def _apply_memory_limit(memory_limit_mb: int) -> None:
+    if memory_limit_mb <= 0:
+        return
+    try:
+        import resource
+    except ImportError:  # Not available on Windows
+        return
+    limit = memory_limit_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def load_frame(path: str) -> pd.DataFrame:
+    """Load a shared Arrow IPC file, reusing this worker's copy if it has one"""
+    df = _frames.get(path)
+    if df is None:
+        with pa.memory_map(path) as source:
+            df = pa.ipc.open_file(source).read_all().to_pandas()
+        _frames[path] = df
+        while len(_frames) > _MAX_FRAMES:
+            _frames.popitem(last=False)
+    else:
+        _frames.move_to_end(path)
+    return df.copy(deep=False)
+
+
+def _status_bytes(field: str) -> Optional[int]:
+    """A memory figure from /proc/self/status (Linux only)"""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+class ResourceMeter:
+    """Wall time, CPU time and peak memory growth of a `with` block.
+
+    Peak memory is how far the process's peak RSS rose above its RSS at
+    the start; the high-water mark is reset first, so this needs Linux
+    and is None elsewhere. Resetting it disturbs any other measurement in
+    the process, so only use `track_memory` where one block runs at a time
+    (a sandbox worker). CPU time covers the whole process.
+    """
+
+    def __init__(self, track_memory: bool = True):
+        self.track_memory = track_memory
+
+    def __enter__(self) -> "ResourceMeter":
+        self._rss = None
+        if self.track_memory:
+            try:
+                with open('/proc/self/clear_refs', 'w') as clear_refs:
+                    clear_refs.write('5')
+                self._rss = _status_bytes('VmRSS')
+            except OSError:
+                pass
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc_info) -> bool:
+        self.wall_ms = (time.perf_counter() - self._wall) * 1000
+        self.cpu_ms = (time.process_time() - self._cpu) * 1000
+        peak = _status_bytes('VmHWM') if self._rss is not None else None
+        self.peak_memory_bytes = max(0, peak - self._rss) if peak is not None else None
+        return False
+
+    def profile(self) -> Dict[str, Any]:
+        return {'wall_ms': self.wall_ms, 'cpu_ms': self.cpu_ms, 'peak_memory_bytes': self.peak_memory_bytes}
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Indices of the points Largest-Triangle-Three-Buckets keeps"""
+    n = len(x)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+
+    every = (n - 2) / (n_out - 2)
+    indices = np.empty(n_out, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        if end < next_end:
+            avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+        else:
+            avg_x, avg_y = x[n - 1], y[n - 1]
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(np.nan_to_num(area, nan=-1.0)))
+        indices[i + 1] = a
+    return indices
+
+
+def _as_numeric(values) -> Optional[np.ndarray]:
+    array = np.asarray(values)
+    if array.dtype.kind in 'iufb':
+        return array.astype(float)
+    if array.dtype.kind == 'M':
+        return array.astype('datetime64[ns]').astype(np.int64).astype(float)
+    try:
+        return pd.to_datetime(array).asi8.astype(float)
+    except (ValueError, TypeError):
+        return None
+
+
+def _decode_array(value):
+    """Plotly >= 6 stores numeric arrays as base64 typed-array specs"""
+    if isinstance(value, dict) and 'bdata' in value:
+        array = np.frombuffer(base64.b64decode(value['bdata']), dtype=value['dtype'])
+        return array.reshape(value['shape']) if 'shape' in value else array
+    return value
+
+
+def _take(value, keep: np.ndarray):
+    """Select points from an array attribute, keeping its encoding"""
+    array = np.asarray(_decode_array(value))[keep]
+    if isinstance(value, dict) and 'bdata' in value:
+        return {'dtype': value['dtype'], 'bdata': base64.b64encode(array.tobytes()).decode()}
+    return array
+
+
+def _length(value) -> Optional[int]:
+    value = _decode_array(value)
+    return len(value) if value is not None and np.ndim(value) > 0 else None
+
+
+# Per-point trace attributes that must be thinned together with x/y
+_POINT_KEYS = ('x', 'y', 'text', 'hovertext', 'customdata', 'ids')
+_MARKER_POINT_KEYS = ('color', 'size', 'symbol', 'opacity')
+
+
+def decimate_trace(trace: Dict[str, Any], max_points: int) -> bool:
+    """Thin a line/scatter trace to at most `max_points`; True if it was thinned"""
+    if trace.get('type') not in ('scatter', 'scattergl') or _length(trace.get('y')) is None:
+        return False
+    y = np.asarray(_decode_array(trace['y']))
+    n = len(y)
+    if n <= max_points:
+        return False
+
+    x = _as_numeric(_decode_array(trace['x'])) if trace.get('x') is not None else np.arange(n, dtype=float)
+    y_numeric = _as_numeric(y)
+    if x is not None and y_numeric is not None and len(x) == n:
+        keep = lttb_indices(x, y_numeric, max_points)
+    else:
+        # Categorical axes have no geometry to preserve; take an even stride
+        keep = np.linspace(0, n - 1, max_points).astype(np.int64)
+
+    for key in _POINT_KEYS:
+        if _length(trace.get(key)) == n:
+            trace[key] = _take(trace[key], keep)
+    marker = trace.get('marker') or {}
+    for key in _MARKER_POINT_KEYS:
+        if _length(marker.get(key)) == n:
+            marker[key] = _take(marker[key], keep)
+    return True
+
+
+def figure_to_json(fig: go.Figure, max_points: int) -> Dict[str, Any]:
+    """Compact plotly figure JSON, decimating traces above `max_points`"""
+    figure = fig.to_plotly_json()
+    decimated = False
+    if max_points > 0:
+        for trace in figure.get('data', []):
+            decimated = decimate_trace(trace, max_points) or decimated
+    figure = json.loads(json.dumps(figure, cls=PlotlyJSONEncoder))
+    return {'type': 'plotly_json', 'data': figure, 'decimated': decimated}
+
+
+def table_frame(data: Any) -> Optional[pd.DataFrame]:
+    """A DataFrame from the forms generated code gives table data in"""
+    if isinstance(data, pd.Series):
+        data = data.to_frame()
+    if isinstance(data, pd.DataFrame):
+        # Grouped results keep their labels in the index
+        if not isinstance(data.index, pd.RangeIndex) or any(name is not None for name in data.index.names):
+            data = data.reset_index()
+        return data
+    if isinstance(data, list) and all(isinstance(row, dict) for row in data):
+        return pd.DataFrame.from_records(data)
+    if isinstance(data, dict):
+        try:
+            return pd.DataFrame(data)
+        except ValueError:
+            return None
+    return None
+
+
+def table_result(data: Any, max_rows: int = 0) -> Optional[Dict[str, Any]]:
+    """Columnar table JSON, truncated to `max_rows` with the full row count kept"""
+    total_rows = len(data) if isinstance(data, list) else None
+    if isinstance(data, list) and max_rows > 0:
+        # Cut records down before building a frame from them
+        data = data[:max_rows]
+    df = table_frame(data)
+    if df is None:
+        return None
+    if total_rows is None:
+        total_rows = len(df)
+    if max_rows > 0:
+        df = df.iloc[:max_rows]
+    return {
+        'type': 'table',
+        'columns': [str(column) for column in df.columns],
+        'dtypes': [str(dtype) for dtype in df.dtypes],
+        'data': json.loads(df.to_json(orient='values', date_format='iso')),
+        'total_rows': total_rows,
+        'truncated': total_rows > len(df)
+    }
+
+
+def normalize_result(result: Any, namespace: Dict[str, Any], max_points: int, max_rows: int = 0) -> Any:
+    """Turn plotly results, whatever form the code produced, into figure JSON,
+    and table results into columnar table JSON"""
+    if isinstance(result, go.Figure):
+        return figure_to_json(result, max_points)
+    if isinstance(result, dict) and result.get('type') == 'table':
+        table = table_result(result.get('data'), max_rows)
+        return {**result, **table} if table is not None else result
+    if not isinstance(result, dict) or result.get('type') not in ('plotly', 'plotly_json'):
+        return result
+
+    data = result.get('data')
+    if isinstance(data, go.Figure):
+        return figure_to_json(data, max_points)
+    if isinstance(data, dict) and 'data' in data:
+        return figure_to_json(go.Figure(data), max_points)
+
+    # Rendered HTML: use the figure the code built, if it left one around
+    figure = namespace.get('fig')
+    if not isinstance(figure, go.Figure):
+        figures = [value for value in namespace.values() if isinstance(value, go.Figure)]
+        figure = figures[-1] if figures else None
+    if figure is not None:
+        return figure_to_json(figure, max_points)
+    return result
+
+
+def run_code(code: str, df: pd.DataFrame, plotly_max_points: int = 0, table_max_rows: int = 0) -> Dict[str, Any]:
+    """Execute generated code against `df` and return its `result`"""
+    try:
+        # Create a safe execution environment with proper builtins
+        safe_globals = {
+            '__builtins__': __builtins__,  # Provide access to built-ins including __import__
+            'df': df,
+            'pd': pd,
+            'np': np,
+            'plt': plt,
+            'sns': sns,
+            'px': px,
+            'go': go,
+            'pio': pio,
+            'base64': base64,
+            'io': io,
+            'json': json,
+            'result': None
+        }
+
+        # Capture stdout and stderr
+        stdout_capture = io.StringIO()
+        stderr_capture = io.StringIO()
+
+        with redirect_stdout(stdout_capture), redirect_stderr(stderr_capture):
+            exec(code, safe_globals)
+
+        # Get the result
+        result = safe_globals.get('result')
+
+        if result is None:
+            return {
+                'type': 'error',
+                'message': 'No result returned from code execution'
+            }
+
+        return normalize_result(result, safe_globals, plotly_max_points, table_max_rows)
+
+    except Exception as e:
+        return {
+            'type': 'error',
+            'message': str(e) or type(e).__name__
+        }
+    finally:
+        # Figures left open would leak into the next job on this worker
+        plt.close('all')
+
+
+def worker_main(conn, memory_limit_mb: int, plotly_max_points: int = 0, table_max_rows: int = 0) -> None:
+    """Serve (code, frame_path, table_max_rows) jobs from `conn` until it is closed
+
+    A job's table_max_rows of None uses the worker's default.
+    """
+    _apply_memory_limit(memory_limit_mb)
+    # Imports above are done; tell the pool this worker is warm
+    conn.send('ready')
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if job is None:
+            break
+
+        code, frame_path, max_rows = job
+        try:
+            df = load_frame(frame_path)
+            with ResourceMeter() as meter:
+                result = run_code(code, df, plotly_max_points, table_max_rows if max_rows is None else max_rows)
+            if isinstance(result, dict):
+                result['profile'] = meter.profile()
+        except Exception as e:
+            result = {'type': 'error', 'message': str(e)}
+
+        try:
+            conn.send(result)
+        except Exception as e:
+            # The result could not be pickled; report that instead
+            conn.send({'type': 'error', 'message': f'Result could not be returned: {e}'})
@@ -1,31 +1,50 @@
-from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, APIRouter, UploadFile, File, Header, HTTPException, Request, Query as QueryParam
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse, Response, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+import gridfs.errors
+import pymongo.errors
 import os
 import logging
 import asyncio
+import time
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Literal, Optional
 import uuid
-from datetime import datetime
+import ast
+import bisect
+import operator
+import hashlib
+import math
+import re
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import duckdb
+pd.set_option('mode.copy_on_write', True)  # Lets cached frames be shared via cheap shallow copies
 import json
+import orjson
 import io
 import base64
-import matplotlib
-matplotlib.use('Agg')  # Use non-interactive backend
-import matplotlib.pyplot as plt
-import seaborn as sns
-import plotly.express as px
-import plotly.graph_objects as go
-import plotly.io as pio
+import tempfile
+import shutil
+import errno
+import multiprocessing
 from emergentintegrations.llm.chat import LlmChat, UserMessage
 import sys
-from contextlib import redirect_stdout, redirect_stderr
+try:
+    # Imported as backend.server (uvicorn backend.server:app from the repo root)
+    from . import sandbox
+except ImportError:
+    # Run from backend/ (uvicorn server:app)
+    import sandbox
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -44,6 +63,67 @@ api_router = APIRouter(prefix="/api")
 # LLM Chat setup
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
 
+# Dataset storage settings
+DATASET_CHUNK_ROWS = int(os.environ.get('DATASET_CHUNK_ROWS', 100_000))
+DATAFRAME_CACHE_BYTES = int(os.environ.get('DATAFRAME_CACHE_BYTES', 512 * 1024 * 1024))
+
+# Ingest dtype compaction settings
+DTYPE_COMPACTION = os.environ.get('DTYPE_COMPACTION', 'true').lower() == 'true'
+CATEGORY_MAX_RATIO = float(os.environ.get('CATEGORY_MAX_RATIO', 0.5))
+CATEGORY_MAX_VALUES = int(os.environ.get('CATEGORY_MAX_VALUES', 10_000))
+
+# Column profiling settings
+PROFILE_TOP_K = int(os.environ.get('PROFILE_TOP_K', 10))
+PROFILE_HISTOGRAM_BINS = int(os.environ.get('PROFILE_HISTOGRAM_BINS', 20))
+
+# Preview execution settings
+PREVIEW_SAMPLE_ROWS = int(os.environ.get('PREVIEW_SAMPLE_ROWS', 10_000))  # Reservoir sample kept per dataset
+
+# Code execution sandbox settings
+EXECUTION_WORKERS = int(os.environ.get('EXECUTION_WORKERS', 2))
+EXECUTION_TIMEOUT_SECONDS = float(os.environ.get('EXECUTION_TIMEOUT_SECONDS', 30))
+EXECUTION_MEMORY_LIMIT_MB = int(os.environ.get('EXECUTION_MEMORY_LIMIT_MB', 2048))
+EXECUTION_MAX_JOBS_PER_WORKER = int(os.environ.get('EXECUTION_MAX_JOBS_PER_WORKER', 100))
+EXECUTION_SHARED_FRAMES = int(os.environ.get('EXECUTION_SHARED_FRAMES', 8))
+# Where frames are shared with workers; falls back to the temp directory when it is short of space
+EXECUTION_FRAME_DIR = os.environ.get('EXECUTION_FRAME_DIR', '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir())
+PLOTLY_MAX_POINTS = int(os.environ.get('PLOTLY_MAX_POINTS', 5000))  # Per trace; 0 disables decimation
+TABLE_MAX_ROWS = int(os.environ.get('TABLE_MAX_ROWS', 10_000))  # Rows kept per table result; 0 keeps all
+
+# SQL engine settings
+DUCKDB_THREADS = int(os.environ.get('DUCKDB_THREADS', os.cpu_count() or 1))
+DUCKDB_MEMORY_LIMIT = os.environ.get('DUCKDB_MEMORY_LIMIT', '2GB')  # For all SQL queries together; spills to the temp directory beyond this
+DUCKDB_TEMP_DIRECTORY = os.environ.get('DUCKDB_TEMP_DIRECTORY', os.path.join(tempfile.gettempdir(), 'askyourdata-duckdb'))
+
+# Generated code cache settings
+CODE_CACHE_TTL_SECONDS = int(os.environ.get('CODE_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+CODE_CACHE_MAX_ENTRIES = int(os.environ.get('CODE_CACHE_MAX_ENTRIES', 10_000))
+
+# Query result cache settings
+RESULT_CACHE_MEMORY_ENTRIES = int(os.environ.get('RESULT_CACHE_MEMORY_ENTRIES', 256))
+RESULT_CACHE_TTL_SECONDS = int(os.environ.get('RESULT_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+
+# Batch query settings
+LLM_CONCURRENCY = int(os.environ.get('LLM_CONCURRENCY', 4))  # Concurrent code generation calls
+BATCH_MAX_QUERIES = int(os.environ.get('BATCH_MAX_QUERIES', 50))
+
+# Query job queue settings
+QUERY_WORKERS = int(os.environ.get('QUERY_WORKERS', 8))  # Queries processed at once
+QUERY_QUEUE_DEPTH = int(os.environ.get('QUERY_QUEUE_DEPTH', 100))  # Waiting queries before 429
+JOB_HEARTBEAT_SECONDS = float(os.environ.get('JOB_HEARTBEAT_SECONDS', 15))  # How often background jobs are marked alive
+JOB_STALE_SECONDS = float(os.environ.get('JOB_STALE_SECONDS', 120))  # Unmarked this long, a job is failed
+
+# Streaming query settings
+STREAM_ROW_BATCH = int(os.environ.get('STREAM_ROW_BATCH', 500))  # Table rows per event
+
+# Row paging settings
+SORT_INDEX_CACHE_BYTES = int(os.environ.get('SORT_INDEX_CACHE_BYTES', 256 * 1024 * 1024))
+QUERY_RESULT_CACHE_BYTES = int(os.environ.get('QUERY_RESULT_CACHE_BYTES', 128 * 1024 * 1024))  # Table results being paged
+
+# Query profiling settings
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 5000))  # Executions this slow go to the slow-query log
+SLOW_QUERY_TTL_SECONDS = int(os.environ.get('SLOW_QUERY_TTL_SECONDS', 30 * 24 * 3600))
+
 # Define Models
 class Dataset(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -52,34 +132,229 @@ class Dataset(BaseModel):
     columns: List[str]
     row_count: int
     data_preview: List[Dict[str, Any]]  # First 5 rows
+    version: int = 1  # Bumped whenever the stored data changes
+    content_hash: Optional[str] = None  # SHA-256 of the uploaded file
+    data_id: Optional[str] = None  # Stored data shared with an identical earlier upload
+    dtypes: Dict[str, str] = Field(default_factory=dict)  # Column dtypes chosen at ingest
     uploaded_at: datetime = Field(default_factory=datetime.utcnow)
 
+class ExecutionProfile(BaseModel):
+    """What executing a query's code cost"""
+    wall_ms: float
+    cpu_ms: Optional[float] = None
+    peak_memory_bytes: Optional[int] = None  # Peak RSS growth in the sandbox worker; None for SQL
+    input_rows: int
+    input_columns: int
+    output_rows: Optional[int] = None  # Table results only, before truncation
+    output_bytes: int  # Size of the result as JSON
+
 class Query(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     dataset_id: str
     query_text: str
     generated_code: str
-    result_type: str  # 'table', 'chart', 'error'
+    result_type: str  # 'table', 'chart', 'plotly_json', 'plotly', 'error', 'pending'
     result_data: Optional[Dict[str, Any]] = None
     error_message: Optional[str] = None
+    code_source: Optional[str] = None  # 'fast_path', 'cache' or 'llm'
+    engine: str = 'pandas'  # 'pandas' (generated Python) or 'sql' (DuckDB)
+    status: str = 'done'  # 'queued', 'running', 'done' or 'failed'
+    timings: Dict[str, float] = Field(default_factory=dict)  # Stage durations in ms
+    profile: Optional[ExecutionProfile] = None  # None when the result came from the result cache
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+class QuerySummary(BaseModel):
+    """Query without its code and result, for history listings"""
+    id: str
+    dataset_id: str
+    query_text: str
+    result_type: str
+    error_message: Optional[str] = None
+    engine: str = 'pandas'
+    status: str = 'done'
+    timings: Dict[str, float] = Field(default_factory=dict)
+    profile: Optional[ExecutionProfile] = None
+    created_at: datetime
+
+class SlowQuery(BaseModel):
+    """A query whose execution took at least SLOW_QUERY_MS, with its code"""
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    query_id: str
+    dataset_id: str
+    query_text: str
+    generated_code: str
+    engine: str
+    code_source: Optional[str] = None
+    profile: ExecutionProfile
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class QueryJobStatus(BaseModel):
+    """Progress of a query submitted in the background"""
+    job_id: str
+    status: str
+    result_type: str
+    error_message: Optional[str] = None
+    created_at: datetime
+
+class DatasetPage(BaseModel):
+    items: List[Dataset]
+    next_cursor: Optional[str] = None
+
+class QueryPage(BaseModel):
+    items: List[QuerySummary]
+    next_cursor: Optional[str] = None
+
+class SlowQueryPage(BaseModel):
+    items: List[SlowQuery]
+    next_cursor: Optional[str] = None
+
+class RowPage(BaseModel):
+    columns: List[str]
+    dtypes: List[str]
+    data: List[List[Any]]
+    offset: int
+    total_rows: int  # Rows matching the filters
+
+# Mongo projections that fetch exactly the fields each model needs
+DATASET_PROJECTION = {'_id': 0, **{field: 1 for field in Dataset.model_fields}}
+QUERY_PROJECTION = {'_id': 0, **{field: 1 for field in Query.model_fields}}
+QUERY_SUMMARY_PROJECTION = {'_id': 0, **{field: 1 for field in QuerySummary.model_fields}}
+SLOW_QUERY_PROJECTION = {'_id': 0, **{field: 1 for field in SlowQuery.model_fields}}
+
+# Query orderings by execution cost, most expensive first
+COST_SORT_FIELDS = {
+    'wall_time': 'profile.wall_ms',
+    'cpu_time': 'profile.cpu_ms',
+    'peak_memory': 'profile.peak_memory_bytes'
+}
+QuerySort = Literal['recent', 'wall_time', 'cpu_time', 'peak_memory']
+
+# Page sizes for list endpoints
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_ROW_PAGE_SIZE = 1000
+
 class QueryRequest(BaseModel):
     dataset_id: str
     query_text: str
+    engine: Literal['pandas', 'sql'] = 'pandas'
+
+class BatchQueryRequest(BaseModel):
+    dataset_id: str
+    query_texts: List[str]
+    engine: Literal['pandas', 'sql'] = 'pandas'
+
+class MetricsRegistry:
+    """Counters, gauges and histograms rendered in the Prometheus text format.
+
+    Recording a value is a dict update (plus a bisect for histograms), so
+    it is cheap enough for the query path. Gauges are callbacks read only
+    when /api/metrics is scraped.
+    """
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, prefix: str = 'askyourdata'):
+        self.prefix = prefix
+        self._meta: Dict[str, tuple] = {}  # name -> (type, help, buckets or gauge callback)
+        self._values: Dict[str, Dict[tuple, Any]] = {}
+
+    def counter(self, name: str, help_text: str) -> None:
+        self._meta[name] = ('counter', help_text, None)
+        self._values.setdefault(name, {})
+
+    def histogram(self, name: str, help_text: str, buckets: tuple = DEFAULT_BUCKETS) -> None:
+        self._meta[name] = ('histogram', help_text, tuple(buckets))
+        self._values.setdefault(name, {})
+
+    def gauge(self, name: str, help_text: str, callback) -> None:
+        """`callback()` returns a value, or a list of (labels, value) pairs"""
+        self._meta[name] = ('gauge', help_text, callback)
+
+    def inc(self, name: str, amount: float = 1.0, **labels) -> None:
+        values = self._values[name]
+        key = tuple(sorted(labels.items()))
+        values[key] = values.get(key, 0.0) + amount
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        values = self._values[name]
+        key = tuple(sorted(labels.items()))
+        entry = values.get(key)
+        if entry is None:
+            # Per-bucket counts (the last one is +Inf), then the sum
+            entry = values[key] = [0] * (len(self._meta[name][2]) + 1) + [0.0]
+        entry[bisect.bisect_left(self._meta[name][2], value)] += 1
+        entry[-1] += value
+
+    @contextmanager
+    def time(self, name: str, **labels):
+        """Observe the seconds spent in a `with` block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    @staticmethod
+    def _labels(labels, **extra) -> str:
+        pairs = list(labels) + list(extra.items())
+        if not pairs:
+            return ''
+        escaped = (
+            '{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+            for key, value in pairs
+        )
+        return '{' + ','.join(escaped) + '}'
+
+    def render(self) -> str:
+        lines = []
+        for name, (kind, help_text, extra) in self._meta.items():
+            full_name = f"{self.prefix}_{name}"
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {kind}")
+            if kind == 'gauge':
+                value = extra()
+                samples = value if isinstance(value, list) else [({}, value)]
+                for labels, sample in samples:
+                    lines.append(f"{full_name}{self._labels(sorted(labels.items()))} {sample}")
+            elif kind == 'counter':
+                for labels, value in list(self._values[name].items()):
+                    lines.append(f"{full_name}{self._labels(labels)} {value}")
+            else:
+                for labels, entry in list(self._values[name].items()):
+                    cumulative = 0
+                    for bound, count in zip(extra + (float('inf'),), entry[:-1]):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else repr(float(bound))
+                        lines.append(f"{full_name}_bucket{self._labels(labels, le=le)} {cumulative}")
+                    lines.append(f"{full_name}_sum{self._labels(labels)} {entry[-1]}")
+                    lines.append(f"{full_name}_count{self._labels(labels)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+class StageTimer:
+    """Adds up time per stage across a multi-step operation, then records
+    each stage's total as one histogram observation"""
+
+    def __init__(self, registry: MetricsRegistry, name: str):
+        self.registry = registry
+        self.name = name
+        self.seconds: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + time.perf_counter() - started
+
+    def record(self) -> None:
+        for stage, seconds in self.seconds.items():
+            self.registry.observe(self.name, seconds, stage=stage)
 
 class CodeGenerationService:
-    def __init__(self, api_key: str):
-        self.api_key = api_key
-        
-    async def generate_code(self, query: str, dataset_info: Dict[str, Any]) -> str:
-        """Generate Python code from natural language query"""
-        
-        # Create a new chat instance for each query
-        chat = LlmChat(
-            api_key=self.api_key,
-            session_id=f"data_query_{uuid.uuid4()}",
-            system_message="""You are an expert data analyst who converts natural language queries into Python code using pandas, matplotlib, seaborn, and plotly.
+    SYSTEM_MESSAGES = {
+        'pandas': """You are an expert data analyst who converts natural language queries into Python code using pandas, matplotlib, seaborn, and plotly.
 
 IMPORTANT RULES:
 1. Always assume the DataFrame is named 'df'
@@ -87,7 +362,7 @@ IMPORTANT RULES:
 3. For visualizations, save plots as base64 encoded images
 4. Return ONLY the Python code, no explanations
 5. Use matplotlib.pyplot.savefig() with bbox_inches='tight', dpi=150 for static plots
-6. For interactive plots, use plotly and return HTML
+6. For interactive plots, use plotly and return the figure
 7. Handle missing values and data types appropriately
 8. Always include proper error handling
 
@@ -110,15 +385,13 @@ plt.close()
 result = {'type': 'chart', 'data': plot_base64}
 ```
 
-For plotly plots, use this format:
+For plotly plots, return the figure itself (it is sent to the browser as figure JSON):
 ```python
 import plotly.express as px
-import plotly.io as pio
 
 # Your plotting code here
 fig = px.bar(df, x='column', y='value')
-plot_html = pio.to_html(fig, include_plotlyjs='cdn')
-result = {'type': 'plotly', 'data': plot_html}
+result = {'type': 'plotly_json', 'data': fig}
 ```
 
 For tables, use this format:
@@ -126,7 +399,46 @@ For tables, use this format:
 # Your data processing code here
 result_df = df.groupby('column').sum()
 result = {'type': 'table', 'data': result_df.to_dict('records')}
-```"""
+```""",
+        'sql': """You are an expert data analyst who converts natural language queries into DuckDB SQL.
+
+IMPORTANT RULES:
+1. The dataset is a table named data
+2. Write exactly one SELECT statement (WITH clauses are allowed); never modify data or read files
+3. Return ONLY the SQL, no explanations
+4. Double-quote column names that contain spaces or special characters
+5. Use DuckDB functions where they help (date_trunc, strftime, quantile_cont, approx_count_distinct, ...)
+6. Give computed columns readable aliases
+7. Limit row-level listings to a sensible number of rows
+
+To show the result as a chart, end with one comment line naming a plotly express chart type (bar, line, scatter, area, box, histogram or pie) and the result columns to plot:
+```sql
+SELECT region, SUM(sales) AS total_sales
+FROM data
+GROUP BY region
+ORDER BY total_sales DESC
+-- chart: {"type": "bar", "x": "region", "y": "total_sales"}
+```
+Pie charts use "names" and "values" instead of "x" and "y". Optional keys: "color", "title"."""
+    }
+
+    # Closing instruction of the user message for each engine
+    INSTRUCTIONS = {
+        'pandas': "Generate Python code to answer this query. The DataFrame is available as 'df'.",
+        'sql': "Generate DuckDB SQL to answer this query. The data is in the table 'data'."
+    }
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        
+    async def generate_code(self, query: str, dataset_info: Dict[str, Any], engine: str = 'pandas') -> str:
+        """Generate Python code (or DuckDB SQL for the 'sql' engine) from natural language query"""
+        
+        # Create a new chat instance for each query
+        chat = LlmChat(
+            api_key=self.api_key,
+            session_id=f"data_query_{uuid.uuid4()}",
+            system_message=self.SYSTEM_MESSAGES[engine]
         ).with_model("gemini", "gemini-2.0-flash-lite")
         
         # Create context about the dataset
@@ -134,30 +446,53 @@ result = {'type': 'table', 'data': result_df.to_dict('records')}
 Dataset Information:
 - Name: {dataset_info['name']}
 - Columns: {', '.join(dataset_info['columns'])}
+- Column Types: {', '.join(f'{column}: {dtype}' for column, dtype in DtypeCompactor.execution_dtypes(dataset_info.get('dtypes', {})).items()) or 'unknown'}
 - Total Rows: {dataset_info['row_count']}
+- Column Statistics:
+{self._format_profile(dataset_info.get('profile'))}
 - Sample Data: {json.dumps(dataset_info['data_preview'][:3], indent=2)}
 
 Query: {query}
 
-Generate Python code to answer this query. The DataFrame is available as 'df'.
+{self.INSTRUCTIONS[engine]}
 """
         
         user_message = UserMessage(text=dataset_context)
         response = await chat.send_message(user_message)
+        # The chat client does not report usage; estimate ~4 characters per token
+        metrics.inc('llm_tokens_total', (len(self.SYSTEM_MESSAGES[engine]) + len(dataset_context)) / 4,
+                    direction='prompt')
+        metrics.inc('llm_tokens_total', len(response) / 4, direction='completion')
         
         # Extract code from response
         code = self._extract_code(response)
         return code
     
+    @staticmethod
+    def _format_profile(profile: Optional[Dict[str, Any]]) -> str:
+        """Summarize precomputed column statistics for the prompt"""
+        if not profile:
+            return "  (not available)"
+        lines = []
+        for column, stats in profile['columns'].items():
+            parts = [f"nulls={stats['null_count']}", f"distinct~{stats['distinct_estimate']}"]
+            if stats.get('min') is not None:
+                parts.append(f"range=[{stats['min']}, {stats['max']}]")
+            if stats.get('top_values'):
+                parts.append(f"top={[entry['value'] for entry in stats['top_values'][:3]]}")
+            lines.append(f"  - {column} ({stats['dtype']}): {', '.join(parts)}")
+        return "\n".join(lines)
+
     def _extract_code(self, response: str) -> str:
-        """Extract Python code from LLM response"""
+        """Extract Python or SQL code from LLM response"""
         # Look for code blocks
-        if "```python" in response:
-            start = response.find("```python") + 9
-            end = response.find("```", start)
-            if end != -1:
-                return response[start:end].strip()
-        elif "```" in response:
+        for fence in ("```python", "```sql"):
+            if fence in response:
+                start = response.find(fence) + len(fence)
+                end = response.find("```", start)
+                if end != -1:
+                    return response[start:end].strip()
+        if "```" in response:
             start = response.find("```") + 3
             end = response.find("```", start)
             if end != -1:
@@ -166,168 +501,2842 @@ Generate Python code to answer this query. The DataFrame is available as 'df'.
         # If no code blocks, return the response as is
         return response.strip()
 
+class ExecutionWorker:
+    """Handle on one sandbox worker process"""
+
+    def __init__(self, context, memory_limit_mb: int, plotly_max_points: int, table_max_rows: int):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=sandbox.worker_main,
+            args=(child_conn, memory_limit_mb, plotly_max_points, table_max_rows),
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+
+    def wait_ready(self, timeout: float = 120) -> None:
+        """Block until the worker has finished importing its libraries"""
+        if not self.conn.poll(timeout) or self.conn.recv() != 'ready':
+            self.kill()
+            raise RuntimeError("Execution worker failed to start")
+
+    def stop(self) -> None:
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=1)
+        self.kill()
+
+    def kill(self) -> None:
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+class ExecutionPool:
+    """Pool of pre-warmed worker processes that run generated code.
+
+    Each job gets a wall-clock timeout; workers that time out or crash are
+    killed and replaced, and healthy workers are recycled after a fixed
+    number of jobs. DataFrames are shared with workers as Arrow IPC files in
+    shared memory, kept per dataset version so repeat queries skip the copy.
+    Frames that do not fit in the frame directory go to the temp directory.
+    """
+
+    RESPAWN_DELAY_SECONDS = 1
+    RESPAWN_MAX_DELAY_SECONDS = 60
+
+    def __init__(self, size: int = EXECUTION_WORKERS, timeout: float = EXECUTION_TIMEOUT_SECONDS,
+                 memory_limit_mb: int = EXECUTION_MEMORY_LIMIT_MB,
+                 max_jobs: int = EXECUTION_MAX_JOBS_PER_WORKER,
+                 max_shared_frames: int = EXECUTION_SHARED_FRAMES,
+                 plotly_max_points: int = PLOTLY_MAX_POINTS,
+                 table_max_rows: int = TABLE_MAX_ROWS,
+                 frame_dir: str = EXECUTION_FRAME_DIR):
+        self.size = max(1, size)
+        self.plotly_max_points = plotly_max_points
+        self.table_max_rows = table_max_rows
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.max_jobs = max_jobs
+        self.max_shared_frames = max_shared_frames
+        # Forking a process that runs an event loop and Mongo threads is unsafe
+        self._context = multiprocessing.get_context('spawn')
+        self._idle: Optional[asyncio.Queue] = None
+        self._workers: List[ExecutionWorker] = []
+        self.frame_dir = frame_dir
+        self._frames: "OrderedDict[tuple, str]" = OrderedDict()
+        self._frames_in_use: Dict[str, int] = {}
+        self._frames_to_remove: set = set()
+        self._frame_writes: Dict[tuple, asyncio.Future] = {}
+        self._replacements: set = set()
+        self.active = 0
+
+    async def start(self) -> None:
+        self._idle = asyncio.Queue()
+        for _ in range(self.size):
+            self._idle.put_nowait(await self._spawn())
+
+    async def shutdown(self) -> None:
+        for task in list(self._replacements):
+            task.cancel()
+        await asyncio.gather(*self._replacements, return_exceptions=True)
+        for worker in self._workers:
+            worker.stop()
+        self._workers = []
+        for path in list(self._frames.values()) + list(self._frames_to_remove):
+            self._remove_file(path)
+        self._frames.clear()
+
+    async def _spawn(self) -> ExecutionWorker:
+        worker = await asyncio.to_thread(
+            ExecutionWorker, self._context, self.memory_limit_mb, self.plotly_max_points, self.table_max_rows
+        )
+        await asyncio.to_thread(worker.wait_ready)
+        self._workers.append(worker)
+        return worker
+
+    def _schedule_replace(self, worker: ExecutionWorker) -> None:
+        # Warm the replacement in the background so the current request is not delayed
+        task = asyncio.create_task(self._replace(worker))
+        self._replacements.add(task)
+        task.add_done_callback(self._replacements.discard)
+
+    async def _replace(self, worker: ExecutionWorker) -> None:
+        if worker in self._workers:
+            self._workers.remove(worker)
+        worker.kill()
+        # Keep trying, or jobs waiting for an idle worker would wait forever
+        retry_delay = self.RESPAWN_DELAY_SECONDS
+        while True:
+            try:
+                replacement = await self._spawn()
+            except Exception as e:
+                logger.warning(f"Could not start a replacement execution worker, retrying in {retry_delay:g}s: {e}")
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, self.RESPAWN_MAX_DELAY_SECONDS)
+            else:
+                self._idle.put_nowait(replacement)
+                return
+
+    async def run(self, code: str, df: pd.DataFrame, dataset_key: Optional[tuple] = None,
+                  table_max_rows: Optional[int] = None) -> Dict[str, Any]:
+        """Run code on a worker; `table_max_rows` overrides the pool's row limit (0 keeps all)"""
+        if self._idle is None:
+            await self.start()
+
+        path = worker = None
+        healthy = False
+        self.active += 1
+        try:
+            # Inside the try so a job cancelled while waiting still releases its frame
+            path = await self._share(df, dataset_key)
+            worker = await self._idle.get()
+            worker.conn.send((code, path, table_max_rows))
+            if not await asyncio.to_thread(worker.conn.poll, self.timeout):
+                return {
+                    'type': 'error',
+                    'message': f'Code execution timed out after {self.timeout:g} seconds'
+                }
+            try:
+                result = await asyncio.to_thread(worker.conn.recv)
+            except EOFError:
+                return {
+                    'type': 'error',
+                    'message': 'Code execution failed: worker process exited (memory limit exceeded?)'
+                }
+            healthy = True
+            worker.jobs += 1
+            return result
+        finally:
+            self.active -= 1
+            if path is not None:
+                self._release(path, dataset_key)
+            if worker is not None and (not healthy or worker.jobs >= self.max_jobs):
+                self._schedule_replace(worker)
+            elif worker is not None:
+                self._idle.put_nowait(worker)
+
+    async def _share(self, df: pd.DataFrame, dataset_key: Optional[tuple]) -> str:
+        if dataset_key is None:
+            path = await self._write(df)
+        else:
+            while True:
+                path = self._frames.get(dataset_key)
+                if path is not None:
+                    self._frames.move_to_end(dataset_key)
+                    break
+                # Concurrent jobs on the same dataset share one write
+                pending = self._frame_writes.get(dataset_key)
+                if pending is None:
+                    pending = asyncio.ensure_future(self._write_shared(df, dataset_key))
+                    self._frame_writes[dataset_key] = pending
+                await asyncio.shield(pending)
+        self._frames_in_use[path] = self._frames_in_use.get(path, 0) + 1
+        return path
+
+    async def _write_shared(self, df: pd.DataFrame, dataset_key: tuple) -> None:
+        try:
+            path = await self._write(df)
+            self._frames[dataset_key] = path
+            while len(self._frames) > self.max_shared_frames:
+                _, evicted = self._frames.popitem(last=False)
+                self._schedule_removal(evicted)
+        finally:
+            self._frame_writes.pop(dataset_key, None)
+
+    async def _write(self, df: pd.DataFrame) -> str:
+        """Write a frame file and return its path, removing it if the write fails or the caller is cancelled"""
+        table = await asyncio.to_thread(pa.Table.from_pandas, df, preserve_index=False)
+        directories = [self.frame_dir]
+        fallback = tempfile.gettempdir()
+        if os.path.realpath(fallback) != os.path.realpath(self.frame_dir):
+            # Docker's default /dev/shm is only 64 MB; IPC files are a little larger than the table
+            if shutil.disk_usage(self.frame_dir).free < table.nbytes * 1.1:
+                directories = [fallback]
+            else:
+                directories.append(fallback)
+        for directory in directories:
+            path = os.path.join(directory, f"askyourdata-{uuid.uuid4().hex}.arrow")
+            write = asyncio.ensure_future(asyncio.to_thread(self._write_frame, table, path))
+            try:
+                await asyncio.shield(write)
+                return path
+            except OSError as e:
+                # Concurrent writes can still fill the directory after the check
+                self._remove_file(path)
+                if e.errno != errno.ENOSPC or directory == directories[-1]:
+                    raise
+                logger.warning(f"No space left for a shared frame in {directory}, using {fallback}")
+            except BaseException:
+                # The thread cannot be stopped, so remove the file once it is done
+                write.add_done_callback(lambda _: self._remove_file(path))
+                raise
+
+    def _release(self, path: str, dataset_key: Optional[tuple]) -> None:
+        self._frames_in_use[path] -= 1
+        if self._frames_in_use[path] == 0:
+            del self._frames_in_use[path]
+        if dataset_key is None:
+            self._schedule_removal(path)
+        elif path in self._frames_to_remove and path not in self._frames_in_use:
+            self._frames_to_remove.discard(path)
+            self._remove_file(path)
+
+    def invalidate(self, dataset_id: str) -> None:
+        """Drop shared frames for every version of a dataset"""
+        for key in [key for key in self._frames if key[0] == dataset_id]:
+            self._schedule_removal(self._frames.pop(key))
+
+    def _schedule_removal(self, path: str) -> None:
+        # Files still being read by a worker are removed once released
+        if path in self._frames_in_use:
+            self._frames_to_remove.add(path)
+        else:
+            self._remove_file(path)
+
+    @staticmethod
+    def _write_frame(table: pa.Table, path: str) -> None:
+        with pa.OSFile(path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+    @staticmethod
+    def _remove_file(path: str) -> None:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
 class CodeExecutor:
-    def __init__(self):
+    def __init__(self, pool: ExecutionPool):
+        self.pool = pool
         self.allowed_imports = {
             'pandas', 'numpy', 'matplotlib', 'seaborn', 'plotly', 
             'base64', 'io', 'json', 'datetime', 'math'
         }
     
-    async def execute_code(self, code: str, df: pd.DataFrame) -> Dict[str, Any]:
-        """Safely execute generated code"""
+    async def execute_code(self, code: str, df: pd.DataFrame, dataset_key: Optional[tuple] = None,
+                           table_max_rows: Optional[int] = None) -> Dict[str, Any]:
+        """Safely execute generated code in a sandbox worker process"""
         try:
-            # Create a safe execution environment with proper builtins
-            safe_globals = {
-                '__builtins__': __builtins__,  # Provide access to built-ins including __import__
-                'df': df,
-                'pd': pd,
-                'np': np,
-                'plt': plt,
-                'sns': sns,
-                'px': px,
-                'go': go,
-                'pio': pio,
-                'base64': base64,
-                'io': io,
-                'json': json,
-                'result': None
-            }
-            
-            # Capture stdout and stderr
-            stdout_capture = io.StringIO()
-            stderr_capture = io.StringIO()
-            
-            with redirect_stdout(stdout_capture), redirect_stderr(stderr_capture):
-                exec(code, safe_globals)
-            
-            # Get the result
-            result = safe_globals.get('result')
-            
-            if result is None:
-                # If no result variable, try to get the last expression
-                return {
-                    'type': 'error',
-                    'message': 'No result returned from code execution'
-                }
-            
-            return result
-            
+            return await self.pool.run(code, df, dataset_key, table_max_rows)
         except Exception as e:
             return {
                 'type': 'error',
                 'message': str(e)
             }
 
+class SqlEngine:
+    """Runs generated DuckDB SQL over a dataset's Arrow data.
+
+    Queries share one in-memory DuckDB database, so its thread count and
+    memory limit bound all SQL execution together; it spills to its temp
+    directory beyond the limit. File system access is disabled and the
+    configuration locked, and each query runs on its own cursor, whose
+    registered `data` table only that query can see. A trailing
+    `-- chart: {...}` comment turns the result into a plotly figure, built
+    in the sandbox from the (small) result table.
+    """
+
+    TABLE = 'data'
+    CHART_TYPES = {'bar', 'line', 'scatter', 'pie', 'histogram', 'area', 'box'}
+    CHART_KEYS = {'x', 'y', 'color', 'names', 'values', 'title'}
+    CHART_PATTERN = re.compile(r'^\s*--\s*chart:\s*(\{.*\})\s*$', re.MULTILINE)
+
+    def __init__(self, executor: CodeExecutor, threads: int = DUCKDB_THREADS,
+                 memory_limit: str = DUCKDB_MEMORY_LIMIT, temp_directory: str = DUCKDB_TEMP_DIRECTORY,
+                 timeout: float = EXECUTION_TIMEOUT_SECONDS, max_rows: int = TABLE_MAX_ROWS):
+        self.executor = executor
+        self.config = {
+            'enable_external_access': False,
+            'threads': max(1, threads),
+            'memory_limit': memory_limit,
+            'temp_directory': temp_directory
+        }
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self.active = 0
+        self._database = None
+
+    def _cursor(self):
+        """A connection of its own to the shared database"""
+        if self._database is None:
+            self._database = duckdb.connect(':memory:', config=self.config)
+            self._database.execute("SET lock_configuration = true")
+        return self._database.cursor()
+
+    def close(self) -> None:
+        if self._database is not None:
+            self._database.close()
+            self._database = None
+
+    @classmethod
+    def split(cls, code: str) -> tuple:
+        """(sql, chart spec or None) from generated SQL"""
+        match = cls.CHART_PATTERN.search(code)
+        if not match:
+            return code.strip().rstrip(';'), None
+        sql = (code[:match.start()] + code[match.end():]).strip().rstrip(';')
+        return sql, json.loads(match.group(1))
+
+    def referenced_columns(self, code: str, columns: List[str]) -> Optional[List[str]]:
+        """Columns named in the SQL, or None if it may read them all (SELECT *)"""
+        sql, chart = self.split(code)
+        if '*' in re.sub(r'count\s*\(\s*\*\s*\)', '', sql, flags=re.IGNORECASE):
+            return None
+        identifiers = {token.lower() for pair in re.findall(r'"([^"]+)"|([A-Za-z_][A-Za-z0-9_]*)', sql)
+                       for token in pair if token}
+        used = [column for column in columns if str(column).lower() in identifiers]
+        return used or list(columns[:1])
+
+    async def execute(self, code: str, data, max_rows: Optional[int] = None) -> Dict[str, Any]:
+        """Run generated SQL against `data` (an Arrow table or DataFrame)
+
+        `max_rows` overrides the engine's table row limit (0 keeps all rows).
+        """
+        try:
+            sql, chart = self.split(code)
+        except ValueError as e:
+            return {'type': 'error', 'message': f'Invalid chart spec: {e}'}
+
+        connection = self._cursor()
+        self.active += 1
+        try:
+            statements = connection.extract_statements(sql)
+            if len(statements) != 1 or statements[0].type != duckdb.StatementType.SELECT:
+                return {'type': 'error', 'message': 'Only a single SELECT statement is allowed'}
+            connection.register(self.TABLE, data)
+
+            # Concurrent queries share this process, so its peak RSS says
+            # nothing about one query; peak memory is left unmeasured
+            with sandbox.ResourceMeter(track_memory=False) as meter:
+                task = asyncio.create_task(asyncio.to_thread(self._run, connection, sql))
+                done, _ = await asyncio.wait({task}, timeout=self.timeout)
+            if not done:
+                connection.interrupt()
+                await asyncio.gather(task, return_exceptions=True)
+                return {'type': 'error', 'message': f'Query timed out after {self.timeout:g} seconds'}
+            result = task.result()
+        except duckdb.Error as e:
+            return {'type': 'error', 'message': str(e)}
+        finally:
+            self.active -= 1
+            connection.close()
+
+        if chart is not None:
+            output = await self._chart(result, chart)
+        else:
+            output = await asyncio.to_thread(self._table, result, self.max_rows if max_rows is None else max_rows)
+        # DuckDB runs in this process, so its CPU time includes concurrent work
+        output['profile'] = meter.profile()
+        return output
+
+    @staticmethod
+    def _run(connection, sql: str) -> pa.Table:
+        result = connection.execute(sql).arrow()
+        # Newer DuckDB versions hand back a reader rather than a table
+        return result.read_all() if isinstance(result, pa.RecordBatchReader) else result
+
+    @staticmethod
+    def _to_pandas(table: pa.Table) -> pd.DataFrame:
+        # SUM over integers comes back as DECIMAL(38, 0), which BSON cannot
+        # store; keep whole numbers integral when they fit in int64
+        for index, field in enumerate(table.schema):
+            if pa.types.is_decimal(field.type):
+                column = table.column(index)
+                try:
+                    column = column.cast(pa.int64()) if field.type.scale == 0 else column.cast(pa.float64())
+                except pa.ArrowInvalid:
+                    column = column.cast(pa.float64())
+                table = table.set_column(index, field.name, column)
+        return table.to_pandas()
+
+    def _table(self, table: pa.Table, max_rows: int) -> Dict[str, Any]:
+        total_rows = table.num_rows
+        if max_rows > 0:
+            table = table.slice(0, max_rows)
+        result = sandbox.table_result(self._to_pandas(table))
+        result.update(total_rows=total_rows, truncated=total_rows > table.num_rows)
+        return result
+
+    async def _chart(self, table: pa.Table, chart: Dict[str, Any]) -> Dict[str, Any]:
+        kind = chart.get('type')
+        if kind not in self.CHART_TYPES:
+            return {'type': 'error', 'message': f"Unsupported chart type: {kind}"}
+        arguments = ', '.join(
+            f"{key}={value!r}" for key, value in chart.items()
+            if key in self.CHART_KEYS and isinstance(value, str)
+        )
+        code = f"fig = px.{kind}(df, {arguments})\nresult = {{'type': 'plotly_json', 'data': fig}}"
+        df = await asyncio.to_thread(self._to_pandas, table)
+        return await self.executor.execute_code(code, df)
+
+class DatasetStore:
+    """Stores datasets as typed Parquet chunks in GridFS.
+
+    The `dataset_data` collection only holds a small manifest per dataset
+    listing its chunk files, so uploads are no longer bound by the 16 MB
+    BSON document limit and dtypes survive the round trip.
+    """
+
+    def __init__(self, database, bucket_name: str = 'dataset_chunks', chunk_rows: int = DATASET_CHUNK_ROWS):
+        self.db = database
+        self.bucket = AsyncIOMotorGridFSBucket(database, bucket_name=bucket_name)
+        self.chunk_rows = max(1, chunk_rows)
+
+    @staticmethod
+    def _to_parquet(table: pa.Table) -> bytes:
+        buffer = io.BytesIO()
+        pq.write_table(table, buffer, compression='zstd')
+        return buffer.getvalue()
+
+    @staticmethod
+    def _from_parquet(blob: bytes, columns: Optional[List[str]] = None) -> pa.Table:
+        return pq.read_table(io.BytesIO(blob), columns=columns)
+
+    def open_writer(self, dataset_id: str) -> "DatasetWriter":
+        """Start writing a dataset chunk by chunk"""
+        return DatasetWriter(self, dataset_id)
+
+    async def load(self, dataset_id: str, columns: Optional[List[str]] = None) -> Optional[pd.DataFrame]:
+        """Load a stored dataset, or None if it does not exist
+
+        With `columns`, only those columns are decoded from each chunk.
+        """
+        manifest = await self.db.dataset_data.find_one(
+            {'dataset_id': dataset_id},
+            {'data': 1, 'chunks': 1, 'dtypes': 1}
+        )
+        if not manifest:
+            return None
+
+        # Datasets uploaded before chunked storage keep their rows inline
+        if 'data' in manifest:
+            df = pd.DataFrame(manifest['data'])
+            return df[columns] if columns is not None else df
+
+        tables = await self._load_chunks(manifest, columns)
+        df = await asyncio.to_thread(self._tables_to_frame, tables)
+        return await asyncio.to_thread(DtypeCompactor.restore, df, manifest.get('dtypes', {}))
+
+    async def load_table(self, dataset_id: str, columns: Optional[List[str]] = None) -> Optional[pa.Table]:
+        """Load a stored dataset as one Arrow table, without going through pandas"""
+        manifest = await self.db.dataset_data.find_one({'dataset_id': dataset_id}, {'data': 1, 'chunks': 1})
+        if not manifest:
+            return None
+        if 'data' in manifest:
+            df = pd.DataFrame(manifest['data'])
+            return pa.Table.from_pandas(df[columns] if columns is not None else df, preserve_index=False)
+
+        tables = await self._load_chunks(manifest, columns)
+        try:
+            table = pa.concat_tables(tables, promote_options='permissive')
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            df = await asyncio.to_thread(self._tables_to_frame, tables)
+            table = pa.Table.from_pandas(df, preserve_index=False)
+        # Older uploads stored downcast ints; queries should see 64-bit ones
+        narrow = [i for i, field in enumerate(table.schema)
+                  if pa.types.is_integer(field.type) and field.type.bit_width < 64]
+        for i in narrow:
+            table = table.set_column(i, table.field(i).name, table.column(i).cast(pa.int64()))
+        return table
+
+    async def load_rows(self, dataset_id: str, offset: int, limit: int) -> Optional[pd.DataFrame]:
+        """Load rows [offset, offset + limit) of a stored dataset, decoding only the chunks they fall in"""
+        manifest = await self.db.dataset_data.find_one(
+            {'dataset_id': dataset_id},
+            {'data': 1, 'chunks': 1, 'dtypes': 1}
+        )
+        if not manifest:
+            return None
+        if 'data' in manifest:
+            return pd.DataFrame(manifest['data']).iloc[offset:offset + limit].reset_index(drop=True)
+
+        chunks, first_row, start = [], 0, 0
+        for chunk in manifest['chunks']:
+            if start + chunk['rows'] > offset and start < offset + limit:
+                if not chunks:
+                    first_row = start
+                chunks.append(chunk)
+            start += chunk['rows']
+
+        # Past the last row, one chunk is still decoded for the columns
+        tables = await self._load_chunks({'chunks': chunks or manifest['chunks'][:1]}, None)
+        df = await asyncio.to_thread(self._tables_to_frame, tables)
+        df = DtypeCompactor.restore(df, manifest.get('dtypes', {}))
+        if not chunks:
+            return df.iloc[0:0]
+        skip = offset - first_row
+        return df.iloc[skip:skip + limit].reset_index(drop=True)
+
+    async def _load_chunks(self, manifest: Dict[str, Any], columns: Optional[List[str]]) -> List[pa.Table]:
+        tables = []
+        for chunk in manifest['chunks']:
+            stream = await self.bucket.open_download_stream(chunk['file_id'])
+            blob = await stream.read()
+            tables.append(await asyncio.to_thread(self._from_parquet, blob, columns))
+        return tables
+
+    @staticmethod
+    def _tables_to_frame(tables: List[pa.Table]) -> pd.DataFrame:
+        if len(tables) == 1:
+            return tables[0].to_pandas()
+        try:
+            # Chunks parsed separately may disagree on types (e.g. int vs float)
+            return pa.concat_tables(tables, promote_options='permissive').to_pandas()
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Incompatible types (e.g. numbers in one chunk, text in another)
+            # fall back to pandas, which widens the column to object
+            return pd.concat([table.to_pandas() for table in tables], ignore_index=True)
+
+    async def load_sample(self, dataset_id: str) -> Optional[pd.DataFrame]:
+        """The row sample recorded at ingest, or None for small or older datasets"""
+        manifest = await self.db.dataset_data.find_one({'dataset_id': dataset_id}, {'sample': 1, 'dtypes': 1})
+        if not manifest or not manifest.get('sample'):
+            return None
+        stream = await self.bucket.open_download_stream(manifest['sample']['file_id'])
+        blob = await stream.read()
+        df = (await asyncio.to_thread(self._from_parquet, blob)).to_pandas()
+        return await asyncio.to_thread(DtypeCompactor.restore, df, manifest.get('dtypes', {}))
+
+    async def load_profile(self, dataset_id: str) -> Optional[Dict[str, Any]]:
+        """Column statistics recorded at ingest, if any"""
+        manifest = await self.db.dataset_data.find_one({'dataset_id': dataset_id}, {'profile': 1})
+        return manifest.get('profile') if manifest else None
+
+    async def save_profile(self, dataset_id: str, profile: Dict[str, Any]) -> None:
+        await self.db.dataset_data.update_one({'dataset_id': dataset_id}, {'$set': {'profile': profile}})
+
+    async def acquire(self, content_hash: str) -> Optional[Dict[str, Any]]:
+        """Take a reference on already-stored data with this content hash"""
+        return await self.db.dataset_data.find_one_and_update(
+            {'content_hash': content_hash},
+            {'$inc': {'ref_count': 1}},
+            projection={'dataset_id': 1, 'row_count': 1, 'columns': 1, 'data_preview': 1, 'dtypes': 1},
+            return_document=pymongo.ReturnDocument.AFTER
+        )
+
+    async def release(self, dataset_id: str) -> bool:
+        """Drop a reference to stored data, deleting it once unreferenced.
+
+        Returns True if the data was deleted.
+        """
+        manifest = await self.db.dataset_data.find_one_and_update(
+            {'dataset_id': dataset_id},
+            {'$inc': {'ref_count': -1}},
+            projection={'ref_count': 1, 'chunks.file_id': 1, 'sample.file_id': 1},
+            return_document=pymongo.ReturnDocument.AFTER
+        )
+        if not manifest or manifest['ref_count'] > 0:
+            return False
+
+        # Only delete if no upload took a new reference in the meantime
+        result = await self.db.dataset_data.delete_one({'_id': manifest['_id'], 'ref_count': {'$lte': 0}})
+        if result.deleted_count == 0:
+            return False
+        for chunk in manifest.get('chunks', []) + ([manifest['sample']] if manifest.get('sample') else []):
+            await self.bucket.delete(chunk['file_id'])
+        return True
+
+class DatasetWriter:
+    """Incrementally writes one dataset's chunks, then commits its manifest"""
+
+    def __init__(self, store: DatasetStore, dataset_id: str):
+        self.store = store
+        self.dataset_id = dataset_id
+        self.schema: Optional[pa.Schema] = None
+        self.row_count = 0
+        self.chunks: List[Dict[str, Any]] = []
+        self.columns: Optional[List[str]] = None
+        self.data_preview: List[Dict[str, Any]] = []
+        self.sampler = ReservoirSampler()
+        self.sample: Optional[Dict[str, Any]] = None
+
+    async def write(self, df: pd.DataFrame) -> None:
+        if self.columns is None:
+            self.columns = df.columns.tolist()
+            # Round-trip through JSON so NaN/NA/timestamps are safe to store
+            self.data_preview = json.loads(df.head().to_json(orient='records', date_format='iso'))
+        table = await asyncio.to_thread(self._to_table, df)
+        blob = await asyncio.to_thread(self.store._to_parquet, table)
+        file_id = await self.store.bucket.upload_from_stream(
+            f"{self.dataset_id}/{len(self.chunks):05d}.parquet",
+            blob,
+            metadata={'dataset_id': self.dataset_id, 'rows': len(df)}
+        )
+        self.chunks.append({'file_id': file_id, 'rows': len(df), 'bytes': len(blob)})
+        self.row_count += len(df)
+        await asyncio.to_thread(self.sampler.update, df)
+
+    async def _write_sample(self) -> None:
+        # Small datasets are their own sample
+        sample = self.sampler.result()
+        if sample is None or self.row_count <= len(sample):
+            return
+        table = await asyncio.to_thread(pa.Table.from_pandas, sample, preserve_index=False)
+        blob = await asyncio.to_thread(self.store._to_parquet, table)
+        file_id = await self.store.bucket.upload_from_stream(
+            f"{self.dataset_id}/sample.parquet",
+            blob,
+            metadata={'dataset_id': self.dataset_id, 'rows': len(sample)}
+        )
+        self.sample = {'file_id': file_id, 'rows': len(sample), 'bytes': len(blob)}
+
+    def _to_table(self, df: pd.DataFrame) -> pa.Table:
+        # Reuse the first chunk's schema so chunks stay concatenable on load
+        if self.schema is None:
+            self.schema = pa.Schema.from_pandas(df, preserve_index=False)
+        try:
+            return pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            return pa.Table.from_pandas(df, preserve_index=False)
+
+    async def commit(self, content_hash: Optional[str] = None,
+                     dtypes: Optional[Dict[str, str]] = None,
+                     profile: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        await self._write_sample()
+        manifest = {
+            'dataset_id': self.dataset_id,
+            'format': 'parquet',
+            'content_hash': content_hash,
+            'dtypes': dtypes or {},
+            'profile': profile,
+            'ref_count': 1,
+            'row_count': self.row_count,
+            'columns': self.columns or [],
+            'data_preview': self.data_preview,
+            'chunks': self.chunks,
+            'sample': self.sample
+        }
+        await self.store.db.dataset_data.insert_one(manifest)
+        return manifest
+
+    async def abort(self) -> None:
+        """Remove chunks written so far after a failed ingest"""
+        for chunk in self.chunks + ([self.sample] if self.sample else []):
+            await self.store.bucket.delete(chunk['file_id'])
+        self.chunks = []
+        self.sample = None
+
+class DtypeCompactor:
+    """Chooses compact dtypes at ingest and applies them chunk by chunk.
+
+    The plan is made from the first chunk: integral floats become nullable
+    ints, date-like strings are parsed once, and other strings become
+    Arrow-backed strings, or categoricals when their cardinality is low. A
+    later chunk that does not fit widens the column's plan for the rest of
+    the upload, except for dates, where values that do not parse become
+    missing. Categoricals are stored as strings and restored on load from
+    the recorded dtypes.
+
+    Integers stay 64-bit: generated code does arithmetic on them, and
+    narrow ints wrap silently on overflow (Parquet compresses them anyway).
+    Datasets ingested when ints were downcast are widened again on load.
+    """
+
+    STRING_DTYPE = 'string[pyarrow]'
+    NARROW_INTS = {'int8': 'int64', 'int16': 'int64', 'int32': 'int64',
+                   'Int8': 'Int64', 'Int16': 'Int64', 'Int32': 'Int64'}
+
+    def __init__(self, category_max_ratio: float = CATEGORY_MAX_RATIO,
+                 category_max_values: int = CATEGORY_MAX_VALUES):
+        self.category_max_ratio = category_max_ratio
+        self.category_max_values = category_max_values
+        self.dtypes: Dict[str, str] = {}
+        self._date_formats: Dict[str, Optional[str]] = {}
+
+    def apply(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Convert a chunk to the planned storage dtypes"""
+        if not self.dtypes:
+            self.dtypes = {str(column): self._plan(df[column], str(column)) for column in df.columns}
+
+        df = df.copy(deep=False)
+        for column in df.columns:
+            target = self.dtypes.setdefault(str(column), str(df[column].dtype))
+            try:
+                df[column] = self._convert(df[column], str(column), target)
+            except (ValueError, TypeError, OverflowError):
+                widened = str(df[column].dtype)
+                self.dtypes[str(column)] = widened
+                df[column] = self._convert(df[column], str(column), widened)
+        return df
+
+    @classmethod
+    def execution_dtype(cls, dtype: str) -> str:
+        """The dtype a recorded dtype is loaded as: downcast ints come back as 64-bit"""
+        return cls.NARROW_INTS.get(dtype, dtype)
+
+    @classmethod
+    def execution_dtypes(cls, dtypes: Dict[str, str]) -> Dict[str, str]:
+        return {column: cls.execution_dtype(dtype) for column, dtype in dtypes.items()}
+
+    @classmethod
+    def restore(cls, df: pd.DataFrame, dtypes: Dict[str, str]) -> pd.DataFrame:
+        """Re-apply recorded dtypes that storage does not keep (e.g. categoricals)"""
+        for column in df.columns:
+            if str(df[column].dtype) in cls.NARROW_INTS:
+                df[column] = df[column].astype(cls.execution_dtype(str(df[column].dtype)))
+        for column, dtype in cls.execution_dtypes(dtypes).items():
+            if column in df.columns and str(df[column].dtype) != dtype:
+                try:
+                    df[column] = df[column].astype(dtype)
+                except (ValueError, TypeError):
+                    pass
+        return df
+
+    def _plan(self, series: pd.Series, column: str) -> str:
+        values = series.dropna()
+        if pd.api.types.is_bool_dtype(series) or values.empty:
+            return str(series.dtype)
+
+        if pd.api.types.is_integer_dtype(series):
+            return 'int64'
+
+        if pd.api.types.is_float_dtype(series):
+            if (values % 1 == 0).all() and abs(values).max() < 2 ** 63:
+                return 'Int64'
+            return str(series.dtype)
+
+        if pd.api.types.infer_dtype(values, skipna=True) != 'string':
+            return str(series.dtype)
+
+        # Require at least year and month so codes like '2020' stay strings
+        date_format = pd.tseries.api.guess_datetime_format(values.iloc[0])
+        if date_format and '%Y' in date_format and any(part in date_format for part in ('%m', '%b', '%B')):
+            try:
+                pd.to_datetime(values.head(1000), format=date_format)
+                self._date_formats[column] = date_format
+                return 'datetime64[ns]'
+            except (ValueError, TypeError):
+                pass
+
+        distinct = values.nunique()
+        if distinct <= self.category_max_values and distinct <= self.category_max_ratio * len(values):
+            return 'category'
+        return self.STRING_DTYPE
+
+    def _convert(self, series: pd.Series, column: str, target: str) -> pd.Series:
+        if target in ('int64', 'Int64'):
+            values = series.dropna()
+            info = np.iinfo('int64')
+            if not values.empty and (values.min() < info.min or values.max() > info.max):
+                raise OverflowError(f"{column} does not fit {target}")
+            if not values.empty and not (values % 1 == 0).all():
+                raise ValueError(f"{column} has non-integral values")
+            if target.islower() and len(values) != len(series):
+                raise ValueError(f"{column} has missing values")
+            return series.astype(target)
+
+        if target in ('category', self.STRING_DTYPE):
+            if pd.api.types.infer_dtype(series, skipna=True) not in ('string', 'empty'):
+                raise ValueError(f"{column} is not all strings")
+            return series.astype(self.STRING_DTYPE)
+
+        if target == 'datetime64[ns]':
+            date_format = self._date_formats.get(column)
+            try:
+                return pd.to_datetime(series, format=date_format)
+            except (ValueError, TypeError, OverflowError):
+                # Earlier chunks are already stored as dates, so values that do
+                # not parse become missing instead of mixing types in the column
+                parsed = pd.to_datetime(series, format=date_format, errors='coerce')
+                lost = int(parsed.isna().sum() - series.isna().sum())
+                logger.warning(f"{column}: {lost} values that are not dates were stored as missing")
+                return parsed
+
+        return series
+
+class ReservoirSampler:
+    """Uniform fixed-size row sample over a stream of chunks.
+
+    Every row gets a random key and the rows with the smallest keys are kept
+    (bottom-k sampling, equivalent to a reservoir). Chunks are filtered
+    against the current largest kept key, so steady-state cost is a single
+    vectorized comparison per chunk. The sample keeps the original row order.
+    """
+
+    def __init__(self, size: int = PREVIEW_SAMPLE_ROWS, seed: Optional[int] = None):
+        self.size = max(0, size)
+        self.row_count = 0
+        self._rng = np.random.default_rng(seed)
+        self._sample: Optional[pd.DataFrame] = None
+        self._keys = np.empty(0)
+        self._positions = np.empty(0, dtype=np.int64)
+
+    def update(self, df: pd.DataFrame) -> None:
+        keys = self._rng.random(len(df))
+        positions = np.arange(self.row_count, self.row_count + len(df))
+        self.row_count += len(df)
+        if self.size == 0:
+            return
+        if len(self._keys) >= self.size:
+            candidates = keys < self._keys.max()
+            df, keys, positions = df[candidates], keys[candidates], positions[candidates]
+        if self._sample is not None:
+            df = pd.concat([self._sample, df], ignore_index=True)
+            keys = np.concatenate([self._keys, keys])
+            positions = np.concatenate([self._positions, positions])
+        if len(keys) > self.size:
+            keep = np.sort(np.argpartition(keys, self.size - 1)[:self.size])
+            df, keys, positions = df.iloc[keep].reset_index(drop=True), keys[keep], positions[keep]
+        self._sample, self._keys, self._positions = df, keys, positions
+
+    def result(self) -> Optional[pd.DataFrame]:
+        """The sampled rows in their original order, or None if nothing was seen"""
+        if self._sample is None:
+            return None
+        order = np.argsort(self._positions, kind='stable')
+        return self._sample.iloc[order].reset_index(drop=True)
+
+def to_builtin(value: Any) -> Any:
+    """Convert numpy/pandas scalars to JSON- and BSON-safe Python values"""
+    if value is None or (not isinstance(value, (str, bytes)) and pd.api.types.is_scalar(value) and pd.isna(value)):
+        return None
+    if isinstance(value, (pd.Timestamp, datetime)):
+        return value.isoformat()
+    if isinstance(value, pd.Timedelta):
+        return str(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+class DatasetProfiler:
+    """Per-column statistics built in one vectorized pass over ingest chunks.
+
+    Tracks dtype, null count, min/max, a HyperLogLog distinct-count estimate,
+    approximate top-k values and, for numeric columns, a histogram merged
+    from per-chunk histograms.
+    """
+
+    HLL_PRECISION = 12  # 4096 registers, ~1.6% standard error
+    TOP_TRACKED = 1000  # Candidate values kept per column for top-k
+    CHUNK_BINS = 64
+
+    def __init__(self, top_k: int = PROFILE_TOP_K, bins: int = PROFILE_HISTOGRAM_BINS):
+        self.top_k = top_k
+        self.bins = bins
+        self.row_count = 0
+        self._columns: Dict[str, Dict[str, Any]] = {}
+
+    def update(self, df: pd.DataFrame) -> None:
+        self.row_count += len(df)
+        for column in df.columns:
+            self._update_column(str(column), df[column])
+
+    def _update_column(self, name: str, series: pd.Series) -> None:
+        state = self._columns.setdefault(name, {
+            'count': 0,
+            'null_count': 0,
+            'min': None,
+            'max': None,
+            'registers': np.zeros(2 ** self.HLL_PRECISION, dtype=np.uint8),
+            'top': {},
+            'histograms': []
+        })
+        state['dtype'] = str(series.dtype)
+        values = series.dropna()
+        state['count'] += len(series)
+        state['null_count'] += len(series) - len(values)
+        if values.empty:
+            return
+        if values.dtype == object:
+            values = self._hashable(values)
+
+        self._update_registers(state['registers'], values)
+
+        top = state['top']
+        for value, count in values.value_counts().head(self.TOP_TRACKED).items():
+            top[value] = top.get(value, 0) + int(count)
+        if len(top) > self.TOP_TRACKED:
+            state['top'] = dict(sorted(top.items(), key=lambda item: item[1], reverse=True)[:self.TOP_TRACKED])
+
+        try:
+            low, high = values.min(), values.max()
+            state['min'] = low if state['min'] is None else min(state['min'], low)
+            state['max'] = high if state['max'] is None else max(state['max'], high)
+        except TypeError:
+            pass  # Mixed types have no order
+
+        if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            counts, edges = np.histogram(values.to_numpy(dtype=float), bins=self.CHUNK_BINS)
+            state['histograms'].append((counts, edges))
+
+    @staticmethod
+    def _hashable(values: pd.Series) -> pd.Series:
+        """Nested JSON values (lists, dicts) as their JSON text, so they can be counted"""
+        nested = values.map(lambda value: isinstance(value, (list, dict)))
+        if not nested.any():
+            return values
+        values = values.copy()
+        values[nested] = values[nested].map(lambda value: json.dumps(value, sort_keys=True, default=str))
+        return values
+
+    def _update_registers(self, registers: np.ndarray, values: pd.Series) -> None:
+        precision = self.HLL_PRECISION
+        hashes = pd.util.hash_pandas_object(values, index=False).to_numpy()
+        buckets = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+        remainder = hashes << np.uint64(precision)
+        # Rank = position of the first set bit in the remaining bits
+        with np.errstate(divide='ignore'):
+            leading_zeros = 63 - np.floor(np.log2(remainder.astype(float)))
+        ranks = np.where(remainder == 0, 64 - precision + 1, np.minimum(leading_zeros + 1, 64 - precision + 1))
+        np.maximum.at(registers, buckets, ranks.astype(np.uint8))
+
+    @staticmethod
+    def _estimate_distinct(registers: np.ndarray) -> int:
+        m = len(registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.power(2.0, -registers.astype(float)))
+        zeros = int(np.count_nonzero(registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * np.log(m / zeros)  # Linear counting for small cardinalities
+        return int(round(estimate))
+
+    def _merge_histograms(self, state: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if not state['histograms']:
+            return None
+        low, high = float(state['min']), float(state['max'])
+        bins = self.bins if high > low else 1
+        edges = np.linspace(low, high if high > low else low + 1, bins + 1)
+        counts = np.zeros(bins, dtype=np.int64)
+        for chunk_counts, chunk_edges in state['histograms']:
+            centers = (chunk_edges[:-1] + chunk_edges[1:]) / 2
+            positions = np.clip(np.searchsorted(edges, centers, side='right') - 1, 0, bins - 1)
+            np.add.at(counts, positions, chunk_counts)
+        return {'edges': edges.tolist(), 'counts': counts.tolist()}
+
+    def result(self, dtypes: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """Final statistics; `dtypes` overrides the dtypes seen in the chunks"""
+        dtypes = dtypes or {}
+        columns = {}
+        for name, state in self._columns.items():
+            top = sorted(state['top'].items(), key=lambda item: item[1], reverse=True)[:self.top_k]
+            columns[name] = {
+                'dtype': dtypes.get(name, state['dtype']),
+                'count': state['count'],
+                'null_count': state['null_count'],
+                'distinct_estimate': min(self._estimate_distinct(state['registers']), state['count'] - state['null_count']),
+                'min': to_builtin(state['min']),
+                'max': to_builtin(state['max']),
+                'top_values': [{'value': to_builtin(value), 'count': count} for value, count in top],
+                'histogram': self._merge_histograms(state)
+            }
+        return {'row_count': self.row_count, 'columns': columns}
+
+class DataFrameCache:
+    """LRU cache of loaded DataFrames bounded by their deep memory usage"""
+
+    def __init__(self, max_bytes: int = DATAFRAME_CACHE_BYTES, name: str = 'dataframe'):
+        self.max_bytes = max_bytes
+        self.name = name  # Cache label in metrics
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+    def get(self, dataset_id: str, version: int, part: str = 'full') -> Optional[pd.DataFrame]:
+        entry = self._entries.get((dataset_id, version, part))
+        if entry is None:
+            self.misses += 1
+            metrics.inc('cache_requests_total', cache=self.name, result='miss')
+            return None
+        self._entries.move_to_end((dataset_id, version, part))
+        self.hits += 1
+        metrics.inc('cache_requests_total', cache=self.name, result='hit')
+        # Copy-on-write makes this shallow copy safe to hand to generated code
+        return entry[0].copy(deep=False)
+
+    def contains(self, dataset_id: str, version: int, part: str = 'full') -> bool:
+        """Whether a frame is cached, without counting a lookup"""
+        return (dataset_id, version, part) in self._entries
+
+    def put(self, dataset_id: str, version: int, df: pd.DataFrame, part: str = 'full') -> None:
+        size = int(df.memory_usage(deep=True).sum())
+        if size > self.max_bytes:
+            return
+        self._drop((dataset_id, version, part))
+        self._entries[(dataset_id, version, part)] = (df, size)
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            key = next(iter(self._entries))
+            self._drop(key)
+            self.evictions += 1
+
+    def invalidate(self, dataset_id: str) -> None:
+        """Drop every cached version and part of a dataset"""
+        for key in [key for key in self._entries if key[0] == dataset_id]:
+            self._drop(key)
+
+    def _drop(self, key: tuple) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[1]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.current_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+def schema_fingerprint(df: pd.DataFrame) -> str:
+    """Hash of a DataFrame's column names and dtypes"""
+    schema = [[str(column), str(dtype)] for column, dtype in df.dtypes.items()]
+    return hashlib.sha256(json.dumps(schema).encode()).hexdigest()
+
+class CodeCache:
+    """Persistent cache of generated code keyed by query text and dataset schema.
+
+    Entries live in the `code_cache` collection with a TTL and a cap on the
+    number of entries (least recently used are evicted first). Concurrent
+    misses for the same key share one in-flight generation.
+    """
+
+    def __init__(self, database, ttl_seconds: int = CODE_CACHE_TTL_SECONDS,
+                 max_entries: int = CODE_CACHE_MAX_ENTRIES):
+        self.collection = database.code_cache
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        return re.sub(r'\s+', ' ', query).strip().rstrip('?.!').strip().lower()
+
+    def make_key(self, query: str, fingerprint: str, engine: str = 'pandas') -> str:
+        scope = fingerprint if engine == 'pandas' else f"{engine}:{fingerprint}"
+        return hashlib.sha256(f"{scope}:{self.normalize_query(query)}".encode()).hexdigest()
+
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index('key', unique=True)
+        await self.collection.create_index('created_at', expireAfterSeconds=self.ttl_seconds)
+        await self.collection.create_index('last_used_at')
+
+    async def get(self, key: str) -> Optional[str]:
+        # The TTL monitor only runs once a minute, so check expiry here too
+        fresh_after = datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+        doc = await self.collection.find_one_and_update(
+            {'key': key, 'created_at': {'$gt': fresh_after}},
+            {'$set': {'last_used_at': datetime.utcnow()}, '$inc': {'hits': 1}},
+            projection={'code': 1}
+        )
+        return doc['code'] if doc else None
+
+    async def put(self, key: str, query: str, fingerprint: str, code: str) -> None:
+        now = datetime.utcnow()
+        await self.collection.update_one(
+            {'key': key},
+            {
+                '$set': {
+                    'query': self.normalize_query(query),
+                    'schema_fingerprint': fingerprint,
+                    'code': code,
+                    'created_at': now,
+                    'last_used_at': now
+                },
+                '$setOnInsert': {'hits': 0}
+            },
+            upsert=True
+        )
+        await self._evict()
+
+    async def discard(self, key: str) -> None:
+        await self.collection.delete_one({'key': key})
+
+    async def _evict(self) -> None:
+        excess = await self.collection.estimated_document_count() - self.max_entries
+        if excess <= 0:
+            return
+        stale = await self.collection.find({}, {'_id': 1}).sort('last_used_at', 1).to_list(excess)
+        await self.collection.delete_many({'_id': {'$in': [doc['_id'] for doc in stale]}})
+
+    async def get_or_generate(self, key: str, generate) -> tuple:
+        """Return (code, cached), sharing one `generate()` call per key"""
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            code = await self.get(key)
+            cached = code is not None
+            if not cached:
+                code = await generate()
+            future.set_result(code)
+            return code, cached
+        except BaseException as e:
+            future.set_exception(e)
+            # Waiters re-raise it; avoid "exception never retrieved" warnings
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+class ArtifactStore:
+    """Content-addressed store for rendered results (chart images, HTML).
+
+    Artifacts are saved once in GridFS under their SHA-256 hash and served
+    from /api/artifacts/{hash}; since the content behind a hash never
+    changes, clients may cache them forever.
+    """
+
+    def __init__(self, database, bucket_name: str = 'result_artifacts'):
+        self.bucket = AsyncIOMotorGridFSBucket(database, bucket_name=bucket_name)
+        self.files = database[f'{bucket_name}.files']
+
+    @staticmethod
+    def url_for(digest: str) -> str:
+        return f"/api/artifacts/{digest}"
+
+    async def put(self, data: bytes, content_type: str) -> str:
+        """Store `data` once and return its SHA-256 hash"""
+        digest = hashlib.sha256(data).hexdigest()
+        if not await self.files.find_one({'filename': digest}, {'_id': 1}):
+            await self.bucket.upload_from_stream(digest, data, metadata={'content_type': content_type})
+        return digest
+
+    async def open(self, digest: str):
+        """Open an artifact for reading, or None if it does not exist"""
+        try:
+            return await self.bucket.open_download_stream_by_name(digest)
+        except gridfs.errors.NoFile:
+            return None
+
+    async def externalize(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Replace inline chart/HTML payloads in a result with artifact URLs"""
+        data = result.get('data')
+        if not isinstance(data, str):
+            return result
+        if result.get('type') == 'chart':
+            content, content_type = base64.b64decode(data), 'image/png'
+        elif result.get('type') == 'plotly':
+            content, content_type = data.encode(), 'text/html; charset=utf-8'
+        else:
+            return result
+
+        digest = await self.put(content, content_type)
+        externalized = {key: value for key, value in result.items() if key != 'data'}
+        externalized.update({
+            'url': self.url_for(digest),
+            'content_type': content_type,
+            'size': len(content)
+        })
+        return externalized
+
+class ResultCache:
+    """Two-tier cache of execution results keyed by dataset content and code.
+
+    Recent results are kept in an in-process LRU; all results are also
+    persisted to the `result_cache` collection with a TTL. Results hold
+    artifact URLs rather than chart payloads, so cached entries stay small.
+    """
+
+    def __init__(self, database, memory_entries: int = RESULT_CACHE_MEMORY_ENTRIES,
+                 ttl_seconds: int = RESULT_CACHE_TTL_SECONDS):
+        self.collection = database.result_cache
+        self.memory_entries = memory_entries
+        self.ttl_seconds = ttl_seconds
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    @staticmethod
+    def make_key(data_token: str, code: str) -> str:
+        code_hash = hashlib.sha256(code.encode()).hexdigest()
+        return hashlib.sha256(f"{data_token}:{code_hash}".encode()).hexdigest()
+
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index('key', unique=True)
+        await self.collection.create_index('created_at', expireAfterSeconds=self.ttl_seconds)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        result = self._memory.get(key)
+        if result is not None:
+            self._memory.move_to_end(key)
+            return result
+
+        fresh_after = datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+        doc = await self.collection.find_one(
+            {'key': key, 'created_at': {'$gt': fresh_after}},
+            {'result': 1}
+        )
+        if not doc:
+            return None
+        self._remember(key, doc['result'])
+        return doc['result']
+
+    async def put(self, key: str, result: Dict[str, Any]) -> None:
+        self._remember(key, result)
+        try:
+            await self.collection.update_one(
+                {'key': key},
+                {'$set': {'result': result, 'created_at': datetime.utcnow()}},
+                upsert=True
+            )
+        except pymongo.errors.DocumentTooLarge:
+            # Very large tables stay memory-only
+            pass
+
+    def _remember(self, key: str, result: Dict[str, Any]) -> None:
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+class QueryIntentMatcher:
+    """Compiles simple aggregate/filter/sort/top-N questions to pandas code.
+
+    Only questions that fully match a small grammar, with every referenced
+    column resolving to exactly one real column, are compiled; anything
+    else returns None so the caller falls back to the LLM.
+    """
+
+    AGGREGATES = {
+        'sum': 'sum', 'total': 'sum',
+        'average': 'mean', 'avg': 'mean', 'mean': 'mean',
+        'median': 'median',
+        'max': 'max', 'maximum': 'max',
+        'min': 'min', 'minimum': 'min',
+        'count': 'count', 'number of': 'count',
+        'number of unique': 'nunique', 'number of distinct': 'nunique',
+        'count of unique': 'nunique', 'count of distinct': 'nunique',
+        'unique count': 'nunique', 'distinct count': 'nunique'
+    }
+    NUMERIC_AGGREGATES = {'sum', 'mean', 'median'}
+    ROW_WORDS = {'rows', 'records', 'entries', 'items', 'row', 'record', 'entry'}
+    OPERATORS = {
+        '>=': '>=', 'is at least': '>=', 'at least': '>=',
+        '<=': '<=', 'is at most': '<=', 'at most': '<=',
+        '!=': '!=', 'is not': '!=', 'not equal to': '!=',
+        '==': '==', '=': '==', 'is': '==', 'equals': '==', 'is equal to': '==',
+        '>': '>', 'is greater than': '>', 'greater than': '>', 'is more than': '>',
+        'more than': '>', 'above': '>', 'over': '>', 'after': '>',
+        '<': '<', 'is less than': '<', 'less than': '<', 'below': '<', 'under': '<', 'before': '<'
+    }
+    FILLER = re.compile(
+        r"^(?:(?:please|can you|could you|show me|show|give me|list|find|get|display|"
+        r"compute|calculate|tell me|what is|what's|what are|whats|the|all)\s+)+"
+    )
+    # Words that ask for something the grammar cannot express
+    UNSUPPORTED = re.compile(r"\b(?:chart|plot|graph|visuali[sz]e|trend|correlat\w*|and|or|percent\w*|ratio)\b")
+
+    def __init__(self):
+        aggregates = '|'.join(sorted(map(re.escape, self.AGGREGATES), key=len, reverse=True))
+        self._patterns = [
+            (re.compile(rf"^(?P<agg>{aggregates})(?: of)? (?P<value>.+?) "
+                        r"(?:by|per|for each|for every|grouped by|across each|across) (?P<group>.+)$"),
+             self._grouped_aggregate),
+            (re.compile(r"^(?P<direction>top|bottom|highest|lowest|largest|smallest) (?P<n>\d+)"
+                        r"(?: (?P<entity>.+?))? by (?P<column>.+)$"),
+             self._top_n),
+            (re.compile(r"^(?:count (?:of )?|number of |how many )(?:rows|records|entries)"
+                        r"(?: are there)?(?: (?:where|with|that have|having) (?P<condition>.+))?$"),
+             self._count_rows),
+            (re.compile(rf"^(?P<agg>{aggregates})(?: of)? (?P<value>.+)$"),
+             self._aggregate),
+            (re.compile(r"^(?:rows|records|data)? ?(?:where|with) (?P<condition>.+)$"),
+             self._filter_rows),
+            (re.compile(r"^(?:sort|order)(?: (?:rows|records|data|the data))? by (?P<column>.+?)"
+                        r"(?: (?P<direction>asc|ascending|desc|descending))?$"),
+             self._sort_rows)
+        ]
+
+    @staticmethod
+    def _normalize(text: str) -> str:
+        return re.sub(r'[\s_]+', ' ', text.lower()).strip()
+
+    def match(self, query: str, df: pd.DataFrame) -> Optional[str]:
+        """Pandas code answering `query`, or None if it is not understood"""
+        text = re.sub(r'\s+', ' ', query.lower()).strip().rstrip('?.!').strip()
+        text = self.FILLER.sub('', text)
+        if self.UNSUPPORTED.search(text):
+            return None
+        for pattern, compile_match in self._patterns:
+            found = pattern.match(text)
+            if found:
+                try:
+                    return compile_match(found.groupdict(), df)
+                except (KeyError, ValueError):
+                    return None
+        return None
+
+    def _column(self, phrase: Optional[str], df: pd.DataFrame) -> str:
+        """Resolve a phrase to exactly one column name or raise KeyError"""
+        if not phrase:
+            raise KeyError(phrase)
+        phrase = self._normalize(re.sub(r'^(?:the|each|every) ', '', phrase))
+        candidates = [column for column in df.columns if self._normalize(str(column)) == phrase]
+        if not candidates:
+            # Tolerate plurals ("prices" for "price", "categories" for "category")
+            singular = re.sub(r'ies$', 'y', phrase) if phrase.endswith('ies') else phrase.rstrip('s')
+            candidates = [column for column in df.columns if self._normalize(str(column)) == singular]
+        if len(candidates) != 1:
+            raise KeyError(phrase)
+        return candidates[0]
+
+    def _check_aggregate(self, func: str, column: str, df: pd.DataFrame) -> None:
+        series = df[column]
+        if func in self.NUMERIC_AGGREGATES and (
+                not pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series)):
+            raise ValueError(f"{func} needs a numeric column")
+        if func in ('min', 'max') and not (
+                pd.api.types.is_numeric_dtype(series) or pd.api.types.is_datetime64_any_dtype(series)):
+            raise ValueError(f"{func} needs an ordered column")
+
+    @staticmethod
+    def _table(expression: str) -> str:
+        return f"result_df = {expression}\nresult = {{'type': 'table', 'data': result_df.to_dict('records')}}"
+
+    def _grouped_aggregate(self, parts: Dict[str, str], df: pd.DataFrame) -> str:
+        func = self.AGGREGATES[parts['agg']]
+        group = self._column(parts['group'], df)
+        if func == 'count' and self._normalize(parts['value']) in self.ROW_WORDS:
+            return self._table(f"df.groupby({group!r}, observed=True).size().reset_index(name='count')")
+        value = self._column(parts['value'], df)
+        if value == group:
+            raise ValueError("value and group are the same column")
+        self._check_aggregate(func, value, df)
+        return self._table(
+            f"df.groupby({group!r}, observed=True)[{value!r}].{func}().reset_index()"
+            f".sort_values({value!r}, ascending=False)"
+        )
+
+    def _aggregate(self, parts: Dict[str, str], df: pd.DataFrame) -> str:
+        func = self.AGGREGATES[parts['agg']]
+        if func == 'count' and self._normalize(parts['value']) in self.ROW_WORDS:
+            return self._table("pd.DataFrame({'count': [len(df)]})")
+        value = self._column(parts['value'], df)
+        self._check_aggregate(func, value, df)
+        return self._table(f"pd.DataFrame({{{f'{func}_{value}'!r}: [df[{value!r}].{func}()]}})")
+
+    def _top_n(self, parts: Dict[str, str], df: pd.DataFrame) -> str:
+        # "top 5 categories by sales" ranks groups, which needs an aggregate
+        # only the LLM can choose; only rows are ranked here
+        if parts.get('entity') and self._normalize(parts['entity']) not in self.ROW_WORDS:
+            raise ValueError("top-N of something other than rows")
+        column = self._column(parts['column'], df)
+        if not pd.api.types.is_numeric_dtype(df[column]) or pd.api.types.is_bool_dtype(df[column]):
+            raise ValueError("top-N needs a numeric column")
+        method = 'nlargest' if parts['direction'] in ('top', 'highest', 'largest') else 'nsmallest'
+        return self._table(f"df.{method}({int(parts['n'])}, {column!r})")
+
+    def _count_rows(self, parts: Dict[str, str], df: pd.DataFrame) -> str:
+        if not parts.get('condition'):
+            return self._table("pd.DataFrame({'count': [len(df)]})")
+        mask = self._mask(parts['condition'], df)
+        return self._table(f"pd.DataFrame({{'count': [int(({mask}).sum())]}})")
+
+    def _filter_rows(self, parts: Dict[str, str], df: pd.DataFrame) -> str:
+        return self._table(f"df[{self._mask(parts['condition'], df)}]")
+
+    def _sort_rows(self, parts: Dict[str, str], df: pd.DataFrame) -> str:
+        column = self._column(parts['column'], df)
+        ascending = not (parts.get('direction') or '').startswith('desc')
+        return self._table(f"df.sort_values({column!r}, ascending={ascending})")
+
+    def _splits(self, condition: str) -> List[tuple]:
+        """Every (column phrase, operator, value) reading of a condition, leftmost first
+
+        Word operators must stand alone, so "discount" is not split at "is";
+        at the same position longer operators ("is at least") come first.
+        """
+        splits = []
+        for op in self.OPERATORS:
+            pattern = re.escape(op) if not op[0].isalpha() else rf"(?<=\s){re.escape(op)}(?=\s)"
+            for found in re.finditer(pattern, condition):
+                left, right = condition[:found.start()].strip(), condition[found.end():].strip()
+                if left and right:
+                    splits.append((found.start(), -len(op), left, op, right))
+        return [(left, op, right) for _, _, left, op, right in sorted(splits)]
+
+    def _mask(self, condition: str, df: pd.DataFrame) -> str:
+        """Boolean mask expression for a single-column condition"""
+        negated = condition.startswith('not ')
+        if negated:
+            condition = condition[4:]
+        try:
+            column = self._column(condition, df)
+        except KeyError:
+            column = None
+        if column is not None:
+            # Bare boolean column: "where in_stock", "where not in_stock"
+            if not pd.api.types.is_bool_dtype(df[column]):
+                raise ValueError("bare condition needs a boolean column")
+            mask = f"df[{column!r}].fillna(False).astype(bool)"
+            return f"~{mask}" if negated else mask
+        if negated:
+            raise ValueError("negation is only supported for boolean columns")
+
+        for phrase, op, raw in self._splits(condition):
+            try:
+                column = self._column(phrase, df)
+            except KeyError:
+                continue
+            break
+        else:
+            raise ValueError("condition not understood")
+        op = self.OPERATORS[op]
+        raw = raw.strip().strip('\'"')
+        series = df[column]
+
+        if pd.api.types.is_bool_dtype(series):
+            if raw not in ('true', 'false', 'yes', 'no') or op not in ('==', '!='):
+                raise ValueError("boolean columns compare to true/false")
+            return f"(df[{column!r}] {op} {raw in ('true', 'yes')})"
+        if pd.api.types.is_numeric_dtype(series):
+            value = float(raw)
+            value = int(value) if value.is_integer() else value
+            return f"(df[{column!r}] {op} {value!r})"
+        if pd.api.types.is_datetime64_any_dtype(series):
+            pd.Timestamp(raw)  # Raises ValueError if the value is not a date
+            return f"(df[{column!r}] {op} pd.Timestamp({raw!r}))"
+        if op not in ('==', '!='):
+            raise ValueError("text columns only support equality")
+        return f"(df[{column!r}].astype(str).str.lower() {op} {raw!r})"
+
+class ColumnUsageAnalyzer:
+    """Statically finds the dataset columns generated code can read.
+
+    Every use of `df` must end in a column selection (df['a'], df[['a', 'b']],
+    df.a, df.loc[rows, 'a']), possibly after row-wise steps such as filters,
+    sorts or a groupby, or be passed to len() or to a plotting call that
+    names its columns. The columns read are then the string constants and
+    attribute names in the code that match dataset columns. Anything else
+    (df.head() as a result, df.describe(), positional or dynamic access)
+    returns None, meaning every column must be loaded.
+    """
+
+    # Methods that keep the frame's columns and pick rows by named columns
+    ROW_METHODS = {'head', 'tail', 'sort_values', 'sort_index', 'nlargest', 'nsmallest',
+                   'sample', 'copy', 'reset_index', 'set_index', 'fillna'}
+    # Methods that look at every column unless given an explicit subset
+    SUBSET_METHODS = {'dropna', 'drop_duplicates'}
+    GROUP_METHODS = {'groupby', 'resample', 'rolling', 'expanding'}
+    PLOT_MODULES = {'px', 'sns'}
+    SINGLE_AXIS_PLOTS = {'histogram', 'pie', 'box', 'violin', 'strip', 'ecdf',
+                         'histplot', 'kdeplot', 'countplot', 'boxplot', 'violinplot'}
+    DYNAMIC_CALLS = {'eval', 'exec', 'globals', 'locals', 'vars', 'getattr'}
+
+    def referenced_columns(self, code: str, columns: List[str]) -> Optional[List[str]]:
+        """Columns `code` needs, in dataset order, or None if it cannot be told"""
+        try:
+            tree = ast.parse(code)
+        except SyntaxError:
+            return None
+        parents = {child: node for node in ast.walk(tree) for child in ast.iter_child_nodes(node)}
+        column_names = {str(column) for column in columns}
+
+        names = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in self.DYNAMIC_CALLS:
+                return None
+            if isinstance(node, ast.Name) and node.id == 'df' and not self._selects_columns(node, parents, column_names):
+                return None
+            if isinstance(node, ast.Constant) and isinstance(node.value, str):
+                names.add(node.value)
+            elif isinstance(node, ast.Attribute):
+                names.add(node.attr)
+
+        used = [column for column in columns if str(column) in names]
+        # Keep one column so row counts survive even when none is named
+        return used or list(columns[:1])
+
+    @staticmethod
+    def _is_column_key(node: ast.AST) -> bool:
+        if isinstance(node, ast.Constant):
+            return isinstance(node.value, str)
+        if isinstance(node, (ast.List, ast.Tuple)):
+            return bool(node.elts) and all(
+                isinstance(element, ast.Constant) and isinstance(element.value, str) for element in node.elts
+            )
+        return False
+
+    def _selects_columns(self, node: ast.AST, parents: Dict[ast.AST, ast.AST], column_names: set) -> bool:
+        """Follow the expression chain rooted at `df` up to where it selects columns"""
+        grouped = False
+        current = node
+        while True:
+            parent = parents.get(current)
+            if isinstance(parent, ast.Subscript) and parent.value is current:
+                if self._is_column_key(parent.slice):
+                    return True
+                if grouped:
+                    return False
+                current = parent  # Row filter or slice
+                continue
+
+            if isinstance(parent, ast.Attribute) and parent.value is current:
+                attr = parent.attr
+                if attr in ('loc', 'iloc', 'at', 'iat'):
+                    subscript = parents.get(parent)
+                    if grouped or not (isinstance(subscript, ast.Subscript) and subscript.value is parent):
+                        return False
+                    if isinstance(subscript.slice, ast.Tuple):
+                        return (attr == 'loc' and len(subscript.slice.elts) == 2
+                                and self._is_column_key(subscript.slice.elts[1]))
+                    current = subscript  # Row selection
+                    continue
+
+                call = parents.get(parent)
+                is_call = isinstance(call, ast.Call) and call.func is parent
+                if grouped:
+                    if is_call and attr == 'size':
+                        return True
+                    return is_call and attr in ('agg', 'aggregate') and bool(call.args) and isinstance(call.args[0], ast.Dict)
+                if attr in column_names and not hasattr(pd.DataFrame, attr):
+                    return True
+                if not is_call:
+                    return False
+                if attr in self.GROUP_METHODS:
+                    grouped = True
+                elif not (attr in self.ROW_METHODS or (
+                        attr in self.SUBSET_METHODS and any(keyword.arg == 'subset' for keyword in call.keywords))):
+                    return False
+                current = call
+                continue
+
+            if isinstance(parent, ast.Call) and not grouped:
+                if isinstance(parent.func, ast.Name) and parent.func.id == 'len':
+                    return True
+                return self._is_plot_call(parent, current)
+            return False
+
+    def _is_plot_call(self, call: ast.Call, data: ast.AST) -> bool:
+        """px/sns call taking `data` as its frame and naming the columns it plots"""
+        func = call.func
+        if not (isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name)
+                and func.value.id in self.PLOT_MODULES):
+            return False
+        if not ((call.args and call.args[0] is data) or any(
+                keyword.value is data and keyword.arg in ('data_frame', 'data') for keyword in call.keywords)):
+            return False
+        named = {keyword.arg for keyword in call.keywords if self._is_column_key(keyword.value)}
+        if {'x', 'y'} <= named:
+            return True
+        return func.attr in self.SINGLE_AXIS_PLOTS and bool(named & {'x', 'y', 'names', 'values'})
+
+class RowPager:
+    """Pages through a DataFrame's rows, sorted by a column and filtered.
+
+    A column's sort order is computed the first time a page is sorted by it
+    and kept in an LRU bounded by its size, so scrolling through a sorted
+    table only slices a precomputed permutation. Filters are
+    `column:op[:value]` strings with op one of eq, ne, lt, le, gt, ge,
+    contains, null or notnull; values are read as the column's type.
+    """
+
+    FILTER_PATTERN = re.compile(r'^(?P<column>.+?):(?P<op>eq|ne|lt|le|gt|ge|contains|null|notnull)(?::(?P<value>.*))?$')
+
+    def __init__(self, max_bytes: int = SORT_INDEX_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._orders: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+    async def page(self, key: Optional[tuple], df: pd.DataFrame, offset: int, limit: int,
+                   sort: Optional[str] = None, descending: bool = False,
+                   filters: List[str] = ()) -> Dict[str, Any]:
+        """One page of `df`; `key` identifies the frame's data for reusing sort orders"""
+        order = None
+        if sort is not None:
+            if sort not in df.columns:
+                raise ValueError(f"Unknown sort column: {sort}")
+            order = await self.sort_order(key, df, sort)
+        return await asyncio.to_thread(self._page, df, order, descending, offset, limit, filters)
+
+    async def sort_order(self, key: Optional[tuple], df: pd.DataFrame, column: str) -> tuple:
+        """(ascending row order with nulls last, non-null count) for a column"""
+        if key is None:
+            return await asyncio.to_thread(self._argsort, df[column])
+        cache_key = (*key, column)
+        entry = self._orders.get(cache_key)
+        if entry is not None:
+            self._orders.move_to_end(cache_key)
+            return entry
+        entry = await asyncio.to_thread(self._argsort, df[column])
+        size = entry[0].nbytes
+        if size <= self.max_bytes:
+            self._drop(cache_key)
+            self._orders[cache_key] = entry
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                self._drop(next(iter(self._orders)))
+        return entry
+
+    def _drop(self, key: tuple) -> None:
+        entry = self._orders.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[0].nbytes
+
+    @staticmethod
+    def _argsort(series: pd.Series) -> tuple:
+        values = series.reset_index(drop=True)
+        try:
+            order = values.sort_values(kind='stable', na_position='last').index.to_numpy()
+        except TypeError:
+            # Mixed types in an object column: order by their text
+            order = values.astype(str).where(values.notna()).sort_values(
+                kind='stable', na_position='last'
+            ).index.to_numpy()
+        positions = order.astype(np.int32 if len(order) < 2 ** 31 else np.int64)
+        return positions, int(values.notna().sum())
+
+    def _page(self, df: pd.DataFrame, order: Optional[tuple], descending: bool,
+              offset: int, limit: int, filters: List[str]) -> Dict[str, Any]:
+        mask = self._filter_mask(df, filters) if filters else None
+        if order is None:
+            positions = np.flatnonzero(mask) if mask is not None else None
+        else:
+            positions, valid = order
+            if descending:
+                positions = np.concatenate([positions[:valid][::-1], positions[valid:]])
+            if mask is not None:
+                positions = positions[mask[positions]]
+
+        if positions is None:
+            return self.encode(df.iloc[offset:offset + limit], offset, len(df))
+        return self.encode(df.iloc[positions[offset:offset + limit]], offset, len(positions))
+
+    @staticmethod
+    def encode(rows: pd.DataFrame, offset: int, total_rows: int) -> Dict[str, Any]:
+        """A page of rows in the columnar table shape"""
+        table = sandbox.table_result(rows.reset_index(drop=True))
+        return {'columns': table['columns'], 'dtypes': table['dtypes'], 'data': table['data'],
+                'offset': offset, 'total_rows': total_rows}
+
+    def _filter_mask(self, df: pd.DataFrame, filters: List[str]) -> np.ndarray:
+        mask = np.ones(len(df), dtype=bool)
+        for spec in filters:
+            match = self.FILTER_PATTERN.match(spec)
+            if not match:
+                raise ValueError(f"Invalid filter {spec!r}; expected column:op:value")
+            column, op, value = match.group('column', 'op', 'value')
+            if column not in df.columns:
+                raise ValueError(f"Unknown filter column: {column}")
+            series = df[column]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                series = series.astype(series.cat.categories.dtype)
+
+            if op == 'null':
+                condition = series.isna()
+            elif op == 'notnull':
+                condition = series.notna()
+            elif value is None:
+                raise ValueError(f"Filter {spec!r} needs a value")
+            elif op == 'contains':
+                condition = series.astype('string').str.contains(value, case=False, regex=False)
+            else:
+                try:
+                    target = self._coerce(series, value)
+                except ValueError:
+                    raise ValueError(f"Invalid {op} value for {column}: {value!r}")
+                try:
+                    condition = getattr(operator, op)(series, target)
+                except TypeError as e:
+                    raise ValueError(f"Cannot apply {op} to {column}: {e}")
+            mask &= np.asarray(condition.fillna(False), dtype=bool)
+        return mask
+
+    @staticmethod
+    def _coerce(series: pd.Series, value: str) -> Any:
+        """A filter value as the column's type"""
+        if pd.api.types.is_bool_dtype(series):
+            if value.lower() not in ('true', 'false', '1', '0'):
+                raise ValueError(f"Expected true or false, got {value!r}")
+            return value.lower() in ('true', '1')
+        if pd.api.types.is_numeric_dtype(series):
+            return float(value)
+        if pd.api.types.is_datetime64_any_dtype(series):
+            timestamp = pd.Timestamp(value)
+            if series.dt.tz is not None and timestamp.tzinfo is None:
+                return timestamp.tz_localize(series.dt.tz)
+            if series.dt.tz is None and timestamp.tzinfo is not None:
+                return timestamp.tz_convert(None)
+            return timestamp
+        return value
+
+class QueryJob:
+    """A queued query and the future its submitter waits on"""
+
+    def __init__(self, request: QueryRequest, emit=None, placeholder: Optional[Query] = None,
+                 preview: bool = False):
+        self.request = request
+        self.emit = emit
+        self.placeholder = placeholder
+        self.preview = preview
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+class QueryJobQueue:
+    """Bounded in-process queue feeding a fixed pool of query workers
+
+    Submitting to a full queue raises 429 with a Retry-After estimated from
+    recent job durations. Jobs submitted in the background are tracked by a
+    placeholder Query document whose status moves queued -> running ->
+    done/failed. Placeholders record the instance that owns them and a
+    heartbeat it refreshes while the job is pending, so any instance can
+    fail jobs whose owner went away without touching live ones.
+    """
+
+    def __init__(self, workers: int = QUERY_WORKERS, max_depth: int = QUERY_QUEUE_DEPTH,
+                 heartbeat_seconds: float = JOB_HEARTBEAT_SECONDS, stale_seconds: float = JOB_STALE_SECONDS):
+        self.workers = workers
+        self.max_depth = max_depth
+        self.heartbeat_seconds = heartbeat_seconds
+        self.stale_seconds = stale_seconds
+        self.instance_id = uuid.uuid4().hex
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._background: set = set()  # Placeholder ids of this instance's pending jobs
+        self._reserved = 0  # Slots held by submissions still writing their placeholder
+        self._average_seconds = 1.0
+        self.running = 0
+
+    async def start(self) -> None:
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_depth)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+
+    async def shutdown(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def retry_after(self) -> int:
+        """Seconds until a queue slot is likely to free up"""
+        return max(1, math.ceil(self._average_seconds * (self.depth + 1) / self.workers))
+
+    async def submit(self, request: QueryRequest, emit=None, background: bool = False,
+                     preview: bool = False) -> QueryJob:
+        """Queue a query, raising 429 if the queue is full"""
+        if self._queue is None:
+            await self.start()
+        # Checked and reserved without awaiting in between, so a burst of
+        # submissions cannot all pass the check and overfill the queue
+        if self.max_depth > 0 and self._queue.qsize() + self._reserved >= self.max_depth:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many queries in progress, please retry later",
+                headers={'Retry-After': str(self.retry_after())}
+            )
+
+        placeholder = None
+        self._reserved += 1
+        try:
+            if background:
+                placeholder = Query(
+                    dataset_id=request.dataset_id,
+                    query_text=request.query_text,
+                    generated_code='',
+                    result_type='pending',
+                    engine=request.engine,
+                    status='queued'
+                )
+                await db.queries.insert_one({**placeholder.dict(), 'owner': self.instance_id,
+                                             'heartbeat_at': datetime.utcnow()})
+                self._background.add(placeholder.id)
+        finally:
+            self._reserved -= 1
+        job = QueryJob(request, emit, placeholder, preview)
+        self._queue.put_nowait(job)
+        return job
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                if not job.future.cancelled():
+                    await self._run(job)
+            finally:
+                if job.placeholder is not None:
+                    self._background.discard(job.placeholder.id)
+                self._queue.task_done()
+
+    async def _run(self, job: QueryJob) -> None:
+        started = time.perf_counter()
+        self.running += 1
+        if job.placeholder is not None:
+            await db.queries.update_one({"id": job.placeholder.id},
+                                        {"$set": {"status": "running", "heartbeat_at": datetime.utcnow()}})
+
+        task = asyncio.create_task(run_query(job.request, job.emit, job.placeholder, job.preview))
+        # A submitter that stops waiting (e.g. a closed stream) cancels the query
+        job.future.add_done_callback(lambda future: task.cancel() if future.cancelled() else None)
+        try:
+            query = await task
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                raise
+        except Exception as e:
+            if job.placeholder is not None:
+                detail = e.detail if isinstance(e, HTTPException) else str(e)
+                await db.queries.update_one(
+                    {"id": job.placeholder.id},
+                    {"$set": {"status": "failed", "result_type": "error",
+                              "error_message": f"Error processing query: {detail}"}}
+                )
+            if not job.future.done():
+                # Nobody waits on a background job; its failure is recorded above
+                if job.placeholder is not None:
+                    job.future.set_result(None)
+                else:
+                    job.future.set_exception(e)
+        else:
+            if not job.future.done():
+                job.future.set_result(query)
+        finally:
+            self.running -= 1
+            elapsed = time.perf_counter() - started
+            self._average_seconds = 0.8 * self._average_seconds + 0.2 * elapsed
+
+    async def _heartbeat(self) -> None:
+        """Keep this instance's pending jobs marked alive and fail abandoned ones"""
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            try:
+                if self._background:
+                    await db.queries.update_many(
+                        {"id": {"$in": list(self._background)}, "owner": self.instance_id},
+                        {"$set": {"heartbeat_at": datetime.utcnow()}}
+                    )
+                await self.fail_abandoned()
+            except pymongo.errors.PyMongoError as e:
+                logger.warning(f"Could not refresh background query heartbeats: {e}")
+
+    async def fail_abandoned(self) -> None:
+        """Mark background queries whose owner stopped refreshing them as failed
+
+        Placeholders from before heartbeats were recorded count as abandoned
+        once they are as old as a stale heartbeat.
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=self.stale_seconds)
+        await db.queries.update_many(
+            {"status": {"$in": ["queued", "running"]},
+             "$or": [{"heartbeat_at": {"$lt": cutoff}},
+                     {"heartbeat_at": {"$exists": False}, "created_at": {"$lt": cutoff}}]},
+            {"$set": {"status": "failed", "result_type": "error",
+                      "error_message": "Server stopped before the query finished"}}
+        )
+
 # Initialize services
+metrics = MetricsRegistry()
+metrics.histogram('query_stage_seconds', 'Time spent in each stage of answering a query')
+metrics.histogram('upload_stage_seconds', 'Time spent in each stage of ingesting an upload')
+metrics.counter('queries_total', 'Queries answered, by engine, code source and result type')
+metrics.counter('uploads_total', 'Dataset uploads, by outcome')
+metrics.counter('cache_requests_total', 'Cache lookups, by cache and whether they hit')
+metrics.counter('llm_tokens_total', 'LLM tokens sent and received, estimated from text length')
 code_generator = CodeGenerationService(GEMINI_API_KEY) if GEMINI_API_KEY else None
-code_executor = CodeExecutor()
+code_executor = CodeExecutor(ExecutionPool())
+sql_engine = SqlEngine(code_executor)
+dataset_store = DatasetStore(db)
+dataframe_cache = DataFrameCache()
+query_result_cache = DataFrameCache(QUERY_RESULT_CACHE_BYTES, name='query_result')
+code_cache = CodeCache(db)
+intent_matcher = QueryIntentMatcher()
+column_analyzer = ColumnUsageAnalyzer()
+llm_slots = asyncio.Semaphore(LLM_CONCURRENCY)
+artifact_store = ArtifactStore(db)
+result_cache = ResultCache(db)
+job_queue = QueryJobQueue()
+row_pager = RowPager()
+metrics.gauge('active_executions', 'Generated code or SQL currently executing', lambda: [
+    ({'engine': 'pandas'}, code_executor.pool.active), ({'engine': 'sql'}, sql_engine.active)
+])
+metrics.gauge('query_queue_depth', 'Queries waiting for a query worker', lambda: job_queue.depth)
+metrics.gauge('query_jobs_running', 'Queries being processed', lambda: job_queue.running)
+metrics.gauge('dataframe_cache_bytes', 'Memory held by cached DataFrames', lambda: dataframe_cache.current_bytes)
+metrics.gauge('query_result_cache_bytes', 'Memory held by table results being paged',
+              lambda: query_result_cache.current_bytes)
+
+def dataset_storage_key(dataset: Dataset) -> tuple:
+    """(stored data id, version); datasets sharing stored data share this key"""
+    return (dataset.data_id or dataset.id, dataset.version)
+
+def frame_part(columns: Optional[List[str]] = None) -> str:
+    """Cache and shared-frame key part for a column projection"""
+    return 'full' if columns is None else 'columns:' + json.dumps(columns)
+
+async def load_dataframe(dataset: Dataset, columns: Optional[List[str]] = None) -> Optional[pd.DataFrame]:
+    """Load a dataset's DataFrame, or just `columns` of it, going through the in-process cache"""
+    data_id, version = dataset_storage_key(dataset)
+    if columns is not None and dataframe_cache.contains(data_id, version):
+        # A cached full frame serves any projection
+        return dataframe_cache.get(data_id, version)[columns]
+    df = dataframe_cache.get(data_id, version, frame_part(columns))
+    if df is not None:
+        return df
+    df = await dataset_store.load(data_id, columns)
+    if df is not None:
+        dataframe_cache.put(data_id, version, df, frame_part(columns))
+        df = df.copy(deep=False)
+    return df
+
+async def load_dataset_table(dataset: Dataset, columns: Optional[List[str]] = None):
+    """A dataset's data for the SQL engine: the cached DataFrame if there is one, else Arrow"""
+    data_id, version = dataset_storage_key(dataset)
+    if dataframe_cache.contains(data_id, version):
+        df = dataframe_cache.get(data_id, version)
+        return df[columns] if columns is not None else df
+    return await dataset_store.load_table(data_id, columns)
+
+def schema_frame(dataset: Dataset) -> Optional[pd.DataFrame]:
+    """Zero-row frame with a dataset's columns and ingest dtypes, if they were recorded"""
+    if not dataset.dtypes or set(dataset.dtypes) != {str(column) for column in dataset.columns}:
+        return None
+    dtypes = DtypeCompactor.execution_dtypes(dataset.dtypes)
+    try:
+        return pd.DataFrame({column: pd.Series(dtype=dtypes[str(column)]) for column in dataset.columns})
+    except (TypeError, ValueError):
+        return None
+
+async def load_sample(dataset: Dataset) -> Optional[pd.DataFrame]:
+    """Load a dataset's ingest-time row sample, if it has one"""
+    data_id, version = dataset_storage_key(dataset)
+    sample = dataframe_cache.get(data_id, version, 'sample')
+    if sample is not None:
+        return sample
+    sample = await dataset_store.load_sample(data_id)
+    if sample is not None:
+        dataframe_cache.put(data_id, version, sample, 'sample')
+        sample = sample.copy(deep=False)
+    return sample
+
+async def load_profile(dataset: Dataset) -> Optional[Dict[str, Any]]:
+    """Get a dataset's column profile, computing it for datasets ingested without one"""
+    data_id, _ = dataset_storage_key(dataset)
+    profile = await dataset_store.load_profile(data_id)
+    if profile is None:
+        df = await load_dataframe(dataset)
+        if df is None:
+            return None
+        profiler = DatasetProfiler()
+        await asyncio.to_thread(profiler.update, df)
+        profile = profiler.result()
+        await dataset_store.save_profile(data_id, profile)
+    return profile
+
+async def generate_with_profile(query_text: str, dataset: Dataset,
+                                profile: Optional[Dict[str, Any]] = None, engine: str = 'pandas') -> str:
+    """Generate code with the dataset's column statistics in the prompt"""
+    if not code_generator:
+        raise HTTPException(status_code=500, detail="LLM service not configured")
+    if profile is None:
+        profile = await load_profile(dataset)
+    async with llm_slots:
+        with metrics.time('query_stage_seconds', stage='llm'):
+            return await code_generator.generate_code(query_text, {**dataset.dict(), 'profile': profile}, engine)
+
+def hash_file(fileobj, block_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a file object's contents, leaving it rewound"""
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for block in iter(lambda: fileobj.read(block_size), b''):
+        digest.update(block)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+def dataset_data_token(dataset: Dataset) -> str:
+    """Identifies a dataset's data, shared by datasets with identical content"""
+    return dataset.content_hash or f"{dataset.id}:{dataset.version}"
+
+def encode_cursor(value: Any, item_id: str) -> str:
+    """Opaque keyset cursor pointing just past an item"""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([value, item_id]).encode()).decode()
+
+def decode_cursor(cursor: str, is_time: bool = True) -> tuple:
+    try:
+        value, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return (datetime.fromisoformat(value) if is_time else value), item_id
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def field_value(document: Dict[str, Any], field: str) -> Any:
+    """A possibly dotted field of a document, or None if it is missing"""
+    for part in field.split('.'):
+        document = document.get(part) if isinstance(document, dict) else None
+    return document
+
+async def fetch_page(collection, query_filter: Dict[str, Any], time_field: str, projection: Dict[str, int],
+                     limit: int, cursor: Optional[str], sort_field: Optional[str] = None) -> tuple:
+    """Fetch one newest-first page of documents using keyset pagination.
+
+    With `sort_field`, only documents that have that field are returned,
+    largest first. Returns (documents, next_cursor); next_cursor is None on
+    the last page.
+    """
+    key_field = sort_field or time_field
+    if sort_field:
+        query_filter = {**query_filter, sort_field: {'$ne': None}}
+    if cursor:
+        value, item_id = decode_cursor(cursor, is_time=sort_field is None)
+        query_filter = {
+            **query_filter,
+            '$or': [
+                {key_field: {'$lt': value}},
+                {key_field: value, 'id': {'$lt': item_id}}
+            ]
+        }
+    docs = await collection.find(query_filter, projection).sort(
+        [(key_field, -1), ('id', -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(field_value(docs[-1], key_field), docs[-1]['id'])
+    return docs, next_cursor
+
+def iter_upload_frames(fileobj, filename: str, chunk_rows: int):
+    """Parse an uploaded file into DataFrame chunks of at most `chunk_rows` rows"""
+    if filename.endswith('.csv'):
+        yield from pd.read_csv(fileobj, encoding='utf-8', chunksize=chunk_rows)
+    elif filename.endswith(('.jsonl', '.ndjson')):
+        yield from pd.read_json(fileobj, lines=True, encoding='utf-8', chunksize=chunk_rows)
+    else:
+        # Plain JSON documents cannot be parsed incrementally
+        data = json.load(io.TextIOWrapper(fileobj, encoding='utf-8'))
+        df = pd.DataFrame(data) if isinstance(data, list) else pd.json_normalize(data)
+        for start in range(0, max(len(df), 1), chunk_rows):
+            yield df.iloc[start:start + chunk_rows]
 
 @api_router.post("/upload-dataset")
 async def upload_dataset(file: UploadFile = File(...)):
     """Upload and process a CSV or JSON dataset"""
+    timer = StageTimer(metrics, 'upload_stage_seconds')
+    started = time.perf_counter()
     try:
-        # Read file content
-        content = await file.read()
-        
-        # Determine file type and process
+        # Determine file type
         if file.filename.endswith('.csv'):
-            df = pd.read_csv(io.StringIO(content.decode('utf-8')))
             file_type = 'csv'
-        elif file.filename.endswith('.json'):
-            data = json.loads(content.decode('utf-8'))
-            df = pd.DataFrame(data) if isinstance(data, list) else pd.json_normalize(data)
+        elif file.filename.endswith(('.json', '.jsonl', '.ndjson')):
             file_type = 'json'
         else:
             raise HTTPException(status_code=400, detail="Only CSV and JSON files are supported")
         
+        # Hash the spooled upload before parsing so duplicates skip ingest
+        with timer.stage('hash'):
+            content_hash = await asyncio.to_thread(hash_file, file.file)
+        
+        # A byte-identical file has already been parsed and stored; share it
+        with timer.stage('dedupe'):
+            manifest = await dataset_store.acquire(content_hash)
+        if manifest:
+            dataset = Dataset(
+                name=file.filename,
+                file_type=file_type,
+                columns=manifest['columns'],
+                row_count=manifest['row_count'],
+                data_preview=manifest['data_preview'],
+                content_hash=content_hash,
+                data_id=manifest['dataset_id'],
+                dtypes=manifest.get('dtypes', {})
+            )
+            with timer.stage('store'):
+                await db.datasets.insert_one(dataset.dict())
+            metrics.inc('uploads_total', outcome='deduplicated')
+            return dataset
+        
+        # Starlette has already spooled the upload to a temporary file, so parse
+        # it from there in bounded chunks off the event loop and store each
+        # chunk as soon as it is parsed
+        dataset_id = str(uuid.uuid4())
+        writer = dataset_store.open_writer(dataset_id)
+        frames = iter_upload_frames(file.file, file.filename, dataset_store.chunk_rows)
+        compactor = DtypeCompactor() if DTYPE_COMPACTION else None
+        profiler = DatasetProfiler()
+        try:
+            while True:
+                with timer.stage('parse'):
+                    chunk = await asyncio.to_thread(next, frames, None)
+                if chunk is None:
+                    break
+                if compactor:
+                    with timer.stage('compact'):
+                        chunk = await asyncio.to_thread(compactor.apply, chunk)
+                with timer.stage('profile'):
+                    await asyncio.to_thread(profiler.update, chunk)
+                with timer.stage('write'):
+                    await writer.write(chunk)
+            if writer.columns is None:
+                raise ValueError("No rows found in file")
+            dtypes = compactor.dtypes if compactor else {}
+            with timer.stage('commit'):
+                await writer.commit(content_hash, dtypes, profiler.result(dtypes))
+        except Exception:
+            await writer.abort()
+            raise
+        
         # Create dataset info
         dataset = Dataset(
+            id=dataset_id,
             name=file.filename,
             file_type=file_type,
-            columns=df.columns.tolist(),
-            row_count=len(df),
-            data_preview=df.head().to_dict('records')
+            columns=writer.columns,
+            row_count=writer.row_count,
+            data_preview=writer.data_preview,
+            content_hash=content_hash,
+            dtypes=dtypes
         )
         
         # Store dataset info in MongoDB
-        await db.datasets.insert_one(dataset.dict())
-        
-        # Store actual data in a separate collection for efficiency
-        data_records = df.to_dict('records')
-        await db.dataset_data.insert_one({
-            'dataset_id': dataset.id,
-            'data': data_records
-        })
+        with timer.stage('store'):
+            await db.datasets.insert_one(dataset.dict())
+        metrics.inc('uploads_total', outcome='stored')
         
         return dataset
         
     except Exception as e:
+        metrics.inc('uploads_total', outcome='failed')
         raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
+    finally:
+        timer.seconds['total'] = time.perf_counter() - started
+        timer.record()
 
-@api_router.get("/datasets", response_model=List[Dataset])
-async def get_datasets():
-    """Get all uploaded datasets"""
-    datasets = await db.datasets.find().to_list(1000)
-    return [Dataset(**dataset) for dataset in datasets]
+@api_router.get("/datasets", response_model=DatasetPage)
+async def get_datasets(
+    limit: int = QueryParam(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
+    """Get uploaded datasets, newest first, one page at a time"""
+    datasets, next_cursor = await fetch_page(
+        db.datasets, {}, 'uploaded_at', DATASET_PROJECTION, limit, cursor
+    )
+    return DatasetPage(items=[Dataset(**dataset) for dataset in datasets], next_cursor=next_cursor)
 
-@api_router.post("/query")
-async def process_query(request: QueryRequest):
-    """Process a natural language query against a dataset"""
+@api_router.get("/datasets/{dataset_id}/profile")
+async def get_dataset_profile(dataset_id: str):
+    """Get per-column statistics computed at ingest"""
+    dataset_doc = await db.datasets.find_one({"id": dataset_id}, DATASET_PROJECTION)
+    if not dataset_doc:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    profile = await load_profile(Dataset(**dataset_doc))
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Dataset data not found")
+    return {"dataset_id": dataset_id, **profile}
+
+@api_router.get("/datasets/{dataset_id}/rows", response_model=RowPage)
+async def get_dataset_rows(
+    dataset_id: str,
+    offset: int = QueryParam(0, ge=0),
+    limit: int = QueryParam(DEFAULT_PAGE_SIZE, ge=1, le=MAX_ROW_PAGE_SIZE),
+    sort: Optional[str] = None,
+    descending: bool = False,
+    filter: List[str] = QueryParam([])
+):
+    """Page through a dataset's rows, optionally sorted by a column and filtered
+
+    Filters are column:op:value (op: eq, ne, lt, le, gt, ge, contains) or
+    column:null / column:notnull, and may be repeated.
+    """
+    dataset = await fetch_dataset(dataset_id)
+    data_id, version = dataset_storage_key(dataset)
     try:
-        if not code_generator:
-            raise HTTPException(status_code=500, detail="LLM service not configured")
+        if sort is None and not filter and not dataframe_cache.contains(data_id, version):
+            # A plain page only needs the chunks it falls in
+            rows = await dataset_store.load_rows(data_id, offset, limit)
+            if rows is None:
+                raise HTTPException(status_code=404, detail="Dataset data not found")
+            return ORJSONResponse(RowPager.encode(rows, offset, dataset.row_count))
         
-        # Get dataset info
-        dataset_doc = await db.datasets.find_one({"id": request.dataset_id})
-        if not dataset_doc:
-            raise HTTPException(status_code=404, detail="Dataset not found")
-        
-        dataset = Dataset(**dataset_doc)
-        
-        # Get dataset data
-        data_doc = await db.dataset_data.find_one({"dataset_id": request.dataset_id})
-        if not data_doc:
+        df = await load_dataframe(dataset)
+        if df is None:
             raise HTTPException(status_code=404, detail="Dataset data not found")
-        
-        df = pd.DataFrame(data_doc['data'])
-        
-        # Generate code from natural language query
-        generated_code = await code_generator.generate_code(
-            request.query_text, 
-            dataset.dict()
+        page = await row_pager.page((data_id, version), df, offset, limit, sort, descending, filter)
+        return ORJSONResponse(page)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@api_router.delete("/datasets/{dataset_id}")
+async def delete_dataset(dataset_id: str):
+    """Delete a dataset, its stored data and its queries"""
+    dataset_doc = await db.datasets.find_one_and_delete({"id": dataset_id}, projection={"data_id": 1})
+    if not dataset_doc:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+
+    # Stored data may be shared with identical uploads; drop it with the last one
+    data_id = dataset_doc.get('data_id') or dataset_id
+    if await dataset_store.release(data_id):
+        dataframe_cache.invalidate(data_id)
+        code_executor.pool.invalidate(data_id)
+    await db.queries.delete_many({"dataset_id": dataset_id})
+    return {"deleted": dataset_id}
+
+@api_router.get("/cache/stats")
+async def get_cache_stats():
+    """Get hit/miss statistics for the DataFrame cache and the query result cache"""
+    return {**dataframe_cache.stats(), 'query_results': query_result_cache.stats()}
+
+async def fetch_dataset(dataset_id: str) -> Dataset:
+    """Fetch a dataset's metadata or raise 404"""
+    dataset_doc = await db.datasets.find_one({"id": dataset_id}, DATASET_PROJECTION)
+    if not dataset_doc:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    return Dataset(**dataset_doc)
+
+async def load_query_dataset(dataset_id: str) -> tuple:
+    """Fetch a dataset and its DataFrame for querying"""
+    dataset = await fetch_dataset(dataset_id)
+    df = await load_dataframe(dataset)
+    if df is None:
+        raise HTTPException(status_code=404, detail="Dataset data not found")
+    return dataset, df
+
+async def generate_query_code(query_text: str, dataset: Dataset, df: pd.DataFrame, emit=None,
+                              profile: Optional[Dict[str, Any]] = None, engine: str = 'pandas') -> tuple:
+    """Code answering a question as (code, source, cache_key, fingerprint)
+
+    Simple questions compile straight to pandas; otherwise code (or SQL for
+    the 'sql' engine) is generated with the LLM, reusing code generated
+    earlier for the same question against the same schema.
+    """
+    started = time.perf_counter()
+    fingerprint = schema_fingerprint(df)
+    cache_key = code_cache.make_key(query_text, fingerprint, engine)
+    code = intent_matcher.match(query_text, df) if engine == 'pandas' else None
+    if code is not None:
+        source = 'fast_path'
+    else:
+        if emit is not None:
+            await emit('generating', {})
+        code, cached = await code_cache.get_or_generate(
+            cache_key,
+            lambda: generate_with_profile(query_text, dataset, profile, engine)
+        )
+        source = 'cache' if cached else 'llm'
+        metrics.inc('cache_requests_total', cache='code', result='hit' if cached else 'miss')
+    generation_seconds = time.perf_counter() - started
+    metrics.observe('query_stage_seconds', generation_seconds, stage='generation')
+    if emit is not None:
+        await emit('code', {'code': code, 'source': source, 'generation_ms': generation_seconds * 1000})
+    return code, source, cache_key, fingerprint
+
+async def execute_generated(code: str, engine: str, data, dataset_key: Optional[tuple] = None,
+                            table_max_rows: Optional[int] = None) -> Dict[str, Any]:
+    """Run generated code with its engine: the sandbox for pandas, DuckDB for SQL
+
+    `table_max_rows` overrides TABLE_MAX_ROWS for table results (0 keeps all rows).
+    """
+    if engine == 'sql':
+        return await sql_engine.execute(code, data, table_max_rows)
+    return await code_executor.execute_code(code, data, dataset_key=dataset_key, table_max_rows=table_max_rows)
+
+async def load_code_data(dataset: Dataset, code: Optional[str], engine: str) -> tuple:
+    """(data, columns): the data `code` runs on, loading only the columns it
+    reads when that can be determined; SQL reads Arrow data directly"""
+    if code is not None and engine == 'sql':
+        columns = sql_engine.referenced_columns(code, dataset.columns)
+        return await load_dataset_table(dataset, columns), columns
+    columns = column_analyzer.referenced_columns(code, dataset.columns) if code is not None else None
+    return await load_dataframe(dataset, columns), columns
+
+async def preview_query(code: str, dataset: Dataset, sample: pd.DataFrame, engine: str = 'pandas') -> Dict[str, Any]:
+    """Run code on a dataset's row sample, marking the result as a preview"""
+    data_id, version = dataset_storage_key(dataset)
+    result = await execute_generated(code, engine, sample, (data_id, version, 'sample'))
+    result.pop('profile', None)
+    result = await artifact_store.externalize(result)
+    result['preview'] = {'sample_rows': len(sample), 'total_rows': dataset.row_count}
+    return result
+
+async def answer_query(query_text: str, dataset: Dataset, df, emit=None,
+                       profile: Optional[Dict[str, Any]] = None,
+                       generated: Optional[tuple] = None, columns: Optional[List[str]] = None,
+                       engine: str = 'pandas') -> Query:
+    """Generate and execute code for a question against a loaded dataset
+
+    The returned Query is not stored. `df` may be an Arrow table for the
+    'sql' engine. `emit`, if given, is awaited as emit(event, data) as each
+    stage finishes. `generated` skips generation with code already produced
+    by generate_query_code; `columns` names the projection `df` was loaded
+    with, if any.
+    """
+    async def notify(event: str, data: Dict[str, Any]):
+        if emit is not None:
+            await emit(event, data)
+
+    started = time.perf_counter()
+    timings = {}
+    
+    if generated is None:
+        generated = await generate_query_code(query_text, dataset, df, emit, profile, engine)
+    generated_code, code_source, cache_key, fingerprint = generated
+    timings['generation_ms'] = (time.perf_counter() - started) * 1000
+    
+    # Execute the generated code, unless the same code already ran on
+    # identical data
+    execution_started = time.perf_counter()
+    await notify('executing', {})
+    result_key = result_cache.make_key(dataset_data_token(dataset), generated_code)
+    execution_result = await result_cache.get(result_key)
+    metrics.inc('cache_requests_total', cache='result', result='miss' if execution_result is None else 'hit')
+    profile = None
+    if execution_result is None:
+        with metrics.time('query_stage_seconds', stage='execution'):
+            execution_result = await execute_generated(
+                generated_code,
+                engine,
+                df,
+                dataset_key=(*dataset_storage_key(dataset), frame_part(columns))
+            )
+        measured = execution_result.pop('profile', None) or {}
+        execution_ms = (time.perf_counter() - execution_started) * 1000
+        with metrics.time('query_stage_seconds', stage='render'):
+            execution_result = await artifact_store.externalize(execution_result)
+        profile = ExecutionProfile(
+            wall_ms=measured.get('wall_ms', execution_ms),
+            cpu_ms=measured.get('cpu_ms'),
+            peak_memory_bytes=measured.get('peak_memory_bytes'),
+            input_rows=len(df),
+            input_columns=len(df.columns),
+            output_rows=execution_result.get('total_rows') if execution_result.get('type') == 'table' else None,
+            output_bytes=len(orjson.dumps(execution_result, default=str))
         )
         
-        # Execute the generated code
-        execution_result = await code_executor.execute_code(generated_code, df)
-        
-        # Create query record
-        query = Query(
-            dataset_id=request.dataset_id,
-            query_text=request.query_text,
-            generated_code=generated_code,
-            result_type=execution_result.get('type', 'error'),
-            result_data=execution_result if execution_result.get('type') != 'error' else None,
-            error_message=execution_result.get('message') if execution_result.get('type') == 'error' else None
+        # Only keep code and results from successful runs
+        if execution_result.get('type') == 'error':
+            if code_source == 'cache':
+                await code_cache.discard(cache_key)
+        else:
+            if code_source == 'llm':
+                await code_cache.put(cache_key, query_text, fingerprint, generated_code)
+            await result_cache.put(result_key, execution_result)
+    timings['execution_ms'] = (time.perf_counter() - execution_started) * 1000
+    timings['total_ms'] = (time.perf_counter() - started) * 1000
+    metrics.inc('queries_total', engine=engine, source=code_source,
+                result_type=execution_result.get('type', 'error'))
+    
+    return Query(
+        dataset_id=dataset.id,
+        query_text=query_text,
+        generated_code=generated_code,
+        result_type=execution_result.get('type', 'error'),
+        result_data=execution_result if execution_result.get('type') != 'error' else None,
+        error_message=execution_result.get('message') if execution_result.get('type') == 'error' else None,
+        code_source=code_source,
+        engine=engine,
+        timings=timings,
+        profile=profile
+    )
+
+async def log_slow_queries(queries: List[Query]) -> None:
+    """Copy queries whose execution took at least SLOW_QUERY_MS into the slow-query log"""
+    slow = [
+        SlowQuery(query_id=query.id, dataset_id=query.dataset_id, query_text=query.query_text,
+                  generated_code=query.generated_code, engine=query.engine,
+                  code_source=query.code_source, profile=query.profile).dict()
+        for query in queries
+        if query.profile is not None and query.profile.wall_ms >= SLOW_QUERY_MS
+    ]
+    if slow:
+        await db.slow_queries.insert_many(slow)
+
+async def run_query(request: QueryRequest, emit=None, placeholder: Optional[Query] = None,
+                    preview: bool = False) -> Query:
+    """Load the dataset, answer the question and store the query
+
+    Code is generated against the dataset's schema before any data is
+    loaded, so only the columns it references need to be read. With
+    `preview` (and an `emit` to receive it), the code is generated and run
+    on the dataset's row sample first and a 'preview' event is emitted
+    before the full data is loaded. A background job's placeholder document
+    is replaced by the finished query.
+    """
+    started = time.perf_counter()
+    with metrics.time('query_stage_seconds', stage='lookup'):
+        dataset = await fetch_dataset(request.dataset_id)
+    
+    generated = None
+    stage_timings = {}
+    sample = await load_sample(dataset) if preview and emit is not None else None
+    schema = sample if sample is not None else schema_frame(dataset)
+    if schema is not None:
+        generated = await generate_query_code(request.query_text, dataset, schema, emit, engine=request.engine)
+        stage_timings['generation_ms'] = (time.perf_counter() - started) * 1000
+    if sample is not None:
+        preview_started = time.perf_counter()
+        await emit('preview', await preview_query(generated[0], dataset, sample, request.engine))
+        stage_timings['preview_ms'] = (time.perf_counter() - preview_started) * 1000
+        metrics.observe('query_stage_seconds', stage_timings['preview_ms'] / 1000, stage='preview')
+    
+    load_started = time.perf_counter()
+    df, columns = await load_code_data(dataset, generated[0] if generated else None, request.engine)
+    if df is None:
+        raise HTTPException(status_code=404, detail="Dataset data not found")
+    load_ms = (time.perf_counter() - load_started) * 1000
+    metrics.observe('query_stage_seconds', load_ms / 1000, stage='load')
+    if emit is not None:
+        await emit('dataset_loaded', {'rows': len(df), 'columns': len(df.columns), 'load_ms': load_ms})
+    
+    query = await answer_query(request.query_text, dataset, df, emit, generated=generated, columns=columns,
+                               engine=request.engine)
+    query.timings = {'load_ms': load_ms, **query.timings, **stage_timings,
+                     'total_ms': (time.perf_counter() - started) * 1000}
+    
+    # Store query in MongoDB
+    with metrics.time('query_stage_seconds', stage='store'):
+        if placeholder is not None:
+            query.id, query.created_at = placeholder.id, placeholder.created_at
+            await db.queries.replace_one({"id": query.id}, query.dict(), upsert=True)
+        else:
+            await db.queries.insert_one(query.dict())
+    await log_slow_queries([query])
+    metrics.observe('query_stage_seconds', time.perf_counter() - started, stage='total')
+    
+    return query
+
+ARROW_STREAM_TYPE = 'application/vnd.apache.arrow.stream'
+
+def table_to_arrow(result: Dict[str, Any]) -> pa.Table:
+    """An Arrow table from a stored table result"""
+    if 'columns' not in result:
+        # Results stored before tables were columnar hold a list of records
+        result = sandbox.table_result(result.get('data') or []) or {'columns': [], 'dtypes': [], 'data': []}
+    rows = result['data']
+    arrays = []
+    for index, dtype in enumerate(result['dtypes']):
+        values = [row[index] for row in rows]
+        try:
+            if dtype.startswith('datetime64'):
+                arrays.append(pa.Array.from_pandas(pd.to_datetime(pd.Series(values, dtype=object))))
+            else:
+                arrays.append(pa.array(values))
+        except (pa.ArrowInvalid, pa.ArrowTypeError, ValueError, TypeError):
+            arrays.append(pa.array([None if value is None else str(value) for value in values], pa.string()))
+    return pa.Table.from_arrays(arrays, names=result['columns'])
+
+def query_json(query: Query) -> Dict[str, Any]:
+    """A query as plain data for orjson, without copying its result"""
+    return {**dict(query), 'profile': query.profile.dict() if query.profile else None}
+
+def query_response(query: Query, accept: Optional[str]) -> Response:
+    """A query as JSON, or its table result as an Arrow IPC stream when the client accepts one"""
+    if accept and ARROW_STREAM_TYPE in accept:
+        result = query.result_data or {}
+        if result.get('type') != 'table':
+            raise HTTPException(status_code=406, detail="Only table results are available as Arrow")
+        table = table_to_arrow(result)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return Response(sink.getvalue().to_pybytes(), media_type=ARROW_STREAM_TYPE, headers={
+            'Vary': 'Accept',
+            'X-Query-Id': query.id,
+            'X-Total-Rows': str(result.get('total_rows', table.num_rows)),
+            'X-Truncated': str(bool(result.get('truncated'))).lower()
+        })
+    # orjson encodes the result rows far faster than the default encoder
+    return ORJSONResponse(query_json(query), headers={'Vary': 'Accept'})
+
+@api_router.post("/query")
+async def process_query(request: QueryRequest, wait: bool = True, preview: bool = False,
+                        accept: Optional[str] = Header(None)):
+    """Process a natural language query against a dataset
+
+    With wait=false the query is queued and a job id is returned right away;
+    poll /api/jobs/{job_id} for its progress. With preview=true the code is
+    first run on the dataset's row sample and that preview is returned
+    (status 'running') while the full run replaces it in the background.
+    Table results come back as columnar JSON, or as an Arrow IPC stream
+    for clients that accept application/vnd.apache.arrow.stream.
+    """
+    if preview:
+        return query_response(await process_query_preview(request), accept)
+    job = await job_queue.submit(request, background=not wait)
+    if not wait:
+        return JSONResponse(
+            status_code=202,
+            content={'job_id': job.placeholder.id, 'status': job.placeholder.status},
+            headers={'Location': f"/api/jobs/{job.placeholder.id}"}
+        )
+    try:
+        query = await job.future
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
+    return query_response(query, accept)
+
+async def process_query_preview(request: QueryRequest):
+    """Return a sample-based preview query as soon as it exists"""
+    preview_ready = asyncio.get_running_loop().create_future()
+    job = None
+    code = {}
+
+    async def emit(event: str, data: Dict[str, Any]):
+        if event == 'code':
+            code.update(data)
+        if event != 'preview':
+            return
+        is_error = data.get('type') == 'error'
+        await db.queries.update_one({"id": job.placeholder.id}, {"$set": {
+            "generated_code": code.get('code', ''),
+            "code_source": code.get('source'),
+            "result_type": data.get('type', 'error'),
+            "result_data": None if is_error else data,
+            "error_message": data.get('message') if is_error else None
+        }})
+        if not preview_ready.done():
+            preview_ready.set_result(None)
+
+    job = await job_queue.submit(request, emit, background=True, preview=True)
+    # Datasets without a sample skip the preview; answer with the full run then
+    await asyncio.wait({preview_ready, job.future}, return_when=asyncio.FIRST_COMPLETED)
+    query = await db.queries.find_one({"id": job.placeholder.id}, QUERY_PROJECTION)
+    return Query(**query)
+
+@api_router.get("/jobs/{job_id}", response_model=QueryJobStatus)
+async def get_job(job_id: str):
+    """Get the progress of a query submitted with wait=false"""
+    query = await db.queries.find_one(
+        {"id": job_id},
+        {'_id': 0, 'id': 1, 'status': 1, 'result_type': 1, 'error_message': 1, 'created_at': 1}
+    )
+    if not query:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return QueryJobStatus(job_id=query['id'], status=query.get('status', 'done'),
+                          result_type=query['result_type'], error_message=query.get('error_message'),
+                          created_at=query['created_at'])
+
+@api_router.get("/jobs/{job_id}/result", response_model=Query)
+async def get_job_result(job_id: str, accept: Optional[str] = Header(None)):
+    """Get a finished job's query; 202 while it is still queued or running"""
+    query = await db.queries.find_one({"id": job_id}, QUERY_PROJECTION)
+    if not query:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if query.get('status') in ('queued', 'running'):
+        return JSONResponse(
+            status_code=202,
+            content={'job_id': job_id, 'status': query['status']},
+            headers={'Retry-After': str(job_queue.retry_after())}
         )
+    return query_response(Query(**query), accept)
+
+@api_router.post("/query/batch", response_model=List[Query])
+async def process_query_batch(request: BatchQueryRequest):
+    """Answer several questions about one dataset with a single data load
+
+    Code generation runs concurrently (bounded by LLM_CONCURRENCY) and
+    execution is spread over the sandbox pool. Results come back in request
+    order; a question that fails is returned as an error query.
+    """
+    if not request.query_texts:
+        raise HTTPException(status_code=400, detail="No queries given")
+    if len(request.query_texts) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_QUERIES} queries per batch")
+    
+    try:
+        started = time.perf_counter()
+        dataset, df = await load_query_dataset(request.dataset_id)
+        load_ms = (time.perf_counter() - started) * 1000
+        profile = await load_profile(dataset)
         
-        # Store query in MongoDB
-        await db.queries.insert_one(query.dict())
+        answers = await asyncio.gather(
+            *(answer_query(query_text, dataset, df, profile=profile, engine=request.engine)
+              for query_text in request.query_texts),
+            return_exceptions=True
+        )
+        queries = []
+        for query_text, answer in zip(request.query_texts, answers):
+            if isinstance(answer, BaseException):
+                detail = answer.detail if isinstance(answer, HTTPException) else str(answer)
+                answer = Query(
+                    dataset_id=request.dataset_id,
+                    query_text=query_text,
+                    generated_code='',
+                    result_type='error',
+                    error_message=f"Error processing query: {detail}",
+                    engine=request.engine
+                )
+            answer.timings = {'load_ms': load_ms, **answer.timings,
+                              'total_ms': load_ms + answer.timings.get('total_ms', 0.0)}
+            queries.append(answer)
         
-        return query
+        await db.queries.insert_many([query.dict() for query in queries])
+        await log_slow_queries(queries)
+        return ORJSONResponse([query_json(query) for query in queries])
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error processing queries: {str(e)}")
+
+def sse_event(event: str, data: Any) -> str:
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data), separators=(',', ':'))}\n\n"
+
+@api_router.post("/query/stream")
+async def stream_query(request: QueryRequest, preview: bool = False):
+    """Process a query, streaming stage events and table rows as server-sent events
+
+    Events: generating, code, preview (with preview=true, the result on the
+    dataset's row sample), dataset_loaded, executing, result, rows (table
+    results, in batches), then done with the stored query, or error.
+    Disconnecting cancels the query.
+    """
+    events: asyncio.Queue = asyncio.Queue()
+
+    async def emit(event: str, data: Dict[str, Any]):
+        await events.put((event, data))
+
+    job = await job_queue.submit(request, emit, preview=preview)
+
+    async def run():
+        try:
+            query = await job.future
+        except HTTPException as e:
+            await events.put(('error', {'detail': e.detail}))
+        except Exception as e:
+            await events.put(('error', {'detail': f"Error processing query: {str(e)}"}))
+        else:
+            result = query.result_data or {}
+            rows = result.get('data') if query.result_type == 'table' else None
+            if isinstance(rows, list):
+                await events.put(('result', {**{key: value for key, value in result.items() if key != 'data'},
+                                             'row_count': len(rows)}))
+                for offset in range(0, len(rows), STREAM_ROW_BATCH):
+                    await events.put(('rows', {'offset': offset, 'rows': rows[offset:offset + STREAM_ROW_BATCH]}))
+            else:
+                await events.put(('result', result or {'type': 'error', 'message': query.error_message}))
+            await events.put(('done', query.dict(exclude={'result_data'})))
+        await events.put(None)
+
+    async def stream():
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                item = await events.get()
+                if item is None:
+                    break
+                yield sse_event(*item)
+        finally:
+            # The client went away before the query finished
+            if not task.done():
+                task.cancel()
+                job.future.cancel()
 
-@api_router.get("/queries/{dataset_id}")
-async def get_queries(dataset_id: str):
-    """Get all queries for a specific dataset"""
-    queries = await db.queries.find({"dataset_id": dataset_id}).to_list(1000)
-    return [Query(**query) for query in queries]
+    return StreamingResponse(
+        stream(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@api_router.get("/queries/{dataset_id}", response_model=QueryPage)
+async def get_queries(
+    dataset_id: str,
+    limit: int = QueryParam(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    sort: QuerySort = 'recent'
+):
+    """Get query summaries for a specific dataset, one page at a time
+
+    Newest first by default; sort=wall_time, cpu_time or peak_memory lists
+    the queries that were executed (not served from the result cache), most
+    expensive first.
+    """
+    queries, next_cursor = await fetch_page(
+        db.queries, {"dataset_id": dataset_id}, 'created_at', QUERY_SUMMARY_PROJECTION, limit, cursor,
+        COST_SORT_FIELDS.get(sort)
+    )
+    return QueryPage(items=[QuerySummary(**query) for query in queries], next_cursor=next_cursor)
+
+@api_router.get("/slow-queries", response_model=SlowQueryPage)
+async def get_slow_queries(
+    limit: int = QueryParam(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    sort: QuerySort = 'recent'
+):
+    """Get the slow-query log with each query's code and execution profile"""
+    queries, next_cursor = await fetch_page(
+        db.slow_queries, {}, 'created_at', SLOW_QUERY_PROJECTION, limit, cursor, COST_SORT_FIELDS.get(sort)
+    )
+    return SlowQueryPage(items=[SlowQuery(**query) for query in queries], next_cursor=next_cursor)
+
+@api_router.get("/query/{query_id}", response_model=Query)
+async def get_query(query_id: str, accept: Optional[str] = Header(None)):
+    """Get one query with its generated code and full result"""
+    query = await db.queries.find_one({"id": query_id}, QUERY_PROJECTION)
+    if not query:
+        raise HTTPException(status_code=404, detail="Query not found")
+    return query_response(Query(**query), accept)
+
+def result_frame(result: Dict[str, Any]) -> pd.DataFrame:
+    """A DataFrame from a stored table result"""
+    if 'columns' not in result:
+        return pd.DataFrame.from_records(result.get('data') or [])
+    df = pd.DataFrame(result['data'], columns=result['columns'])
+    for index, dtype in enumerate(result['dtypes']):
+        # Timestamps are stored as ISO strings
+        if dtype.startswith('datetime64') and len(df):
+            df.isetitem(index, pd.to_datetime(df.iloc[:, index], errors='coerce'))
+    return df
+
+async def full_table_result(query: Dict[str, Any]) -> pd.DataFrame:
+    """Re-run a stored query's code without truncating its table result"""
+    dataset = await fetch_dataset(query['dataset_id'])
+    engine = query.get('engine') or 'pandas'
+    data, columns = await load_code_data(dataset, query['generated_code'], engine)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Dataset data not found")
+    result = await execute_generated(query['generated_code'], engine, data,
+                                     (*dataset_storage_key(dataset), frame_part(columns)), table_max_rows=0)
+    if result.get('type') != 'table':
+        raise HTTPException(status_code=500,
+                            detail=f"Could not re-run the query: {result.get('message', 'no table result')}")
+    return await asyncio.to_thread(result_frame, result)
+
+@api_router.get("/queries/{query_id}/rows", response_model=RowPage)
+async def get_query_rows(
+    query_id: str,
+    offset: int = QueryParam(0, ge=0),
+    limit: int = QueryParam(DEFAULT_PAGE_SIZE, ge=1, le=MAX_ROW_PAGE_SIZE),
+    sort: Optional[str] = None,
+    descending: bool = False,
+    filter: List[str] = QueryParam([])
+):
+    """Page through a table result's rows, optionally sorted by a column and filtered
+
+    Stored table results keep at most TABLE_MAX_ROWS rows; for a truncated
+    result the query is run again once to page, sort and filter all rows.
+    """
+    df = query_result_cache.get(query_id, 0)
+    key = (query_id, 0)
+    if df is None:
+        query = await db.queries.find_one(
+            {"id": query_id},
+            {'_id': 0, 'result_data': 1, 'status': 1, 'dataset_id': 1, 'generated_code': 1, 'engine': 1}
+        )
+        if not query:
+            raise HTTPException(status_code=404, detail="Query not found")
+        result = query.get('result_data') or {}
+        if result.get('type') != 'table':
+            raise HTTPException(status_code=400, detail="Query result is not a table")
+        if result.get('truncated'):
+            df = await full_table_result(query)
+        else:
+            df = await asyncio.to_thread(result_frame, result)
+        if query.get('status') in ('queued', 'running'):
+            # A preview; the full run will replace it
+            key = None
+        else:
+            query_result_cache.put(query_id, 0, df)
+    try:
+        page = await row_pager.page(key, df, offset, limit, sort, descending, filter)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return ORJSONResponse(page)
+
+def parse_range(range_header: str, size: int) -> Optional[tuple]:
+    """Parse a single 'bytes=start-end' range into inclusive offsets"""
+    match = re.fullmatch(r'bytes=(\d*)-(\d*)', range_header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if start == '':
+        # Suffix range: the last N bytes
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start > end or start >= size:
+        return None
+    return start, end
+
+@api_router.get("/artifacts/{digest}")
+async def get_artifact(digest: str, request: Request):
+    """Serve a stored chart or HTML artifact with immutable caching and range support"""
+    etag = f'"{digest}"'
+    headers = {
+        'ETag': etag,
+        'Cache-Control': 'public, max-age=31536000, immutable',
+        'Accept-Ranges': 'bytes'
+    }
+    if etag in request.headers.get('if-none-match', ''):
+        return Response(status_code=304, headers=headers)
+
+    artifact = await artifact_store.open(digest)
+    if artifact is None:
+        raise HTTPException(status_code=404, detail="Artifact not found")
+    content_type = (artifact.metadata or {}).get('content_type', 'application/octet-stream')
+
+    range_header = request.headers.get('range')
+    if range_header:
+        byte_range = parse_range(range_header, artifact.length)
+        if byte_range is None:
+            return Response(status_code=416, headers={**headers, 'Content-Range': f'bytes */{artifact.length}'})
+        start, end = byte_range
+        artifact.seek(start)
+        content = await artifact.read(end - start + 1)
+        return Response(
+            content,
+            status_code=206,
+            media_type=content_type,
+            headers={**headers, 'Content-Range': f'bytes {start}-{end}/{artifact.length}'}
+        )
+
+    return Response(await artifact.read(), media_type=content_type, headers=headers)
 
 @api_router.get("/")
 async def root():
     return {"message": "Ask Your Data API is running!"}
 
+# Under /api so it is reachable through the same proxy as the rest of the API
+@api_router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Pipeline metrics in the Prometheus text exposition format"""
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -337,6 +3346,7 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Query-Id", "X-Total-Rows", "X-Truncated"],
 )
 
 # Configure logging
@@ -346,6 +3356,50 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def ensure_indexes():
+    """Create the indexes every lookup relies on (no-op if they exist)"""
+    try:
+        await db.datasets.create_index("id", unique=True)
+        await db.datasets.create_index([("uploaded_at", -1), ("id", -1)])
+        await db.dataset_data.create_index("dataset_id", unique=True)
+        await db.dataset_data.create_index("content_hash", sparse=True)
+        await db.queries.create_index("id", unique=True)
+        await db.queries.create_index([("dataset_id", 1), ("created_at", -1), ("id", -1)])
+        await db.queries.create_index([("status", 1), ("heartbeat_at", 1)])
+        for field in COST_SORT_FIELDS.values():
+            await db.queries.create_index([("dataset_id", 1), (field, -1), ("id", -1)])
+        await db.slow_queries.create_index([("created_at", -1), ("id", -1)])
+        await db.slow_queries.create_index("created_at", expireAfterSeconds=SLOW_QUERY_TTL_SECONDS)
+        await code_cache.ensure_indexes()
+        await result_cache.ensure_indexes()
+    except pymongo.errors.PyMongoError as e:
+        logger.error(f"Could not create MongoDB indexes: {e}")
+
+@app.on_event("startup")
+async def start_execution_pool():
+    await code_executor.pool.start()
+
+@app.on_event("startup")
+async def start_job_queue():
+    await job_queue.start()
+    try:
+        await job_queue.fail_abandoned()
+    except pymongo.errors.PyMongoError as e:
+        logger.warning(f"Could not mark abandoned queries as failed: {e}")
+
+@app.on_event("shutdown")
+async def shutdown_job_queue():
+    await job_queue.shutdown()
+
+@app.on_event("shutdown")
+async def shutdown_execution_pool():
+    await code_executor.pool.shutdown()
+
+@app.on_event("shutdown")
+async def shutdown_sql_engine():
+    sql_engine.close()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
\ No newline at end of file
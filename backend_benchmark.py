@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""Offline micro-benchmarks for the backend's upload and query stages.
+
+Runs the server code in process against synthetic datasets, with a
+deterministic stand-in for the LLM and, unless BENCHMARK_MONGO_URL points at
+a local MongoDB, an in-memory one (mongomock-motor). Nothing leaves the
+machine, so runs are repeatable:
+
+    python backend_benchmark.py                          # 1k, 100k and 1m rows
+    python backend_benchmark.py --sizes 1k,100k,1m,10m
+    python backend_benchmark.py --save benchmark_baseline.json
+    python backend_benchmark.py --compare benchmark_baseline.json
+
+With --compare the exit code is non-zero if any stage got slower, or used
+more memory, than the baseline by more than --threshold.
+"""
+import argparse
+import asyncio
+import gc
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import types
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+BACKEND_DIR = Path(__file__).parent / 'backend'
+
+SIZES = {'1k': 1_000, '10k': 10_000, '100k': 100_000, '1m': 1_000_000, '10m': 10_000_000}
+DEFAULT_SIZES = '1k,100k,1m'
+
+# Differences below these are noise, whatever the ratio
+MIN_TIME_DELTA_MS = 1.0
+MIN_MEMORY_DELTA_BYTES = 16 * 1024 * 1024
+
+TABLE_CODE = """summary = df.groupby('category')['value'].agg(['mean', 'sum', 'count'])
+result = {'type': 'table', 'data': summary}"""
+
+CHART_CODE = """fig = px.line(df, x='ts', y='value')
+result = fig"""
+
+QUERY_TEXT = "Which categories have the most volatile value by region? (run {run})"
+
+# The server module, imported by setup_backend() once the stand-ins are in place
+server = None
+
+
+class FakeUserMessage:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeLlmChat:
+    """Deterministic stand-in for LlmChat: answers every prompt with the same
+    pandas code, tagged with the question so each one caches separately"""
+
+    def __init__(self, api_key, session_id, system_message):
+        self.system_message = system_message
+
+    def with_model(self, provider, model):
+        return self
+
+    async def send_message(self, message):
+        question = message.text.split('Query:', 1)[-1].strip().splitlines()[0]
+        return f"```python\n# {question}\n{TABLE_CODE}\n```"
+
+
+class MemoryGridOut:
+    def __init__(self, data, metadata=None):
+        self._data = data
+        self._position = 0
+        self.length = len(data)
+        self.metadata = metadata
+
+    def seek(self, position):
+        self._position = position
+
+    async def read(self, size=-1):
+        end = self.length if size is None or size < 0 else self._position + size
+        chunk = self._data[self._position:end]
+        self._position += len(chunk)
+        return chunk
+
+
+class MemoryGridFSBucket:
+    """In-memory stand-in for AsyncIOMotorGridFSBucket, for runs without MongoDB.
+
+    File documents go to the usual `<bucket>.files` collection so lookups by
+    filename behave as they do against GridFS.
+    """
+    _blobs = {}
+
+    def __init__(self, database, bucket_name='fs'):
+        self.files = database[f'{bucket_name}.files']
+
+    async def upload_from_stream(self, filename, source, metadata=None):
+        from bson import ObjectId
+        data = bytes(source) if isinstance(source, (bytes, bytearray, memoryview)) else source.read()
+        file_id = ObjectId()
+        self._blobs[file_id] = data
+        await self.files.insert_one({'_id': file_id, 'filename': filename, 'length': len(data),
+                                     'metadata': metadata})
+        return file_id
+
+    async def open_download_stream(self, file_id):
+        import gridfs.errors
+        document = await self.files.find_one({'_id': file_id})
+        if document is None or file_id not in self._blobs:
+            raise gridfs.errors.NoFile(file_id)
+        return MemoryGridOut(self._blobs[file_id], document.get('metadata'))
+
+    async def open_download_stream_by_name(self, filename):
+        import gridfs.errors
+        document = await self.files.find_one({'filename': filename})
+        if document is None:
+            raise gridfs.errors.NoFile(filename)
+        return await self.open_download_stream(document['_id'])
+
+    async def delete(self, file_id):
+        import gridfs.errors
+        if self._blobs.pop(file_id, None) is None:
+            raise gridfs.errors.NoFile(file_id)
+        await self.files.delete_one({'_id': file_id})
+
+
+def setup_backend():
+    """Import server.py against the local data store and the fake LLM"""
+    global server
+    mongo_url = os.environ.get('BENCHMARK_MONGO_URL')
+    # Set before server.py loads backend/.env, which does not override them
+    os.environ['MONGO_URL'] = mongo_url or 'mongodb://localhost:27017'
+    os.environ['DB_NAME'] = os.environ.get('BENCHMARK_DB_NAME', 'askyourdata_benchmark')
+    os.environ['GEMINI_API_KEY'] = 'benchmark'
+
+    if not mongo_url:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            print("Error: install mongomock-motor or set BENCHMARK_MONGO_URL to a local MongoDB")
+            sys.exit(1)
+        import motor.motor_asyncio
+        motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
+        motor.motor_asyncio.AsyncIOMotorGridFSBucket = MemoryGridFSBucket
+
+    try:
+        import emergentintegrations.llm.chat  # noqa: F401
+    except ImportError:
+        # The LLM client is never called here, so it need not be installed
+        chat = types.ModuleType('emergentintegrations.llm.chat')
+        chat.LlmChat, chat.UserMessage = FakeLlmChat, FakeUserMessage
+        sys.modules['emergentintegrations'] = types.ModuleType('emergentintegrations')
+        sys.modules['emergentintegrations.llm'] = types.ModuleType('emergentintegrations.llm')
+        sys.modules['emergentintegrations.llm.chat'] = chat
+
+    sys.path.insert(0, str(BACKEND_DIR))
+    import server as backend_server
+    backend_server.LlmChat, backend_server.UserMessage = FakeLlmChat, FakeUserMessage
+    server = backend_server
+    return mongo_url or 'in-memory (mongomock-motor)'
+
+
+def parse_sizes(text):
+    sizes = []
+    for part in text.split(','):
+        part = part.strip().lower()
+        if part:
+            sizes.append((part, SIZES[part] if part in SIZES else int(part)))
+    return sizes
+
+
+def synthetic_frame(rows, seed=42):
+    """A reproducible dataset mixing numbers, categories and timestamps"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'id': np.arange(rows),
+        'ts': pd.date_range('2024-01-01', periods=rows, freq='min'),
+        'category': rng.choice([f'category_{i}' for i in range(20)], rows),
+        'region': rng.choice(['north', 'south', 'east', 'west', 'central'], rows),
+        'value': rng.normal(100, 25, rows).round(3),
+        'quantity': rng.integers(1, 100, rows)
+    })
+
+
+async def measure(func, repeats):
+    """Run `func` `repeats` times; (result, per-run milliseconds, peak memory growth)
+
+    Memory is measured in this process. `func` may return a sandbox
+    profile as its second value to report memory measured in a worker instead.
+    """
+    times, peaks, result = [], [], None
+    for _ in range(repeats):
+        gc.collect()
+        with server.sandbox.ResourceMeter() as meter:
+            result, worker_profile = await func()
+        times.append(meter.wall_ms)
+        peak = (worker_profile or {}).get('peak_memory_bytes', meter.peak_memory_bytes)
+        if peak is not None:
+            peaks.append(peak)
+    return result, times, max(peaks) if peaks else None
+
+
+def summarize(times, peak):
+    return {
+        'median_ms': statistics.median(times),
+        'min_ms': min(times),
+        'peak_memory_bytes': peak
+    }
+
+
+async def benchmark_size(label, rows, repeats):
+    """Benchmark every stage on a dataset of `rows` rows"""
+    results = {}
+
+    async def record(stage, func, stage_repeats=repeats):
+        result, times, peak = await measure(func, stage_repeats)
+        results[f'{stage}/{label}'] = summarize(times, peak)
+        print(f"  {stage:<18} {statistics.median(times):>12.2f} ms"
+              f"{'' if peak is None else f'{peak / 2 ** 20:>12.1f} MB'}")
+        return result
+
+    frame = synthetic_frame(rows)
+    csv_bytes = frame.to_csv(index=False).encode()
+    print(f"\n{'=' * 80}\n{label}: {rows:,} rows, {len(csv_bytes) / 2 ** 20:.1f} MB of CSV\n{'=' * 80}")
+
+    # Each upload is deleted again so the next one is not deduplicated
+    uploaded = []
+
+    async def upload():
+        if uploaded:
+            await server.delete_dataset(uploaded.pop().id)
+        file = server.UploadFile(file=io.BytesIO(csv_bytes), filename=f'benchmark_{label}.csv')
+        dataset = await server.upload_dataset(file)
+        uploaded.append(dataset)
+        return dataset, None
+
+    dataset = await record('upload_csv', upload)
+    data_id, version = server.dataset_storage_key(dataset)
+    del frame, csv_bytes
+
+    async def load_cold():
+        return await server.dataset_store.load(data_id), None
+
+    async def load_cached():
+        return await server.load_dataframe(dataset), None
+
+    df = await record('load_storage', load_cold)
+    server.dataframe_cache.put(data_id, version, df)
+    df = await record('load_cached', load_cached)
+    dataset_key = (data_id, version, server.frame_part())
+
+    def execute(code):
+        async def run():
+            result = await server.code_executor.execute_code(code, df, dataset_key)
+            if result.get('type') == 'error':
+                raise RuntimeError(f"Benchmark code failed: {result['message']}")
+            return result, result.pop('profile', None)
+        return run
+
+    # The first run shares the frame with the workers; time the warm runs
+    await server.code_executor.execute_code(TABLE_CODE, df, dataset_key)
+    await record('execute_table', execute(TABLE_CODE))
+    await record('execute_chart', execute(CHART_CODE))
+
+    figure = server.sandbox.go.Figure(server.sandbox.go.Scatter(x=df['ts'], y=df['value'], mode='lines'))
+
+    async def serialize_chart():
+        return server.sandbox.figure_to_json(figure, server.PLOTLY_MAX_POINTS), None
+
+    await record('chart_serialize', serialize_chart)
+
+    async def build_table():
+        return server.sandbox.table_result(df, server.TABLE_MAX_ROWS), None
+
+    table = await record('result_table', build_table)
+    query = server.Query(dataset_id=dataset.id, query_text='benchmark', generated_code=TABLE_CODE,
+                         result_type='table', result_data=table)
+
+    async def encode_json():
+        return server.query_response(query, None).body, None
+
+    async def encode_arrow():
+        return server.query_response(query, server.ARROW_STREAM_TYPE).body, None
+
+    await record('result_json', encode_json)
+    await record('result_arrow', encode_arrow)
+
+    # A full question through code generation (fake LLM), execution and caching
+    runs = iter(range(repeats))
+
+    async def answer():
+        answered = await server.answer_query(QUERY_TEXT.format(run=next(runs)), dataset, df)
+        if answered.result_type == 'error':
+            raise RuntimeError(f"Benchmark query failed: {answered.error_message}")
+        return answered, None
+
+    await record('answer_query', answer)
+
+    await server.delete_dataset(dataset.id)
+    server.dataframe_cache.invalidate(data_id)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print each stage against the baseline; the keys that regressed"""
+    regressions = []
+    print(f"\n{'=' * 80}\nCOMPARISON WITH BASELINE (threshold {threshold:.0%})\n{'=' * 80}")
+    for key, current in results.items():
+        previous = baseline.get(key)
+        if previous is None:
+            print(f"  {key:<26} new")
+            continue
+        change = current['median_ms'] / previous['median_ms'] - 1 if previous['median_ms'] else 0.0
+        slower = (change > threshold
+                  and current['median_ms'] - previous['median_ms'] > MIN_TIME_DELTA_MS)
+        memory_note = ''
+        if current['peak_memory_bytes'] is not None and previous.get('peak_memory_bytes') is not None:
+            growth = current['peak_memory_bytes'] - previous['peak_memory_bytes']
+            if (growth > MIN_MEMORY_DELTA_BYTES
+                    and current['peak_memory_bytes'] > previous['peak_memory_bytes'] * (1 + threshold)):
+                memory_note = f", memory +{growth / 2 ** 20:.1f} MB"
+        flag = 'REGRESSION' if slower or memory_note else 'ok'
+        print(f"  {key:<26} {previous['median_ms']:>10.2f} -> {current['median_ms']:>10.2f} ms "
+              f"({change:+.0%}{memory_note}) {flag}")
+        if flag != 'ok':
+            regressions.append(key)
+    return regressions
+
+
+async def run_benchmarks(sizes, repeats):
+    await server.ensure_indexes()
+    await server.code_executor.pool.start()
+    try:
+        results = {}
+        for label, rows in sizes:
+            results.update(await benchmark_size(label, rows, repeats))
+        return results
+    finally:
+        await server.code_executor.pool.shutdown()
+
+
+def main():
+    """Run the benchmarks and save or compare a baseline"""
+    parser = argparse.ArgumentParser(description="Offline backend stage benchmarks")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES,
+                        help=f"comma-separated row counts or {', '.join(SIZES)} (default {DEFAULT_SIZES})")
+    parser.add_argument('--repeats', type=int, default=3, help="timed runs per stage (default 3)")
+    parser.add_argument('--save', metavar='PATH', help="write the results as a baseline JSON file")
+    parser.add_argument('--compare', metavar='PATH', help="compare the results with a saved baseline")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="relative slowdown or memory growth counted as a regression (default 0.2)")
+    args = parser.parse_args()
+
+    store = setup_backend()
+    print(f"Benchmarking against {store} data store, {args.repeats} runs per stage")
+    results = asyncio.run(run_benchmarks(parse_sizes(args.sizes), max(1, args.repeats)))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'created_at': datetime.utcnow().isoformat(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'pandas': pd.__version__,
+                'repeats': args.repeats,
+                'results': results
+            }, f, indent=2)
+        print(f"\nBaseline saved to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline['results'], args.threshold)
+        print(f"\n{len(regressions)} regression(s)")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
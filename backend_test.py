@@ -168,11 +168,12 @@ def test_get_datasets():
     response.raise_for_status()
     data = response.json()
     
-    assert isinstance(data, list), "Response should be a list of datasets"
-    assert len(data) > 0, "At least one dataset should be returned"
+    assert isinstance(data.get("items"), list), "Response should contain a list of datasets"
+    assert "next_cursor" in data, "Response should contain a next_cursor"
+    assert len(data["items"]) > 0, "At least one dataset should be returned"
     
     # Verify dataset structure
-    dataset = data[0]
+    dataset = data["items"][0]
     assert "id" in dataset, "Dataset should have an ID"
     assert "name" in dataset, "Dataset should have a name"
     assert "columns" in dataset, "Dataset should have columns"
@@ -184,7 +185,7 @@ def test_natural_language_query_table():
     # First get a dataset ID
     response = requests.get(f"{BASE_URL}/datasets")
     response.raise_for_status()
-    datasets = response.json()
+    datasets = response.json()["items"]
     
     if not datasets:
         raise Exception("No datasets available for testing queries")
@@ -217,6 +218,15 @@ def test_natural_language_query_table():
         assert "result_data" in data, "Table result should include result_data"
         assert "data" in data["result_data"], "Table result should include data array"
         assert isinstance(data["result_data"]["data"], list), "Table data should be a list"
+        assert "columns" in data["result_data"], "Table result should be columnar"
+        assert "total_rows" in data["result_data"], "Table result should include the total row count"
+        
+        # The same result as an Arrow IPC stream
+        response = requests.get(f"{BASE_URL}/query/{data['id']}",
+                                headers={"Accept": "application/vnd.apache.arrow.stream"})
+        response.raise_for_status()
+        assert response.headers["Content-Type"] == "application/vnd.apache.arrow.stream", "Should return Arrow"
+        assert "X-Total-Rows" in response.headers, "Arrow response should include the total row count"
     elif data["result_type"] == "error":
         print(f"Query returned an error: {data.get('error_message')}")
         print(f"Full error data: {data}")
@@ -228,7 +238,7 @@ def test_natural_language_query_chart():
     # First get a dataset ID
     response = requests.get(f"{BASE_URL}/datasets")
     response.raise_for_status()
-    datasets = response.json()
+    datasets = response.json()["items"]
     
     if not datasets:
         raise Exception("No datasets available for testing queries")
@@ -259,16 +269,21 @@ def test_natural_language_query_chart():
     # Check if we got a chart result
     if data["result_type"] == "chart":
         assert "result_data" in data, "Chart result should include result_data"
-        assert "data" in data["result_data"], "Chart result should include base64 data"
-        # Verify it's a valid base64 string
-        try:
-            base64.b64decode(data["result_data"]["data"])
-        except:
-            assert False, "Chart data is not a valid base64 string"
+        assert "url" in data["result_data"], "Chart result should include an artifact URL"
+        # Verify the artifact is a PNG image served with immutable caching
+        artifact = requests.get(f"{BASE_URL[:-len('/api')]}{data['result_data']['url']}")
+        artifact.raise_for_status()
+        assert artifact.content.startswith(b"\x89PNG"), "Chart artifact is not a PNG image"
+        assert "immutable" in artifact.headers.get("Cache-Control", ""), "Chart artifact should be cacheable"
+    elif data["result_type"] == "plotly_json":
+        assert "result_data" in data, "Plotly result should include result_data"
+        assert "data" in data["result_data"]["data"], "Plotly figure JSON should include traces"
     elif data["result_type"] == "plotly":
         assert "result_data" in data, "Plotly result should include result_data"
-        assert "data" in data["result_data"], "Plotly result should include HTML data"
-        assert "<div" in data["result_data"]["data"], "Plotly HTML should contain div elements"
+        assert "url" in data["result_data"], "Plotly result should include an artifact URL"
+        artifact = requests.get(f"{BASE_URL[:-len('/api')]}{data['result_data']['url']}")
+        artifact.raise_for_status()
+        assert "<div" in artifact.text, "Plotly HTML should contain div elements"
     elif data["result_type"] == "error":
         print(f"Query returned an error: {data.get('error_message')}")
         print(f"Full error data: {data}")
@@ -280,7 +295,7 @@ def test_get_queries():
     # First get a dataset ID
     response = requests.get(f"{BASE_URL}/datasets")
     response.raise_for_status()
-    datasets = response.json()
+    datasets = response.json()["items"]
     
     if not datasets:
         raise Exception("No datasets available for testing queries")
@@ -292,18 +307,229 @@ def test_get_queries():
     response.raise_for_status()
     data = response.json()
     
-    assert isinstance(data, list), "Response should be a list of queries"
+    assert isinstance(data.get("items"), list), "Response should contain a list of queries"
     
-    # If we have queries, verify their structure
-    if data:
-        query = data[0]
+    # If we have queries, verify their summary structure and full result
+    if data["items"]:
+        query = data["items"][0]
         assert "id" in query, "Query should have an ID"
         assert "dataset_id" in query, "Query should have a dataset ID"
         assert "query_text" in query, "Query should have query text"
-        assert "generated_code" in query, "Query should have generated code"
+        assert "result_data" not in query, "Query summaries should not include result data"
+        
+        response = requests.get(f"{BASE_URL}/query/{query['id']}")
+        response.raise_for_status()
+        assert "generated_code" in response.json(), "Full query should have generated code"
     
     return data
 
+def test_streaming_query():
+    """Test 8: Streaming Query API"""
+    response = requests.get(f"{BASE_URL}/datasets")
+    response.raise_for_status()
+    datasets = response.json()["items"]
+    
+    if not datasets:
+        raise Exception("No datasets available for testing queries")
+    
+    query_data = {
+        "dataset_id": datasets[0]["id"],
+        "query_text": "Show the first 5 rows as a table"
+    }
+    
+    events = []
+    with requests.post(f"{BASE_URL}/query/stream", json=query_data, stream=True) as response:
+        response.raise_for_status()
+        assert response.headers["content-type"].startswith("text/event-stream"), "Response should be an event stream"
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                events.append((event, json.loads(line[len("data: "):])))
+    
+    names = [name for name, _ in events]
+    print(f"Events: {names}")
+    # Code is generated from the schema before any data is loaded
+    assert names[0] in ("generating", "code"), "Stream should start with code generation"
+    stages = ["code", "dataset_loaded", "executing", "result", "done"]
+    assert all(stage in names for stage in stages), f"Stream should include {stages}"
+    positions = [names.index(stage) for stage in stages]
+    assert positions == sorted(positions), f"Stages should arrive in the order {stages}"
+    assert names[-1] == "done", "Stream should end with the stored query"
+    
+    done = events[-1][1]
+    if done["result_type"] == "table":
+        result = next(data for name, data in events if name == "result")
+        rows = [row for name, data in events if name == "rows" for row in data["rows"]]
+        assert len(rows) == result["row_count"], "Row batches should add up to the row count"
+    
+    return done
+
+def test_batch_queries():
+    """Test 9: Batch Query API"""
+    response = requests.get(f"{BASE_URL}/datasets")
+    response.raise_for_status()
+    datasets = response.json()["items"]
+    
+    if not datasets:
+        raise Exception("No datasets available for testing queries")
+    
+    query_texts = [
+        "What is the total sales by category?",
+        "Show the first 5 rows as a table",
+        "How many rows are there?"
+    ]
+    response = requests.post(f"{BASE_URL}/query/batch", json={
+        "dataset_id": datasets[0]["id"],
+        "query_texts": query_texts
+    })
+    response.raise_for_status()
+    data = response.json()
+    
+    assert isinstance(data, list), "Response should be a list of queries"
+    assert [query["query_text"] for query in data] == query_texts, "Queries should come back in request order"
+    for query in data:
+        assert "result_type" in query, "Each query should have a result type"
+        print(f"{query['query_text']}: {query['result_type']}")
+    
+    return data
+
+def test_background_query_job():
+    """Test 10: Background Query Job API"""
+    response = requests.get(f"{BASE_URL}/datasets")
+    response.raise_for_status()
+    datasets = response.json()["items"]
+    
+    if not datasets:
+        raise Exception("No datasets available for testing queries")
+    
+    query_data = {
+        "dataset_id": datasets[0]["id"],
+        "query_text": "Show the first 5 rows as a table"
+    }
+    response = requests.post(f"{BASE_URL}/query", params={"wait": "false"}, json=query_data)
+    assert response.status_code == 202, f"Background query should be accepted, got {response.status_code}"
+    job_id = response.json()["job_id"]
+    
+    # Poll until the job finishes
+    for _ in range(60):
+        response = requests.get(f"{BASE_URL}/jobs/{job_id}")
+        response.raise_for_status()
+        status = response.json()["status"]
+        if status in ("done", "failed"):
+            break
+        time.sleep(1)
+    print(f"Job {job_id} finished with status {status}")
+    assert status in ("done", "failed"), "Job should finish within a minute"
+    
+    response = requests.get(f"{BASE_URL}/jobs/{job_id}/result")
+    assert response.status_code == 200, "Finished job should return its query"
+    data = response.json()
+    assert data["id"] == job_id, "Job id should be the query id"
+    
+    return data
+
+def test_sql_query():
+    """Test 11: Natural Language Query with the SQL engine"""
+    response = requests.get(f"{BASE_URL}/datasets")
+    response.raise_for_status()
+    datasets = response.json()["items"]
+    
+    if not datasets:
+        raise Exception("No datasets available for testing queries")
+    
+    query_data = {
+        "dataset_id": datasets[0]["id"],
+        "query_text": "What is the total sales by category?",
+        "engine": "sql"
+    }
+    response = requests.post(f"{BASE_URL}/query", json=query_data)
+    response.raise_for_status()
+    data = response.json()
+    
+    assert data["engine"] == "sql", "Query should record the SQL engine"
+    assert "result_type" in data, "Response should contain result type"
+    print(f"Generated SQL: {data['generated_code']}")
+    print(f"Result type: {data['result_type']}")
+    
+    return data
+
+def test_dataset_rows():
+    """Test 12: Dataset Row Paging API"""
+    response = requests.get(f"{BASE_URL}/datasets")
+    response.raise_for_status()
+    datasets = response.json()["items"]
+    
+    if not datasets:
+        raise Exception("No datasets available for testing row paging")
+    
+    dataset = datasets[0]
+    response = requests.get(f"{BASE_URL}/datasets/{dataset['id']}/rows", params={"offset": 0, "limit": 5})
+    response.raise_for_status()
+    page = response.json()
+    
+    assert page["columns"] == dataset["columns"], "Page should include the dataset's columns"
+    assert len(page["data"]) == min(5, dataset["row_count"]), "Page should hold at most limit rows"
+    assert page["total_rows"] == dataset["row_count"], "Unfiltered page should count every row"
+    
+    # Sorted descending by the first column, keeping only rows where it is set
+    column = dataset["columns"][0]
+    response = requests.get(f"{BASE_URL}/datasets/{dataset['id']}/rows", params={
+        "sort": column, "descending": "true", "filter": f"{column}:notnull", "limit": 5
+    })
+    response.raise_for_status()
+    page = response.json()
+    values = [row[0] for row in page["data"]]
+    assert values == sorted(values, reverse=True), "Rows should be sorted descending"
+    print(f"Top {column} values: {values}")
+    
+    response = requests.get(f"{BASE_URL}/datasets/{dataset['id']}/rows", params={"sort": "no_such_column"})
+    assert response.status_code == 400, "Sorting by an unknown column should be rejected"
+    
+    return page
+
+def test_metrics():
+    """Test 13: Prometheus Metrics Endpoint"""
+    response = requests.get(f"{BASE_URL}/metrics")
+    response.raise_for_status()
+    assert response.headers["Content-Type"].startswith("text/plain"), "Metrics should be Prometheus text"
+    
+    text = response.text
+    for name in ("askyourdata_query_stage_seconds", "askyourdata_cache_requests_total",
+                 "askyourdata_query_queue_depth", "askyourdata_active_executions"):
+        assert f"# TYPE {name}" in text, f"Metrics should include {name}"
+    print(f"Metrics exposition is {len(text)} bytes")
+    
+    return text
+
+def test_query_cost_sort():
+    """Test 14: Query Execution Profiles and Slow Query Log"""
+    response = requests.get(f"{BASE_URL}/datasets")
+    response.raise_for_status()
+    datasets = response.json()["items"]
+    
+    if not datasets:
+        raise Exception("No datasets available for testing query profiles")
+    
+    dataset_id = datasets[0]["id"]
+    response = requests.get(f"{BASE_URL}/queries/{dataset_id}", params={"sort": "wall_time"})
+    response.raise_for_status()
+    items = response.json()["items"]
+    
+    wall_times = [query["profile"]["wall_ms"] for query in items]
+    assert wall_times == sorted(wall_times, reverse=True), "Queries should be ordered by wall time"
+    print(f"{len(items)} profiled queries, slowest took {wall_times[0] if wall_times else 0:.1f} ms")
+    
+    response = requests.get(f"{BASE_URL}/queries/{dataset_id}", params={"sort": "bogus"})
+    assert response.status_code == 422, "Unknown sort orders should be rejected"
+    
+    response = requests.get(f"{BASE_URL}/slow-queries")
+    response.raise_for_status()
+    assert isinstance(response.json().get("items"), list), "Slow query log should be a list"
+    
+    return items
+
 def main():
     """Run all tests"""
     print(f"Starting backend API tests against {BASE_URL}")
@@ -318,6 +544,13 @@ def main():
         run_test("Natural Language Query - Table", test_natural_language_query_table)
         run_test("Natural Language Query - Chart", test_natural_language_query_chart)
         run_test("Get Queries", test_get_queries)
+        run_test("Streaming Query", test_streaming_query)
+        run_test("Batch Queries", test_batch_queries)
+        run_test("Background Query Job", test_background_query_job)
+        run_test("SQL Engine Query", test_sql_query)
+        run_test("Dataset Row Paging", test_dataset_rows)
+        run_test("Metrics", test_metrics)
+        run_test("Query Cost Sort", test_query_cost_sort)
     
     # Print summary
     print("\n" + "="*80)
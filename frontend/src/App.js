@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import "./App.css";
 import axios from "axios";
 
@@ -127,9 +127,72 @@ const DatasetInfo = ({ dataset }) => (
   </div>
 );
 
+const STAGE_LABELS = {
+  dataset_loaded: 'Data loaded...',
+  generating: 'Writing code...',
+  code: 'Code ready...',
+  preview: 'Running on all rows...',
+  executing: 'Running code...',
+  result: 'Receiving results...',
+  rows: 'Receiving results...'
+};
+
+// POST a query to the streaming endpoint (with a sample-based preview),
+// calling onEvent(event, data) for each server-sent event, and resolve with
+// the assembled query record
+const streamQuery = async (body, onEvent) => {
+  const response = await fetch(`${API}/query/stream?preview=true`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(body)
+  });
+  if (!response.ok || !response.body) {
+    throw new Error(`Query failed with status ${response.status}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let result = null;
+  let rows = [];
+  let query = null;
+
+  const handle = (event, data) => {
+    onEvent(event, data);
+    if (event === 'result') result = data;
+    else if (event === 'rows') rows = rows.concat(data.rows);
+    else if (event === 'done') query = data;
+    else if (event === 'error') throw new Error(data.detail);
+  };
+
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) >= 0) {
+      const message = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      const event = (message.match(/^event: (.*)$/m) || [])[1];
+      const data = (message.match(/^data: (.*)$/m) || [])[1];
+      if (event && data) handle(event, JSON.parse(data));
+    }
+  }
+
+  if (!query) throw new Error('Query stream ended early');
+  if (query.result_type === 'table') {
+    const { row_count, ...table } = result;
+    query.result_data = { ...table, data: rows };
+  } else if (query.result_type !== 'error') {
+    query.result_data = result;
+  }
+  return query;
+};
+
 const QueryInterface = ({ dataset, onQueryResult }) => {
   const [query, setQuery] = useState('');
   const [loading, setLoading] = useState(false);
+  const [stage, setStage] = useState(null);
   const [suggestions] = useState([
     "Show me the average values by category",
     "Which item has the highest value?",
@@ -144,19 +207,35 @@ const QueryInterface = ({ dataset, onQueryResult }) => {
     if (!query.trim()) return;
 
     setLoading(true);
+    // The preview and the full result share a key so one replaces the other
+    const key = `${Date.now()}-${Math.random()}`;
+    let code = '';
     try {
-      const response = await axios.post(`${API}/query`, {
-        dataset_id: dataset.id,
-        query_text: query
-      });
+      const result = await streamQuery(
+        { dataset_id: dataset.id, query_text: query },
+        (event, data) => {
+          setStage(STAGE_LABELS[event] || null);
+          if (event === 'code') code = data.code;
+          if (event === 'preview' && data.type !== 'error') {
+            onQueryResult({
+              key,
+              query_text: query,
+              generated_code: code,
+              result_type: data.type,
+              result_data: data
+            });
+          }
+        }
+      );
       
-      onQueryResult(response.data);
+      onQueryResult({ ...result, key });
       setQuery('');
     } catch (error) {
       console.error('Error processing query:', error);
       alert('Error processing query. Please try again.');
     } finally {
       setLoading(false);
+      setStage(null);
     }
   };
 
@@ -181,7 +260,7 @@ const QueryInterface = ({ dataset, onQueryResult }) => {
             {loading ? (
               <div className="button-loading">
                 <div className="mini-spinner"></div>
-                Analyzing...
+                {stage || 'Analyzing...'}
               </div>
             ) : (
               'Ask Question'
@@ -209,6 +288,54 @@ const QueryInterface = ({ dataset, onQueryResult }) => {
   );
 };
 
+const PLOTLY_SRC = "https://cdn.plot.ly/plotly-2.35.2.min.js";
+let plotlyLoading = null;
+
+// Plotly is several megabytes, so it is only fetched once a chart is shown
+const loadPlotly = () => {
+  if (window.Plotly) return Promise.resolve(window.Plotly);
+  if (!plotlyLoading) {
+    plotlyLoading = new Promise((resolve, reject) => {
+      const script = document.createElement("script");
+      script.src = PLOTLY_SRC;
+      script.charset = "utf-8";
+      script.async = true;
+      script.onload = () => resolve(window.Plotly);
+      script.onerror = () => {
+        plotlyLoading = null;
+        script.remove();
+        reject(new Error("Could not load Plotly"));
+      };
+      document.head.appendChild(script);
+    });
+  }
+  return plotlyLoading;
+};
+
+const PlotlyChart = ({ figure }) => {
+  const containerRef = useRef(null);
+
+  useEffect(() => {
+    const container = containerRef.current;
+    if (!container) return;
+    let cancelled = false;
+    let plotted = false;
+    loadPlotly()
+      .then(Plotly => {
+        if (cancelled) return;
+        Plotly.newPlot(container, figure.data, figure.layout, { responsive: true });
+        plotted = true;
+      })
+      .catch(error => console.error('Error loading chart library:', error));
+    return () => {
+      cancelled = true;
+      if (plotted) window.Plotly.purge(container);
+    };
+  }, [figure]);
+
+  return <div ref={containerRef} className="plotly-chart" />;
+};
+
 const QueryResult = ({ result }) => {
   if (!result) return null;
 
@@ -226,13 +353,24 @@ const QueryResult = ({ result }) => {
   }
 
   const { result_data } = result;
+  const preview = result_data.preview;
+  // Tables are columnar; results stored before that hold a list of records
+  const columns = result_data.type === 'table'
+    ? result_data.columns || Object.keys(result_data.data[0] || {})
+    : [];
+  const totalRows = result_data.total_rows ?? (result_data.data || []).length;
 
   return (
-    <div className="query-result success">
+    <div className={`query-result success ${preview ? 'preview' : ''}`}>
       <div className="result-header">
-        <h4>✅ Query Result</h4>
+        <h4>{preview ? '⏳ Preview' : '✅ Query Result'}</h4>
         <span className="result-type">{result.result_type}</span>
       </div>
+      {preview && (
+        <p className="preview-note">
+          Based on a sample of {preview.sample_rows.toLocaleString()} of {preview.total_rows.toLocaleString()} rows; the full result is on its way.
+        </p>
+      )}
       
       <div className="result-content">
         {result_data.type === 'table' && (
@@ -240,7 +378,7 @@ const QueryResult = ({ result }) => {
             <table>
               <thead>
                 <tr>
-                  {Object.keys(result_data.data[0] || {}).map((key, idx) => (
+                  {columns.map((key, idx) => (
                     <th key={idx}>{key}</th>
                   ))}
                 </tr>
@@ -248,28 +386,44 @@ const QueryResult = ({ result }) => {
               <tbody>
                 {result_data.data.slice(0, 50).map((row, idx) => (
                   <tr key={idx}>
-                    {Object.values(row).map((value, valueIdx) => (
+                    {(Array.isArray(row) ? row : columns.map((key) => row[key])).map((value, valueIdx) => (
                       <td key={valueIdx}>{String(value)}</td>
                     ))}
                   </tr>
                 ))}
               </tbody>
             </table>
-            {result_data.data.length > 50 && (
-              <p className="table-truncation">Showing first 50 rows of {result_data.data.length} total rows</p>
+            {totalRows > 50 && (
+              <p className="table-truncation">Showing first 50 rows of {totalRows.toLocaleString()} total rows</p>
             )}
           </div>
         )}
 
         {result_data.type === 'chart' && (
           <div className="chart-result">
-            <img src={`data:image/png;base64,${result_data.data}`} alt="Generated Chart" />
+            <img
+              src={result_data.url ? `${BACKEND_URL}${result_data.url}` : `data:image/png;base64,${result_data.data}`}
+              alt="Generated Chart"
+            />
+          </div>
+        )}
+
+        {result_data.type === 'plotly_json' && (
+          <div className="plotly-result">
+            <PlotlyChart figure={result_data.data} />
+            {result_data.decimated && (
+              <p className="table-truncation">Large traces were downsampled for display</p>
+            )}
           </div>
         )}
 
         {result_data.type === 'plotly' && (
           <div className="plotly-result">
-            <div dangerouslySetInnerHTML={{ __html: result_data.data }} />
+            {result_data.url ? (
+              <iframe src={`${BACKEND_URL}${result_data.url}`} title="Generated Chart" className="plotly-frame" />
+            ) : (
+              <div dangerouslySetInnerHTML={{ __html: result_data.data }} />
+            )}
           </div>
         )}
       </div>
@@ -284,6 +438,8 @@ const QueryResult = ({ result }) => {
 
 function App() {
   const [datasets, setDatasets] = useState([]);
+  const [datasetsCursor, setDatasetsCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [selectedDataset, setSelectedDataset] = useState(null);
   const [queryResults, setQueryResults] = useState([]);
   const [loading, setLoading] = useState(true);
@@ -295,9 +451,11 @@ function App() {
   const loadDatasets = async () => {
     try {
       const response = await axios.get(`${API}/datasets`);
-      setDatasets(response.data);
-      if (response.data.length > 0 && !selectedDataset) {
-        setSelectedDataset(response.data[0]);
+      const { items, next_cursor } = response.data;
+      setDatasets(items);
+      setDatasetsCursor(next_cursor || null);
+      if (items.length > 0 && !selectedDataset) {
+        setSelectedDataset(items[0]);
       }
     } catch (error) {
       console.error('Error loading datasets:', error);
@@ -306,6 +464,21 @@ function App() {
     }
   };
 
+  // The list is paged, newest first; older datasets load on request
+  const loadMoreDatasets = async () => {
+    setLoadingMore(true);
+    try {
+      const response = await axios.get(`${API}/datasets`, { params: { cursor: datasetsCursor } });
+      const { items, next_cursor } = response.data;
+      setDatasets(prev => [...prev, ...items]);
+      setDatasetsCursor(next_cursor || null);
+    } catch (error) {
+      console.error('Error loading datasets:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleDatasetUploaded = (dataset) => {
     setDatasets(prev => [dataset, ...prev]);
     setSelectedDataset(dataset);
@@ -313,7 +486,7 @@ function App() {
   };
 
   const handleQueryResult = (result) => {
-    setQueryResults(prev => [result, ...prev]);
+    setQueryResults(prev => [result, ...prev.filter(other => !result.key || other.key !== result.key)]);
   };
 
   if (loading) {
@@ -357,6 +530,11 @@ function App() {
                     <span>{dataset.row_count} rows</span>
                   </div>
                 ))}
+                {datasetsCursor && (
+                  <button className="load-more-button" onClick={loadMoreDatasets} disabled={loadingMore}>
+                    {loadingMore ? 'Loading...' : 'Load more datasets'}
+                  </button>
+                )}
                 <DatasetUpload onDatasetUploaded={handleDatasetUploaded} />
               </div>
             </div>
@@ -367,7 +545,7 @@ function App() {
               
               <div className="results-section">
                 {queryResults.map((result, idx) => (
-                  <QueryResult key={idx} result={result} />
+                  <QueryResult key={result.key || idx} result={result} />
                 ))}
               </div>
             </div>
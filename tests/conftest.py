@@ -0,0 +1,12 @@
+"""Offline test setup: server.py imported against the benchmark suite's
+in-memory MongoDB and fake LLM, so no deployment or API key is needed"""
+import pytest
+
+import backend_benchmark
+
+
+@pytest.fixture(scope='session')
+def server():
+    if backend_benchmark.server is None:
+        backend_benchmark.setup_backend()
+    return backend_benchmark.server
@@ -0,0 +1,56 @@
+import asyncio
+import io
+
+import orjson
+import pandas as pd
+
+
+def test_lookups_are_counted_once(server):
+    cache = server.dataframe_cache
+
+    async def scenario():
+        csv = pd.DataFrame({'a': range(10), 'b': range(10)}).to_csv(index=False).encode()
+        dataset = await server.upload_dataset(server.UploadFile(file=io.BytesIO(csv), filename='stats.csv'))
+        counts = []
+        try:
+            # A projected load of an uncached dataset is one miss
+            before = (cache.hits, cache.misses)
+            await server.load_dataframe(dataset, ['a'])
+            counts.append((cache.hits - before[0], cache.misses - before[1]))
+
+            # A plain row page only checks whether the dataset is cached
+            before = (cache.hits, cache.misses)
+            response = await server.get_dataset_rows(dataset.id, offset=0, limit=5, sort=None,
+                                                     descending=False, filter=[])
+            assert orjson.loads(response.body)['total_rows'] == 10
+            counts.append((cache.hits - before[0], cache.misses - before[1]))
+
+            # A cached full frame serves a projection as one hit
+            await server.load_dataframe(dataset)
+            before = (cache.hits, cache.misses)
+            await server.load_dataframe(dataset, ['b'])
+            counts.append((cache.hits - before[0], cache.misses - before[1]))
+        finally:
+            await server.delete_dataset(dataset.id)
+        return counts
+
+    assert asyncio.run(scenario()) == [(0, 1), (0, 0), (1, 0)]
+
+
+def test_query_results_have_their_own_cache(server):
+    async def scenario():
+        result = server.sandbox.table_result(pd.DataFrame({'k': [3, 1, 2]}))
+        query = server.Query(dataset_id='none', query_text='k', generated_code='', result_type='table',
+                             result_data=result)
+        await server.db.queries.insert_one(query.dict())
+        before = server.dataframe_cache.stats()
+        for _ in range(2):
+            await server.get_query_rows(query.id, offset=0, limit=5, sort='k', descending=False, filter=[])
+        after = server.dataframe_cache.stats()
+        stats = await server.get_cache_stats()
+        await server.db.queries.delete_one({'id': query.id})
+        return before, after, stats
+
+    before, after, stats = asyncio.run(scenario())
+    assert (after['hits'], after['misses']) == (before['hits'], before['misses'])
+    assert stats['query_results']['hits'] >= 1
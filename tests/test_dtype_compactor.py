@@ -0,0 +1,58 @@
+import asyncio
+
+import pandas as pd
+import pyarrow as pa
+
+
+def test_integers_stay_64_bit(server):
+    compactor = server.DtypeCompactor()
+    df = compactor.apply(pd.DataFrame({
+        'product': ['a', 'b'],
+        'price': [100, 120],
+        'quantity': [50.0, 90.0]
+    }))
+
+    assert compactor.dtypes['price'] == 'int64'
+    assert compactor.dtypes['quantity'] == 'Int64'
+    revenue = (df['price'] * df['quantity']).tolist()
+    assert revenue == [5000, 10800]
+
+
+def test_date_columns_stay_dates_across_chunks(server):
+    compactor = server.DtypeCompactor()
+    first = compactor.apply(pd.DataFrame({'ordered': ['2024-01-05', '2024-02-10']}))
+    later = compactor.apply(pd.DataFrame({'ordered': ['2024-03-15', 'unknown', None]}))
+
+    assert compactor.dtypes['ordered'] == 'datetime64[ns]'
+    assert later['ordered'].dtype == first['ordered'].dtype
+    assert later['ordered'].tolist()[0] == pd.Timestamp('2024-03-15')
+    assert later['ordered'].isna().tolist() == [False, True, True]
+
+
+def test_downcast_datasets_are_widened_on_load(server):
+    # Datasets ingested before ints stayed 64-bit recorded narrow dtypes
+    df = pd.DataFrame({'price': pd.Series([100, 120], dtype='int8'),
+                       'quantity': pd.Series([50, None], dtype='Int8')})
+    df = server.DtypeCompactor.restore(df, {'price': 'int8', 'quantity': 'Int8'})
+
+    assert str(df['price'].dtype) == 'int64'
+    assert str(df['quantity'].dtype) == 'Int64'
+    assert (df['price'] * 1000).tolist() == [100000, 120000]
+    assert server.DtypeCompactor.execution_dtypes({'price': 'int16'}) == {'price': 'int64'}
+
+
+def test_stored_dataset_loads_with_wide_ints(server):
+    async def round_trip():
+        chunk = pd.DataFrame({'price': pd.Series([100, 120], dtype='int8')})
+        writer = server.dataset_store.open_writer('dtype-test')
+        await writer.write(chunk)
+        await writer.commit(None, {'price': 'int8'})
+        try:
+            return (await server.dataset_store.load('dtype-test'),
+                    await server.dataset_store.load_table('dtype-test'))
+        finally:
+            await server.dataset_store.release('dtype-test')
+
+    df, table = asyncio.run(round_trip())
+    assert str(df['price'].dtype) == 'int64'
+    assert table.schema.field('price').type == pa.int64()
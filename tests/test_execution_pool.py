@@ -0,0 +1,65 @@
+import asyncio
+import shutil
+import tempfile
+from types import SimpleNamespace
+
+import pandas as pd
+
+
+def test_cancelled_job_releases_its_frame(server, tmp_path):
+    async def scenario():
+        pool = server.ExecutionPool(frame_dir=str(tmp_path))
+        pool._idle = asyncio.Queue()  # No worker ever becomes free
+        df = pd.DataFrame({'a': [1, 2, 3]})
+        jobs = [asyncio.create_task(pool.run('result = None', df, key)) for key in (None, ('ds', 1))]
+        while len(list(tmp_path.iterdir())) < 2:
+            await asyncio.sleep(0.01)
+        for job in jobs:
+            job.cancel()
+        await asyncio.gather(*jobs, return_exceptions=True)
+        leftover = {path.name for path in tmp_path.iterdir()}
+        await pool.shutdown()
+        return pool, leftover
+
+    pool, leftover = asyncio.run(scenario())
+    # Only the cached dataset frame is left, and shutdown removes it
+    assert len(leftover) == 1
+    assert pool.active == 0 and not pool._frames_in_use
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_frames_fall_back_to_the_temp_directory_when_short_of_space(server, tmp_path, monkeypatch):
+    shm, temp = tmp_path / 'shm', tmp_path / 'temp'
+    shm.mkdir()
+    temp.mkdir()
+    monkeypatch.setattr(tempfile, 'tempdir', str(temp))
+    monkeypatch.setattr(shutil, 'disk_usage', lambda path: SimpleNamespace(total=1, used=1, free=0))
+    pool = server.ExecutionPool(frame_dir=str(shm))
+
+    path = asyncio.run(pool._write(pd.DataFrame({'a': range(1000)})))
+    assert path.startswith(str(temp))
+    assert pd.read_feather(path)['a'].sum() == sum(range(1000))
+
+
+def test_failed_worker_spawns_are_retried(server, monkeypatch):
+    attempts = []
+
+    async def spawn():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise RuntimeError("Execution worker failed to start")
+        return 'replacement'
+
+    async def scenario():
+        pool = server.ExecutionPool()
+        pool._idle = asyncio.Queue()
+        monkeypatch.setattr(pool, 'RESPAWN_DELAY_SECONDS', 0.01)
+        monkeypatch.setattr(pool, '_spawn', spawn)
+        pool._schedule_replace(SimpleNamespace(kill=lambda: None))
+        worker = await asyncio.wait_for(pool._idle.get(), 5)
+        await asyncio.sleep(0)
+        return worker, pool._replacements
+
+    worker, replacements = asyncio.run(scenario())
+    assert worker == 'replacement' and len(attempts) == 3
+    assert not replacements
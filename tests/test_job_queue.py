@@ -0,0 +1,52 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+
+def test_fail_abandoned_spares_live_jobs(server):
+    now = datetime.utcnow()
+    old = now - timedelta(minutes=10)
+
+    async def scenario():
+        queue = server.QueryJobQueue(stale_seconds=60)
+        documents = {
+            'live': {'status': 'running', 'owner': 'other-instance', 'heartbeat_at': now, 'created_at': old},
+            'stale': {'status': 'queued', 'owner': 'gone-instance', 'heartbeat_at': old, 'created_at': old},
+            'legacy': {'status': 'running', 'created_at': old},
+            'new_legacy': {'status': 'queued', 'created_at': now}
+        }
+        await server.db.queries.insert_many([{'id': f'job-{name}', **doc} for name, doc in documents.items()])
+        await queue.fail_abandoned()
+        statuses = {doc['id'][len('job-'):]: doc['status']
+                    async for doc in server.db.queries.find({'id': {'$regex': '^job-'}})}
+        await server.db.queries.delete_many({'id': {'$regex': '^job-'}})
+        return statuses
+
+    assert asyncio.run(scenario()) == {
+        'live': 'running', 'stale': 'failed', 'legacy': 'failed', 'new_legacy': 'queued'
+    }
+
+
+def test_burst_of_submissions_never_overfills_the_queue(server, monkeypatch):
+    queries = server.db.queries
+
+    async def insert_one(document):
+        await asyncio.sleep(0.01)  # A database round trip lets the other submitters run
+        return await queries.insert_one(document)
+
+    monkeypatch.setattr(server, 'db', SimpleNamespace(queries=SimpleNamespace(insert_one=insert_one)))
+
+    async def scenario():
+        queue = server.QueryJobQueue(max_depth=2)
+        queue._queue = asyncio.Queue(maxsize=2)  # No workers, so nothing is taken off
+        request = server.QueryRequest(dataset_id='burst-dataset', query_text='average price')
+        outcomes = await asyncio.gather(*[queue.submit(request, background=True) for _ in range(5)],
+                                        return_exceptions=True)
+        placeholders = await queries.count_documents({'dataset_id': 'burst-dataset'})
+        await queries.delete_many({'dataset_id': 'burst-dataset'})
+        return outcomes, placeholders
+
+    outcomes, placeholders = asyncio.run(scenario())
+    assert sum(isinstance(outcome, server.QueryJob) for outcome in outcomes) == 2
+    assert [outcome.status_code for outcome in outcomes if isinstance(outcome, Exception)] == [429] * 3
+    assert placeholders == 2
@@ -0,0 +1,94 @@
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({
+        'product': ['a', 'b', 'c', 'd'],
+        'region': ['north', 'south', 'north', 'south'],
+        'price': [100, 120, 80, 150],
+        'total_sales': [5, 9, 2, 7],
+        'in_stock': [True, False, True, True]
+    })
+
+
+def run(code, df):
+    namespace = {'df': df, 'pd': pd}
+    exec(code, namespace)
+    return pd.DataFrame(namespace['result']['data'])
+
+
+@pytest.mark.parametrize('question', [
+    'average price by region and product',  # more than one grouping
+    'plot price by region',                  # asks for a chart
+    'average colour by region',              # no such column
+    'sum of product',                        # not numeric
+    'top 3 products by region',              # top-N over text
+    'average sales by region',               # "sales" is not a column name
+    'rows where price is roughly 100',       # condition not understood
+    'top 2 regions by price',                # ranks groups, not rows
+    'top 2 products by price',               # products may repeat across rows
+    'top 2 customers by price',              # not a column and not rows
+    'why are prices higher in the south',
+])
+def test_matcher_leaves_unclear_questions_to_the_llm(server, df, question):
+    assert server.QueryIntentMatcher().match(question, df) is None
+
+
+def test_matcher_rejects_columns_that_resolve_ambiguously(server):
+    df = pd.DataFrame({'total_sales': [1, 2], 'Total Sales': [3, 4], 'region': ['x', 'y']})
+    assert server.QueryIntentMatcher().match('sum of total sales by region', df) is None
+
+
+def test_matcher_compiles_simple_questions(server, df):
+    matcher = server.QueryIntentMatcher()
+
+    grouped = run(matcher.match('What is the average price by region?', df), df)
+    assert grouped.to_dict('records') == [{'region': 'south', 'price': 135.0},
+                                          {'region': 'north', 'price': 90.0}]
+    top = run(matcher.match('top 2 rows by price', df), df)
+    assert top['product'].tolist() == ['d', 'b']
+    bottom = run(matcher.match('lowest 1 by price', df), df)
+    assert bottom['product'].tolist() == ['c']
+    count = run(matcher.match('how many rows where price > 90', df), df)
+    assert count['count'].tolist() == [3]
+    in_stock = run(matcher.match('rows where not in_stock', df), df)
+    assert in_stock['product'].tolist() == ['b']
+
+
+def test_matcher_splits_conditions_at_standalone_operators(server):
+    df = pd.DataFrame({'discount': [2, 8, 6], 'overtime': [1, 0, 3], 'price is': [5, 6, 7]})
+    matcher = server.QueryIntentMatcher()
+
+    discounted = run(matcher.match('how many rows where discount > 5', df), df)
+    assert discounted['count'].tolist() == [2]
+    overtime = run(matcher.match('rows where overtime is at least 1', df), df)
+    assert overtime['discount'].tolist() == [2, 6]
+    # The first "is" is part of the column name, so the second one is tried
+    priced = run(matcher.match('rows where price is is 6', df), df)
+    assert priced['discount'].tolist() == [8]
+
+
+@pytest.mark.parametrize('code', [
+    "result = {'type': 'table', 'data': df.describe()}",
+    "result = {'type': 'table', 'data': [{'rows': df.shape[0]}]}",
+    "result = {'type': 'table', 'data': eval(\"df['price']\").to_frame()}",
+    "result = {'type': 'table', 'data': df.head()}",
+    "result = {'type': 'table', 'data': df.iloc[:, 0].to_frame()}",
+    "column = 'pri' + 'ce'\nresult = {'type': 'table', 'data': df[column].to_frame()}",
+])
+def test_analyzer_loads_every_column_when_unsure(server, df, code):
+    assert server.ColumnUsageAnalyzer().referenced_columns(code, list(df.columns)) is None
+
+
+@pytest.mark.parametrize('code, columns', [
+    ("result = {'type': 'table', 'data': df.groupby('region')['price'].mean().reset_index()}",
+     ['region', 'price']),
+    ("result = {'type': 'table', 'data': df[df['in_stock']][['product', 'price']]}",
+     ['product', 'price', 'in_stock']),
+    ("result = {'type': 'table', 'data': [{'n': len(df), 'top': df.price.max()}]}", ['price']),
+])
+def test_analyzer_finds_the_columns_code_reads(server, df, code, columns):
+    found = server.ColumnUsageAnalyzer().referenced_columns(code, list(df.columns))
+    assert sorted(found) == sorted(columns)
@@ -0,0 +1,27 @@
+import asyncio
+import io
+
+import orjson
+import pandas as pd
+
+
+def test_truncated_result_pages_all_rows(server):
+    async def scenario():
+        csv = pd.DataFrame({'k': range(0, 50, 2)}).to_csv(index=False).encode()
+        dataset = await server.upload_dataset(server.UploadFile(file=io.BytesIO(csv), filename='rows.csv'))
+        # A stored result cut down to its first 10 of 25 rows
+        kept = server.sandbox.table_result(pd.DataFrame({'k': range(0, 20, 2)}))
+        kept.update(total_rows=25, truncated=True)
+        query = server.Query(dataset_id=dataset.id, query_text='all k', generated_code='SELECT k FROM data',
+                             engine='sql', result_type='table', result_data=kept)
+        await server.db.queries.insert_one(query.dict())
+        try:
+            response = await server.get_query_rows(query.id, offset=0, limit=5, sort='k',
+                                                   descending=True, filter=[])
+            return orjson.loads(response.body)
+        finally:
+            await server.delete_dataset(dataset.id)
+
+    page = asyncio.run(scenario())
+    assert page['total_rows'] == 25
+    assert [row[0] for row in page['data']] == [48, 46, 44, 42, 40]
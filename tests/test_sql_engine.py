@@ -0,0 +1,37 @@
+import asyncio
+
+import pyarrow as pa
+
+
+def run_sql(server, sql, table):
+    return asyncio.run(server.sql_engine.execute(sql, table))
+
+
+def test_sql_profile_leaves_peak_memory_unmeasured(server):
+    result = run_sql(server, 'SELECT SUM(x) AS total FROM data', pa.table({'x': list(range(100))}))
+
+    assert result['type'] == 'table'
+    assert result['profile']['wall_ms'] >= 0
+    assert result['profile']['peak_memory_bytes'] is None
+
+
+def test_integer_sums_stay_integers(server):
+    result = run_sql(server, 'SELECT SUM(sales) AS total, AVG(sales) AS mean FROM data',
+                     pa.table({'sales': [1, 3]}))
+
+    assert result['data'] == [[4, 2.0]]
+    assert result['dtypes'] == ['int64', 'float64']
+
+
+def test_queries_share_one_database_but_not_their_data(server):
+    async def both():
+        return await asyncio.gather(
+            server.sql_engine.execute('SELECT SUM(x) AS total FROM data', pa.table({'x': [1, 2]})),
+            server.sql_engine.execute('SELECT SUM(x) AS total FROM data', pa.table({'x': [10, 20]}))
+        )
+
+    first, second = asyncio.run(both())
+    assert (first['data'], second['data']) == ([[3]], [[30]])
+    assert run_sql(server, "SELECT current_setting('threads') AS threads", pa.table({'x': [1]}))['data'] == [
+        [server.sql_engine.config['threads']]
+    ]
@@ -0,0 +1,26 @@
+import asyncio
+import io
+import json
+
+
+def test_json_upload_with_nested_fields(server):
+    records = [
+        {'id': 1, 'tags': ['a', 'b'], 'address': {'city': 'Oslo'}},
+        {'id': 2, 'tags': ['a', 'b'], 'address': {'city': 'Rome'}},
+        {'id': 3, 'tags': [], 'address': None}
+    ]
+
+    async def scenario():
+        file = server.UploadFile(file=io.BytesIO(json.dumps(records).encode()), filename='nested.json')
+        dataset = await server.upload_dataset(file)
+        try:
+            return dataset, await server.load_profile(dataset)
+        finally:
+            await server.delete_dataset(dataset.id)
+
+    dataset, profile = asyncio.run(scenario())
+    assert dataset.row_count == 3
+    tags = profile['columns']['tags']
+    assert tags['top_values'][0] == {'value': '["a", "b"]', 'count': 2}
+    assert tags['distinct_estimate'] == 2
+    assert profile['columns']['address']['null_count'] == 1